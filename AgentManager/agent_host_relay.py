@@ -0,0 +1,55 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+from fastapi import FastAPI, Request
+import requests
+import uvicorn
+
+# 在每台 Agent Host 上執行，把 Controller 送來的 /servicechange/batch 分送給本機上的每個Agent
+# python agent_host_relay.py [port]
+# e.g. python agent_host_relay.py 8890
+
+port = int(sys.argv[1]) if len(sys.argv) > 1 else 8890
+
+# 單一Agent的 /servicechange 等待時間
+timeout = 2
+
+log_dir = "logs"
+if not os.path.exists(log_dir):
+    os.makedirs(log_dir)
+
+logging.basicConfig(filename=os.path.join(log_dir, "AgentHostRelay.log"),
+                    format='%(asctime)s %(levelname)s: %(message)s',
+                    level=logging.INFO)
+
+app = FastAPI()
+
+def forward_change(change: dict):
+    '''
+    change : {"agentPort": 8001, "servicename": "pose", "ip": "10.52.52.126", "port": 30501, "frequency": 15}
+    ip = "null" and port = 0 mean the agent keeps its current service
+    '''
+    body = {key: value for key, value in change.items() if key != "agentPort"}
+    url = f"http://127.0.0.1:{change['agentPort']}/servicechange"
+    try:
+        response = requests.post(url, data=json.dumps(body), timeout=timeout)
+        logging.info(f"forward to Agent {change['agentPort']}, body = {body}, status code {response.status_code}")
+        return {"agentPort": change['agentPort'], "statusCode": response.status_code, "error": None}
+    except requests.exceptions.RequestException as e:
+        logging.warning(f"forward to Agent {change['agentPort']} failed: {e}")
+        return {"agentPort": change['agentPort'], "statusCode": None, "error": str(e)}
+
+@app.post("/servicechange/batch")
+async def servicechange_batch(request: Request):
+    data = await request.json()
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *(loop.run_in_executor(None, forward_change, change) for change in data["changes"])
+    )
+    return {"results": list(results)}
+
+if __name__ == "__main__":
+    logging.info("Agent host relay started on 0.0.0.0:" + str(port))
+    uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,128 @@
+import json
+import logging
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Optional
+
+LOG_FORMAT = '%(asctime)s %(levelname)s: %(message)s'
+
+
+def start_logging(log_file: str, level: int = logging.INFO) -> QueueListener:
+    """
+    Send the records of the root logger through a queue to a thread that
+    writes them to log_file, so logging never waits for file I/O.
+    Stop the returned listener on shutdown to flush the queue.
+    """
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+class _BodyTee:
+    """First limit bytes of a body that is streamed in chunks."""
+
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._chunk_list = []
+        self._size = 0
+        self.truncated = False
+
+    def add(self, chunk: bytes):
+        if not chunk:
+            return
+        room = self._limit - self._size
+        if room <= 0:
+            self.truncated = True
+            return
+        if len(chunk) > room:
+            chunk = chunk[:room]
+            self.truncated = True
+        self._chunk_list.append(chunk)
+        self._size += len(chunk)
+
+    def text(self) -> Optional[str]:
+        if not self._chunk_list:
+            return None
+        return b"".join(self._chunk_list).decode("utf-8", errors="replace")
+
+
+class AccessLogMiddleware:
+    """
+    ASGI middleware that writes one JSON line per HTTP request to the
+    "controller.access" logger: path, method, client IP, status code,
+    duration and the first body_limit bytes of the request and response
+    bodies.
+
+    The bodies are copied while they stream through, the response is
+    passed on as the handler produced it. sample_rate of the successful
+    requests are logged, responses with status 400 or more always are.
+    An exception of the handler is answered with 500 {"error": ...}.
+    """
+
+    def __init__(self, app, sample_rate: float = 1.0, body_limit: int = 1024,
+                 sampler: Callable[[], float] = random.random):
+        self.app = app
+        self._sample_rate = sample_rate
+        self._body_limit = body_limit
+        self._sampler = sampler
+        self._logger = logging.getLogger("controller.access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        request_body = _BodyTee(self._body_limit)
+        response_body = _BodyTee(self._body_limit)
+        response = {"statusCode": None}
+
+        async def tee_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                request_body.add(message.get("body", b""))
+            return message
+
+        async def tee_send(message):
+            if message["type"] == "http.response.start":
+                response["statusCode"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response_body.add(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, tee_receive, tee_send)
+        except Exception as e:
+            if response["statusCode"] is not None:
+                raise
+            body = json.dumps({"error": str(e)}).encode("utf-8")
+            await tee_send({
+                "type": "http.response.start",
+                "status": 500,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            })
+            await tee_send({"type": "http.response.body", "body": body})
+            logging.exception(f"{scope['path']} failed")
+        finally:
+            statusCode = response["statusCode"] or 500
+            if statusCode >= 400 or self._sampler() < self._sample_rate:
+                client = scope.get("client")
+                self._logger.info(json.dumps({
+                    "api": scope["path"],
+                    "method": scope["method"],
+                    "clientIp": client[0] if client else None,
+                    "statusCode": statusCode,
+                    "durationMs": round((time.perf_counter() - start) * 1000, 3),
+                    "request": request_body.text(),
+                    "requestTruncated": request_body.truncated,
+                    "response": response_body.text(),
+                    "responseTruncated": response_body.truncated,
+                }))
@@ -0,0 +1,224 @@
+import asyncio
+import json
+import logging
+from typing import List, Optional
+
+import httpx
+
+from .config import (
+    AGENT_NOTIFY_CONCURRENCY,
+    AGENT_NOTIFY_TIMEOUT,
+    AGENT_NOTIFY_RETRIES,
+    AGENT_NOTIFY_BACKOFF,
+    AGENT_BATCH_PORT,
+)
+
+
+class AgentNotifier:
+    """
+    Sends /servicechange requests to the agents concurrently over one pooled
+    httpx.AsyncClient, with a bound on the requests in flight, a timeout per
+    request and retries with exponential backoff.
+
+    The configuration (service IP, service port, frequency) each agent acked
+    last is remembered per (agentIP, agentPort, serviceType), and
+    notifications that would not change it are suppressed.
+
+    Notifications for several agents on the same agent host are sent as one
+    POST /servicechange/batch to the relay listening on batch_port of that
+    host:
+
+        {"changes": [{"agentPort": 8001, "servicename": "pose", "ip": ..., "port": ..., "frequency": ...}, ...]}
+
+    which answers with the result of every change, in order:
+
+        {"results": [{"agentPort": 8001, "statusCode": 200, "error": null}, ...]}
+
+    Hosts without a relay get one /servicechange per agent.
+    """
+
+    def __init__(self, concurrency: int = AGENT_NOTIFY_CONCURRENCY, timeout: float = AGENT_NOTIFY_TIMEOUT,
+                 retries: int = AGENT_NOTIFY_RETRIES, backoff: float = AGENT_NOTIFY_BACKOFF,
+                 batch_port: Optional[int] = AGENT_BATCH_PORT,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._batch_port = batch_port
+        # None 表示真的連線，測試時傳入 httpx.MockTransport
+        self._transport = transport
+        self._unbatched_hosts = set()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._agentConfig_dict = {}
+        self._stats = {
+            "sent": 0,
+            "acked": 0,
+            "failed": 0,
+            "retried": 0,
+            "suppressed": 0,
+            "batches": 0,
+            "batchFallbacks": 0,
+        }
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self._timeout,
+                transport=self._transport,
+                limits=httpx.Limits(
+                    max_connections=self._concurrency,
+                    max_keepalive_connections=self._concurrency,
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+
+    async def _post(self, url: str, body: dict) -> tuple:
+        """POST body to url, retrying on connection errors and 5xx. Returns (response, attempts, error)."""
+        await self.start()
+        response = None
+        error = None
+        attempts = 0
+        async with self._semaphore:
+            for attempt in range(self._retries + 1):
+                if attempt > 0:
+                    self._stats["retried"] += 1
+                    await asyncio.sleep(self._backoff * 2 ** (attempt - 1))
+                attempts = attempt + 1
+                try:
+                    response = await self._client.post(url, content=json.dumps(body))
+                    error = None
+                    if response.status_code < 500:
+                        break
+                except httpx.HTTPError as e:
+                    response = None
+                    error = str(e) or type(e).__name__
+        return response, attempts, error
+
+    def _record(self, body: dict, result: dict) -> dict:
+        self._stats["sent"] += 1
+        result["acked"] = result["statusCode"] is not None and 200 <= result["statusCode"] < 300
+        if result["acked"]:
+            self._stats["acked"] += 1
+            logging.info(f"communicate with Agent {result['agentIP']} {result['agentPort']}, body = {body}")
+        else:
+            self._stats["failed"] += 1
+            logging.warning(
+                f"Agent {result['agentIP']} {result['agentPort']} did not ack {body}: "
+                f"status code {result['statusCode']}, error {result['error']}"
+            )
+        return result
+
+    async def send(self, body: dict, agent_ip: str, agent_port: int) -> dict:
+        response, attempts, error = await self._post(f"http://{agent_ip}:{agent_port}/servicechange", body)
+        return self._record(body, {
+            "agentIP": agent_ip,
+            "agentPort": agent_port,
+            "acked": False,
+            "statusCode": None if response is None else response.status_code,
+            "attempts": attempts,
+            "error": error,
+        })
+
+    async def send_batch(self, agent_ip: str, change_list: List[tuple]) -> List[dict]:
+        """
+        Send every (body, agentPort) of change_list to the relay on agent_ip in
+        one request. Falls back to one request per agent if the host has no
+        relay or the relay did not answer.
+        """
+        response, attempts, error = await self._post(
+            f"http://{agent_ip}:{self._batch_port}/servicechange/batch",
+            {"changes": [dict(body, agentPort=agent_port) for body, agent_port in change_list]},
+        )
+        self._stats["batches"] += 1
+        result_list = None
+        if response is not None and response.status_code == 200:
+            try:
+                result_list = response.json()["results"]
+            except (ValueError, KeyError, TypeError):
+                result_list = None
+        if result_list is None or len(result_list) != len(change_list):
+            if response is None or response.status_code in (404, 405):
+                # nothing listens on the batch port of this host, stop trying
+                self._unbatched_hosts.add(agent_ip)
+            self._stats["batchFallbacks"] += 1
+            logging.warning(
+                f"Batched servicechange to {agent_ip} failed: status code "
+                f"{None if response is None else response.status_code}, error {error}, sending one by one"
+            )
+            return list(await asyncio.gather(
+                *(self.send(body, agent_ip, agent_port) for body, agent_port in change_list)
+            ))
+        return [
+            self._record(body, {
+                "agentIP": agent_ip,
+                "agentPort": agent_port,
+                "acked": False,
+                "statusCode": result.get("statusCode"),
+                "attempts": attempts,
+                "error": result.get("error"),
+            })
+            for (body, agent_port), result in zip(change_list, result_list)
+        ]
+
+    async def _notify_host(self, agent_ip: str, pending_list: List[tuple]) -> List[dict]:
+        if self._batch_port is None or len(pending_list) == 1 or agent_ip in self._unbatched_hosts:
+            return list(await asyncio.gather(
+                *(self.send(body, agent_ip, agent_port) for _, _, body, agent_port in pending_list)
+            ))
+        return await self.send_batch(agent_ip, [(body, agent_port) for _, _, body, agent_port in pending_list])
+
+    @staticmethod
+    def _agent_key(agent_ip: str, agent_port: int, serviceType: str) -> tuple:
+        return (str(agent_ip), int(agent_port), serviceType)
+
+    def remember(self, agent_ip: str, agent_port: int, serviceType: str, agentConfig: tuple):
+        """Record a configuration the agent got without a notification, e.g. in the /subscribe response."""
+        self._agentConfig_dict[self._agent_key(agent_ip, agent_port, serviceType)] = agentConfig
+
+    def forget(self, agent_ip: str, agent_port: int, serviceType: str):
+        self._agentConfig_dict.pop(self._agent_key(agent_ip, agent_port, serviceType), None)
+
+    async def notify(self, notification_list: List[tuple]) -> dict:
+        """
+        Send every (body, agentIP, agentPort, agentConfig) of notification_list
+        whose agentConfig differs from the one the agent has, grouped by agent
+        host, and report which agents acked.
+        """
+        pending_dict = {}
+        suppressed = 0
+        for body, agent_ip, agent_port, agentConfig in notification_list:
+            key = self._agent_key(agent_ip, agent_port, body['servicename'])
+            if self._agentConfig_dict.get(key) == agentConfig:
+                suppressed += 1
+                continue
+            pending_dict.setdefault(str(agent_ip), []).append((key, agentConfig, body, int(agent_port)))
+        self._stats["suppressed"] += suppressed
+
+        host_results = await asyncio.gather(
+            *(self._notify_host(agent_ip, pending_list) for agent_ip, pending_list in pending_dict.items())
+        )
+        results = []
+        for pending_list, result_list in zip(pending_dict.values(), host_results):
+            for (key, agentConfig, _, _), result in zip(pending_list, result_list):
+                if result["acked"]:
+                    self._agentConfig_dict[key] = agentConfig
+                results.append(result)
+        return {
+            "acked": [result for result in results if result["acked"]],
+            "failed": [result for result in results if not result["acked"]],
+            "suppressed": suppressed,
+        }
+
+    def metrics(self) -> dict:
+        return dict(self._stats)
+
+
+agent_notifier = AgentNotifier()
@@ -0,0 +1,66 @@
+"""
+Compare the running time of optimize() and waterfill() against optimize_sorted().
+
+    python benchmarks/bench_optimizer.py --agents 10000 --instances 500
+"""
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import optimizer  # noqa: E402
+
+
+def make_servicelist(instances: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    servicelist = []
+    for i in range(instances):
+        servicelist.append({
+            "podIP": f"10.244.{i // 250}.{i % 250}",
+            "hostPort": 30500 + i % 500,
+            "serviceType": "pose",
+            "currentConnection": 0,
+            "nodeName": f"workergpu{i % 50}",
+            "hostIP": f"10.52.52.{i % 50}",
+            "frequencyLimit": [20, 10],
+            "currentFrequency": 20,
+            "workloadLimit": rng.choice([70, 85, 170, 255]) / rng.choice([1, 2, 3]),
+        })
+    return servicelist
+
+
+def measure(function, servicetype: str, agentcount: int, servicelist: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        data = copy.deepcopy(servicelist)
+        start = time.perf_counter()
+        function(servicetype, agentcount, data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agents", type=int, default=10000)
+    parser.add_argument("--instances", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    servicelist = make_servicelist(args.instances)
+    functions = (optimizer.optimize_sorted, optimizer.optimize, optimizer.waterfill)
+    expected = optimizer.optimize_sorted("pose", args.agents, copy.deepcopy(servicelist))
+    for function in functions[1:]:
+        if function("pose", args.agents, copy.deepcopy(servicelist)) != expected:
+            raise SystemExit(f"{function.__name__}() and optimize_sorted() disagree")
+
+    for function in functions:
+        seconds = measure(function, "pose", args.agents, servicelist, args.repeat)
+        print(f"{function.__name__:16s} {args.agents} agents x {args.instances} instances: {seconds * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Compare the running time and the allocation quality of the optimizer
+strategies on synthetic service lists.
+
+    python benchmarks/bench_strategies.py --nodes 100 --agents 100 1000 10000 --output strategies.json
+    python benchmarks/bench_strategies.py --strategies optimize waterfill uniform most_remaining
+
+Every node runs a random subset of the service types and splits its
+workAbility between them, so the instances of a type have different
+workloadLimits. The agents are split evenly between the service types and
+every strategy places them on a copy of the same service list, one call
+per type. Reported per strategy and agent count: the best time of --repeat
+runs, the agents placed per second, the statuses and
+metrics.allocation_quality() of the result.
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import optimizer  # noqa: E402
+from metrics import allocation_quality  # noqa: E402
+
+# serviceType, frequencyLimit, workAbility choices
+SERVICE_TYPES = (
+    ("pose", [20, 10], (70, 85)),
+    ("gesture", [30, 15], (170, 255)),
+    ("object", [8, 4], (40, 60)),
+)
+
+
+def make_servicelist(nodes: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    servicelist = []
+    for node in range(nodes):
+        serviceType_list = rng.sample(SERVICE_TYPES, rng.randint(1, len(SERVICE_TYPES)))
+        for port, (serviceType, frequencyLimit, workAbility) in enumerate(serviceType_list):
+            servicelist.append({
+                "podIP": f"10.244.{node // 250}.{node % 250 + 1}{port}",
+                "hostPort": 30500 + port,
+                "serviceType": serviceType,
+                "currentConnection": 0,
+                "nodeName": f"workergpu{node}",
+                "hostIP": f"10.52.{node // 250}.{node % 250 + 1}",
+                "frequencyLimit": list(frequencyLimit),
+                "currentFrequency": frequencyLimit[0],
+                "workloadLimit": rng.choice(workAbility) / len(serviceType_list),
+            })
+    return servicelist
+
+
+def split_agents(agents: int, serviceType_list: list) -> dict:
+    share, extra = divmod(agents, len(serviceType_list))
+    return {serviceType: share + (index < extra) for index, serviceType in enumerate(serviceType_list)}
+
+
+def place(function, agent_dict: dict, servicelist: list) -> tuple:
+    status_list = []
+    for serviceType, agentcount in agent_dict.items():
+        status, servicelist = function(serviceType, agentcount, servicelist)
+        status_list.append(status)
+    return status_list, servicelist
+
+
+def measure(function, agent_dict: dict, servicelist: list, repeat: int) -> tuple:
+    best = float("inf")
+    for _ in range(repeat):
+        data = copy.deepcopy(servicelist)
+        start = time.perf_counter()
+        status_list, result = place(function, agent_dict, data)
+        best = min(best, time.perf_counter() - start)
+    return best, status_list, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--strategies", nargs="+", default=["optimize", "uniform", "most_remaining"])
+    parser.add_argument("--agents", nargs="+", type=int, default=[100, 1000, 5000])
+    parser.add_argument("--nodes", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    for name in args.strategies:
+        if not callable(getattr(optimizer, name, None)):
+            raise SystemExit(f"optimizer.py has no {name}()")
+
+    servicelist = make_servicelist(args.nodes, args.seed)
+    serviceType_list = [serviceType for serviceType, _, _ in SERVICE_TYPES]
+    result_list = []
+    for agents in args.agents:
+        agent_dict = split_agents(agents, serviceType_list)
+        for name in args.strategies:
+            seconds, status_list, placed = measure(getattr(optimizer, name), agent_dict, servicelist, args.repeat)
+            quality = allocation_quality(placed)
+            result_list.append(dict({
+                "strategy": name,
+                "agents": agents,
+                "seconds": seconds,
+                "agentsPerSecond": round(agents / seconds, 1) if seconds > 0 else None,
+                "status": dict(zip(serviceType_list, status_list)),
+            }, **quality))
+            print(
+                f"{name:16s} {agents:6d} agents: {seconds * 1000:9.2f} ms,"
+                f" delivered {quality['deliveredFps']:.1f} of {quality['requestedFps']:.1f} fps,"
+                f" frequency min {quality['minFrequency']} mean {quality['meanFrequency']},"
+                f" below minimum {quality['belowMinimumFraction']:.3f},"
+                f" overloaded {quality['overloadedFraction']:.3f}"
+            )
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "nodes": args.nodes,
+                "instances": len(servicelist),
+                "repeat": args.repeat,
+                "seed": args.seed,
+                "results": result_list,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
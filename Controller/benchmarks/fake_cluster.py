@@ -0,0 +1,440 @@
+"""
+Fake Kubernetes API server, kubelets and agents for benchmarks/simulate.py.
+
+Everything is served by http.server threads on loopback, the Controller talks
+to them with its real clients:
+
+- FakeCluster: the part of the CoreV1 API the Controller uses (nodes and
+  pods: list, watch, read, create, delete) and the kubelet /healthz of every
+  node. A created Pod gets its IPs after pod_start seconds and is Ready
+  pod_ready seconds later, a deleted Pod is gone after pod_terminate seconds.
+- FakeAgents: /servicechange on every agent port and the host relay's
+  /servicechange/batch, for any agent IP in 127.0.0.0/8. Every agent's
+  current service and the number of notifications are recorded.
+"""
+import bisect
+import datetime
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+NODE_PATH = re.compile(r"^/api/v1/nodes(?:/(?P<name>[^/]+))?$")
+POD_PATH = re.compile(r"^/api/v1/namespaces/(?P<namespace>[^/]+)/pods(?:/(?P<name>[^/]+))?$")
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _status(code: int, reason: str, message: str) -> dict:
+    return {"kind": "Status", "apiVersion": "v1", "status": "Failure",
+            "message": message, "reason": reason, "code": code}
+
+
+def _label_filter(selector: Optional[str]):
+    """Matcher of the label selectors the Controller sends: "app in (a,b)" and "app=a"."""
+    if not selector:
+        return lambda labels: True
+    match = re.fullmatch(r"\s*(\w[\w./-]*)\s+in\s+\(([^)]*)\)\s*", selector)
+    if match:
+        key, value_set = match.group(1), {value.strip() for value in match.group(2).split(',')}
+    else:
+        key, _, value = selector.partition('=')
+        key, value_set = key.strip(), {value.strip()}
+    return lambda labels: (labels or {}).get(key) in value_set
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handler, owner):
+        self.owner = owner
+        super().__init__(address, handler)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def reply(self, code: int, body, content_type: str = "application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def local_ip(self) -> str:
+        """Address the client connected to, i.e. the node or agent the request is for."""
+        return self.connection.getsockname()[0]
+
+
+class _KubeApiHandler(_Handler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        cluster = self.server.owner
+        match = NODE_PATH.match(url.path)
+        kind = "nodes"
+        if match is None:
+            match = POD_PATH.match(url.path)
+            kind = "pods"
+        if match is None:
+            self.reply(404, _status(404, "NotFound", f"{url.path} not found"))
+        elif match.group("name"):
+            item = cluster.get(kind, match.group("name"))
+            if item is None:
+                self.reply(404, _status(404, "NotFound", f"{kind} \"{match.group('name')}\" not found"))
+            else:
+                self.reply(200, item)
+        elif query.get("watch") in ("true", "1", "True"):
+            self.watch(kind, query)
+        else:
+            self.reply(200, cluster.list(kind, query.get("labelSelector")))
+
+    def do_POST(self):
+        match = POD_PATH.match(urlparse(self.path).path)
+        if match is None or match.group("name"):
+            self.reply(405, _status(405, "MethodNotAllowed", "only pods can be created"))
+            return
+        code, body = self.server.owner.create_pod(self.read_json())
+        self.reply(code, body)
+
+    def do_DELETE(self):
+        match = POD_PATH.match(urlparse(self.path).path)
+        if match is None or not match.group("name"):
+            self.reply(405, _status(405, "MethodNotAllowed", "only pods can be deleted"))
+            return
+        self.read_json()
+        code, body = self.server.owner.delete_pod(match.group("name"))
+        self.reply(code, body)
+
+    def watch(self, kind: str, query: dict):
+        cluster = self.server.owner
+        deadline = time.monotonic() + float(query.get("timeoutSeconds") or 300)
+        resourceVersion = int(query.get("resourceVersion") or 0)
+        matches = _label_filter(query.get("labelSelector"))
+        # 和 API server 一樣以 chunked 串流，每個 chunk 是一行事件
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            while True:
+                event_list = cluster.events_after(kind, resourceVersion, deadline)
+                if event_list is None:
+                    break
+                for eventResourceVersion, event in event_list:
+                    resourceVersion = eventResourceVersion
+                    if matches(event["object"]["metadata"].get("labels")):
+                        line = json.dumps(event).encode() + b"\n"
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class _KubeletHandler(_Handler):
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/healthz":
+            self.reply(404, b"not found", "text/plain")
+        elif self.server.owner.node_healthy(self.local_ip()):
+            self.reply(200, b"ok", "text/plain")
+        else:
+            self.reply(500, b"kubelet is down", "text/plain")
+
+
+class FakeCluster:
+    """
+    Nodes and Pods of the fake API server. node_list holds (name, ip, labels),
+    ip must be a loopback address, the kubelet of the node answers on it.
+    """
+
+    def __init__(self, node_list: Iterable[Tuple[str, str, dict]], pod_start: float = 0.5,
+                 pod_ready: float = 1.0, pod_terminate: float = 0.5):
+        self._pod_start = pod_start
+        self._pod_ready = pod_ready
+        self._pod_terminate = pod_terminate
+        self._condition = threading.Condition()
+        self._resourceVersion = 0
+        self._stopped = False
+        self._items: Dict[str, Dict[str, dict]] = {"nodes": {}, "pods": {}}
+        # kind -> resourceVersions and (resourceVersion, event) in order
+        self._eventVersions: Dict[str, List[int]] = {"nodes": [], "pods": []}
+        self._events: Dict[str, List[tuple]] = {"nodes": [], "pods": []}
+        self._nodeIP_dict: Dict[str, str] = {}
+        self._failedNode_set = set()
+        self._podIP = itertools.count(1)
+        self._timer_list: List[threading.Timer] = []
+        self._servers: List[_Server] = []
+        self.stats = {"podsCreated": 0, "podsDeleted": 0, "apiConflicts": 0}
+        with self._condition:
+            for name, ip, labels in node_list:
+                self._nodeIP_dict[name] = ip
+                self._put("nodes", {
+                    "apiVersion": "v1",
+                    "kind": "Node",
+                    "metadata": {"name": name, "labels": dict(labels, **{"kubernetes.io/hostname": name})},
+                    "status": {"addresses": [{"type": "InternalIP", "address": ip}]},
+                }, "ADDED")
+        self.api_port = None
+        self.kubelet_port = None
+
+    def start(self, kubelet_port: int = 0):
+        """Serve the API on an ephemeral port of 127.0.0.1 and the kubelets on kubelet_port of every address."""
+        api = _Server(("127.0.0.1", 0), _KubeApiHandler, self)
+        kubelet = _Server(("0.0.0.0", kubelet_port), _KubeletHandler, self)
+        self.api_port = api.server_address[1]
+        self.kubelet_port = kubelet.server_address[1]
+        for server in (api, kubelet):
+            self._servers.append(server)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    @property
+    def api_host(self) -> str:
+        return f"http://127.0.0.1:{self.api_port}"
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+            for timer in self._timer_list:
+                timer.cancel()
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+    def _put(self, kind: str, item: dict, eventType: str):
+        """Store item and record its event, the caller holds the lock."""
+        self._resourceVersion += 1
+        item["metadata"]["resourceVersion"] = str(self._resourceVersion)
+        if eventType == "DELETED":
+            self._items[kind].pop(item["metadata"]["name"], None)
+        else:
+            self._items[kind][item["metadata"]["name"]] = item
+        self._eventVersions[kind].append(self._resourceVersion)
+        self._events[kind].append((self._resourceVersion, {"type": eventType, "object": json.loads(json.dumps(item))}))
+        self._condition.notify_all()
+
+    def _later(self, delay: float, function, *args):
+        timer = threading.Timer(delay, function, args)
+        timer.daemon = True
+        with self._condition:
+            self._timer_list = [t for t in self._timer_list if t.is_alive()]
+            self._timer_list.append(timer)
+        timer.start()
+
+    def get(self, kind: str, name: str) -> Optional[dict]:
+        with self._condition:
+            item = self._items[kind].get(name)
+            return None if item is None else json.loads(json.dumps(item))
+
+    def list(self, kind: str, selector: Optional[str] = None) -> dict:
+        matches = _label_filter(selector)
+        with self._condition:
+            return json.loads(json.dumps({
+                "apiVersion": "v1",
+                "kind": "NodeList" if kind == "nodes" else "PodList",
+                "metadata": {"resourceVersion": str(self._resourceVersion)},
+                "items": [item for item in self._items[kind].values() if matches(item["metadata"].get("labels"))],
+            }))
+
+    def events_after(self, kind: str, resourceVersion: int, deadline: float) -> Optional[List[tuple]]:
+        """Events of kind newer than resourceVersion, waiting for one until deadline; None once it passed."""
+        with self._condition:
+            while not self._stopped:
+                index = bisect.bisect_right(self._eventVersions[kind], resourceVersion)
+                if index < len(self._events[kind]):
+                    return self._events[kind][index:]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(min(remaining, 1.0))
+            return None
+
+    def create_pod(self, body: dict) -> Tuple[int, dict]:
+        name = body["metadata"]["name"]
+        with self._condition:
+            if name in self._items["pods"]:
+                self.stats["apiConflicts"] += 1
+                return 409, _status(409, "AlreadyExists", f"pods \"{name}\" already exists")
+            body["metadata"].setdefault("namespace", "default")
+            body["metadata"]["creationTimestamp"] = _now()
+            nodeName = (body["spec"].get("nodeSelector") or {}).get("kubernetes.io/hostname")
+            body["spec"]["nodeName"] = nodeName
+            body["status"] = {"phase": "Pending"}
+            self._put("pods", body, "ADDED")
+            self.stats["podsCreated"] += 1
+            pod = json.loads(json.dumps(body))
+        self._later(self._pod_start, self._start_pod, name)
+        return 201, pod
+
+    def _current_pod(self, name: str) -> Optional[dict]:
+        pod = self._items["pods"].get(name)
+        if pod is None or pod["metadata"].get("deletionTimestamp"):
+            return None
+        return pod
+
+    def _start_pod(self, name: str):
+        with self._condition:
+            pod = self._current_pod(name)
+            nodeName = None if pod is None else pod["spec"]["nodeName"]
+            if pod is None or nodeName not in self._nodeIP_dict or nodeName in self._failedNode_set:
+                # 節點故障時 Pod 一直停在 Pending
+                return
+            podIndex = next(self._podIP)
+            pod["status"] = {
+                "phase": "Running",
+                "podIP": f"10.244.{podIndex // 250}.{podIndex % 250 + 1}",
+                "hostIP": self._nodeIP_dict[nodeName],
+                "conditions": [{"type": "Ready", "status": "False"}],
+            }
+            self._put("pods", pod, "MODIFIED")
+        self._later(self._pod_ready, self._set_ready, name, True)
+
+    def _set_ready(self, name: str, ready: bool):
+        with self._condition:
+            pod = self._current_pod(name)
+            if pod is None or pod["status"].get("phase") != "Running":
+                return
+            if ready and pod["spec"]["nodeName"] in self._failedNode_set:
+                return
+            pod["status"]["conditions"] = [{"type": "Ready", "status": "True" if ready else "False"}]
+            self._put("pods", pod, "MODIFIED")
+
+    def delete_pod(self, name: str) -> Tuple[int, dict]:
+        with self._condition:
+            pod = self._items["pods"].get(name)
+            if pod is None:
+                return 404, _status(404, "NotFound", f"pods \"{name}\" not found")
+            if not pod["metadata"].get("deletionTimestamp"):
+                pod["metadata"]["deletionTimestamp"] = _now()
+                self._put("pods", pod, "MODIFIED")
+                self.stats["podsDeleted"] += 1
+                self._later(self._pod_terminate, self._remove_pod, name)
+            return 200, json.loads(json.dumps(pod))
+
+    def _remove_pod(self, name: str):
+        with self._condition:
+            pod = self._items["pods"].get(name)
+            if pod is not None:
+                self._put("pods", pod, "DELETED")
+
+    def fail_pod(self, name: str):
+        """The Pod's container stopped, it is no longer Ready."""
+        self._set_ready(name, False)
+
+    def fail_node(self, nodeName: str):
+        """The kubelet of nodeName stops answering /healthz and the Pods on it are no longer Ready."""
+        with self._condition:
+            self._failedNode_set.add(nodeName)
+            podName_list = [name for name, pod in self._items["pods"].items() if pod["spec"]["nodeName"] == nodeName]
+        for podName in podName_list:
+            self._set_ready(podName, False)
+
+    def recover_node(self, nodeName: str):
+        with self._condition:
+            self._failedNode_set.discard(nodeName)
+
+    def node_healthy(self, ip: str) -> bool:
+        with self._condition:
+            for nodeName, nodeIP in self._nodeIP_dict.items():
+                if nodeIP == ip:
+                    return nodeName not in self._failedNode_set
+            return False
+
+    def pod_names(self) -> List[str]:
+        with self._condition:
+            return list(self._items["pods"])
+
+
+class _AgentHandler(_Handler):
+
+    def do_POST(self):
+        agents = self.server.owner
+        path = urlparse(self.path).path
+        body = self.read_json()
+        agentIP = self.local_ip()
+        if path == "/servicechange":
+            agents.change(agentIP, self.server.server_address[1], body)
+            self.reply(200, {"message": "ok"})
+        elif path == "/servicechange/batch" and self.server.server_address[1] == agents.batch_port:
+            agents.stats["batches"] += 1
+            result_list = []
+            for change in body["changes"]:
+                agents.change(agentIP, change["agentPort"], change)
+                result_list.append({"agentPort": change["agentPort"], "statusCode": 200, "error": None})
+            self.reply(200, {"results": result_list})
+        else:
+            self.reply(404, {"detail": "Not Found"})
+
+
+class FakeAgents:
+    """
+    The agents: one server per agent port and the host relay on batch_port,
+    all on every address, so an agent is any 127.x.x.x address with one of
+    the ports.
+    """
+
+    def __init__(self, agentPort_list: Iterable[int]):
+        self._agentPort_list = sorted(set(agentPort_list))
+        self._lock = threading.Lock()
+        self._servers: List[_Server] = []
+        # (agentIP, agentPort, serviceType) -> [ip, port, frequency]
+        self._agentConfig_dict: Dict[tuple, list] = {}
+        self.batch_port = None
+        self.stats = {"notifications": 0, "batches": 0, "unknownAgents": 0}
+
+    def start(self):
+        for port in self._agentPort_list + [0]:
+            server = _Server(("0.0.0.0", port), _AgentHandler, self)
+            self._servers.append(server)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.batch_port = self._servers[-1].server_address[1]
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+    def subscribed(self, agentIP: str, agentPort: int, serviceType: str, agentConfig: tuple):
+        """The agent got its service in the /subscribe response."""
+        with self._lock:
+            self._agentConfig_dict[(agentIP, int(agentPort), serviceType)] = list(agentConfig)
+
+    def unsubscribed(self, agentIP: str, agentPort: int):
+        with self._lock:
+            for key in [key for key in self._agentConfig_dict if key[:2] == (agentIP, int(agentPort))]:
+                del self._agentConfig_dict[key]
+
+    def change(self, agentIP: str, agentPort: int, body: dict):
+        key = (agentIP, int(agentPort), body["servicename"])
+        with self._lock:
+            self.stats["notifications"] += 1
+            agentConfig = self._agentConfig_dict.get(key)
+            if agentConfig is None:
+                self.stats["unknownAgents"] += 1
+                agentConfig = self._agentConfig_dict[key] = [None, None, None]
+            # ip = "null" 與 port = 0 表示 Agent 繼續使用目前的服務
+            if body["ip"] != "null":
+                agentConfig[0], agentConfig[1] = body["ip"], int(body["port"])
+            agentConfig[2] = body["frequency"]
+
+    def configs(self) -> Dict[tuple, tuple]:
+        with self._lock:
+            return {key: tuple(agentConfig) for key, agentConfig in self._agentConfig_dict.items()}
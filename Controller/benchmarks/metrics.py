@@ -0,0 +1,62 @@
+"""Latency percentiles and allocation quality shared by the benchmarks."""
+import math
+from typing import List, Optional
+
+
+def percentile(value_list: List[float], p: float) -> Optional[float]:
+    """Nearest-rank p-th percentile, None for no values."""
+    if not value_list:
+        return None
+    ordered = sorted(value_list)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def latency_summary(seconds_list: List[float]) -> dict:
+    def ms(seconds):
+        return None if seconds is None else round(seconds * 1000, 3)
+
+    return {
+        "count": len(seconds_list),
+        "meanMs": ms(sum(seconds_list) / len(seconds_list)) if seconds_list else None,
+        "p50Ms": ms(percentile(seconds_list, 50)),
+        "p99Ms": ms(percentile(seconds_list, 99)),
+        "maxMs": ms(max(seconds_list)) if seconds_list else None,
+    }
+
+
+def allocation_quality(service_list: list) -> dict:
+    """
+    Quality of the allocation in service_list, over the instances that serve
+    at least one agent:
+
+    - requestedFps: sum of currentConnection * currentFrequency, what the agents send
+    - deliveredFps: the same, but at most workloadLimit per instance, what the instances can serve
+    - minFrequency / meanFrequency: of currentFrequency
+    - belowMinimumFraction: instances with currentFrequency below frequencyLimit[1]
+    - overloadedFraction: instances asked for more than workloadLimit, uniform()
+      and most_remaining() keep the default frequency on a full instance
+    """
+    connected_list = [service for service in service_list if int(service['currentConnection']) > 0]
+    frequency_list = [float(service['currentFrequency']) for service in connected_list]
+    requested_list = [int(service['currentConnection']) * float(service['currentFrequency']) for service in connected_list]
+    belowMinimum = sum(
+        1 for service in connected_list if float(service['currentFrequency']) < service['frequencyLimit'][1]
+    )
+    # optimize() sets currentFrequency = workloadLimit / currentConnection, allow its rounding error
+    overloaded = sum(
+        1 for service, requested in zip(connected_list, requested_list)
+        if requested > float(service['workloadLimit']) * (1 + 1e-9)
+    )
+    return {
+        "instances": len(service_list),
+        "connectedInstances": len(connected_list),
+        "agents": sum(int(service['currentConnection']) for service in connected_list),
+        "requestedFps": round(sum(requested_list), 6),
+        "deliveredFps": round(sum(
+            min(requested, float(service['workloadLimit'])) for service, requested in zip(connected_list, requested_list)
+        ), 6),
+        "minFrequency": min(frequency_list) if frequency_list else None,
+        "meanFrequency": round(sum(frequency_list) / len(frequency_list), 6) if frequency_list else None,
+        "belowMinimumFraction": belowMinimum / len(connected_list) if connected_list else 0.0,
+        "overloadedFraction": overloaded / len(connected_list) if connected_list else 0.0,
+    }
@@ -0,0 +1,446 @@
+"""
+Offline simulation of the Controller: controller.py runs against the fake
+Kubernetes API, kubelets and agents of fake_cluster.py and is driven by a
+subscription and failure trace (see workload.py).
+
+    python benchmarks/simulate.py --nodes 8 --agents 200 --duration 60 --speed 4
+    python benchmarks/simulate.py --optimizer all --node-failures 1 --output simulation.json
+    python benchmarks/simulate.py --trace trace.jsonl --service-spec information/serviceSpec.json
+
+Every agent replays its own events in order, different agents and the
+failures run concurrently. The requests go to the app in process, the
+Controller's own traffic (Kubernetes API, health checks, agent
+notifications) goes over loopback HTTP. Reported per optimizer:
+
+- latency: p50/p99 of /subscribe, /unsubscribe, /alert and of the handling
+  of every failure alert
+- notifications: the /servicechange the agents got, and how many agents
+  do not have the service the Controller assigned them at the end
+- quality: metrics.allocation_quality() at the end and every --sample-interval
+
+Every optimizer runs in its own process, the Controller keeps its state in
+module singletons.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import httpx
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+CONTROLLER_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, CONTROLLER_DIR)
+
+import optimizer  # noqa: E402
+from fake_cluster import FakeAgents, FakeCluster  # noqa: E402
+from metrics import allocation_quality, latency_summary  # noqa: E402
+from workload import AGENT_OPS, FAILURE_OPS, generate_trace, load_trace, save_trace  # noqa: E402
+
+OPTIMIZERS = ("optimize", "optimize_sorted", "waterfill", "uniform", "most_remaining")
+PACKAGE = "edge_controller"
+
+# serviceType, frequencyLimit, workAbility choices, gpuMemoryRequest
+DEFAULT_SERVICES = (
+    ("pose", [20, 10], (70, 85), 4),
+    ("gesture", [30, 15], (170, 255), 3),
+    ("object", [8, 4], (40, 60), 6),
+)
+
+
+def default_service_spec(nodeName_list: list, seed: int) -> list:
+    rng = random.Random(seed)
+    return [
+        {
+            "serviceType": serviceType,
+            "frequencyLimit": frequencyLimit,
+            "workAbility": {nodeName: rng.choice(workAbility) for nodeName in nodeName_list},
+            "gpuMemoryRequest": gpuMemoryRequest,
+        }
+        for serviceType, frequencyLimit, workAbility, gpuMemoryRequest in DEFAULT_SERVICES
+    ]
+
+
+def pod_template(serviceType: str) -> dict:
+    return {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "metadata": {"name": f"{serviceType}-node-30500", "labels": {"app": serviceType}},
+        "spec": {"containers": [{
+            "name": serviceType,
+            "image": f"simulated/{serviceType}",
+            "ports": [{"containerPort": 7000, "hostPort": 30500}],
+        }]},
+    }
+
+
+def prepare_workdir(workdir: str, serviceSpec_list: list) -> dict:
+    """Empty information files and the Pod templates in workdir, returns the config overrides of the files."""
+    for directory in ("information", "logdir", "service_yaml"):
+        os.makedirs(os.path.join(workdir, directory), exist_ok=True)
+    files = {
+        "SERVICE_FILE": ("information/service.json", []),
+        "SERVICESPEC_FILE": ("information/serviceSpec.json", serviceSpec_list),
+        "SUBSCRIPTION_FILE": ("information/subscription.json", []),
+        "NODE_STATUS_FILE": ("information/nodestatus.json", {}),
+    }
+    overrides = {}
+    for name, (path, content) in files.items():
+        overrides[name] = os.path.join(workdir, path)
+        with open(overrides[name], 'w', encoding='utf-8') as f:
+            json.dump(content, f, indent=4)
+    # create_pod() reads service_yaml/<serviceType>.yaml, JSON is YAML
+    for serviceSpec in serviceSpec_list:
+        with open(os.path.join(workdir, "service_yaml", f"{serviceSpec['serviceType']}.yaml"), 'w') as f:
+            json.dump(pod_template(serviceSpec['serviceType']), f)
+    overrides["STATE_JOURNAL_FILE"] = os.path.join(workdir, "information/state.journal")
+    overrides["STATE_SNAPSHOT_FILE"] = os.path.join(workdir, "information/state.snapshot.json")
+    overrides["LOG_FILE"] = os.path.join(workdir, "logdir/controller.log")
+    return overrides
+
+
+def load_config():
+    """
+    Import the Controller directory as a package and return its config, to
+    be overridden before load_controller().
+    """
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [CONTROLLER_DIR]
+    sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.config")
+
+
+def load_controller(config):
+    """
+    Import controller.py as uvicorn does from the Controller directory.
+    controller.py imports the other modules by their flat names while they
+    import each other relatively, so every module of the package is
+    registered under its flat name too; otherwise e.g. cluster_state would
+    exist twice.
+    """
+    sys.modules["config"] = config
+    for fileName in sorted(os.listdir(CONTROLLER_DIR)):
+        name, extension = os.path.splitext(fileName)
+        if extension != ".py" or name in ("config", "controller", "test", "optimizer"):
+            continue
+        sys.modules[name] = importlib.import_module(f"{PACKAGE}.{name}")
+    return importlib.import_module("controller")
+
+
+class Simulation:
+
+    def __init__(self, controller, cluster: FakeCluster, agents: FakeAgents, speed: float,
+                 sample_interval: float, seed: int):
+        self._controller = controller
+        self._cluster = cluster
+        self._agents = agents
+        self._speed = speed
+        self._sample_interval = sample_interval
+        self._rng = random.Random(seed)
+        self._clients = {}
+        self._subscribed = set()
+        self._start = None
+        self.latency = {"subscribe": [], "unsubscribe": [], "alert": [], "node_failure": [], "pod_failure": []}
+        self.scheduleLag = []
+        self.outcomes = {"accepted": 0, "rejected": 0, "errors": 0, "failuresSkipped": 0}
+        self.samples = []
+
+    def _client(self, agentIP: str) -> httpx.AsyncClient:
+        # /unsubscribe 以連線的來源 IP 找 Agent
+        if agentIP not in self._clients:
+            self._clients[agentIP] = httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=self._controller.app, client=(agentIP, 0)),
+                base_url="http://controller",
+                timeout=None,
+            )
+        return self._clients[agentIP]
+
+    def _elapsed(self) -> float:
+        return (time.perf_counter() - self._start) * self._speed
+
+    async def _post(self, op: str, agentIP: str, path: str, body: dict) -> httpx.Response:
+        start = time.perf_counter()
+        response = await self._client(agentIP).post(path, json=body)
+        self.latency[op].append(time.perf_counter() - start)
+        return response
+
+    async def subscribe(self, event: dict):
+        response = await self._post("subscribe", event["agentIP"], "/subscribe", {
+            "ip": event["agentIP"], "port": event["agentPort"], "serviceType": event["serviceType"],
+        })
+        result = response.json() if response.status_code == 200 else None
+        if isinstance(result, dict) and "IP" in result:
+            self.outcomes["accepted"] += 1
+            self._subscribed.add((event["agentIP"], event["agentPort"]))
+            self._agents.subscribed(event["agentIP"], event["agentPort"], event["serviceType"],
+                                    (str(result["IP"]), int(result["Port"]), result["Frequency"]))
+        elif result == 'reject the subscription':
+            self.outcomes["rejected"] += 1
+        else:
+            self.outcomes["errors"] += 1
+
+    async def unsubscribe(self, event: dict):
+        agent = (event["agentIP"], event["agentPort"])
+        if agent not in self._subscribed:
+            return
+        self._subscribed.discard(agent)
+        response = await self._post("unsubscribe", event["agentIP"], "/unsubscribe", {"port": event["agentPort"]})
+        if response.status_code != 200:
+            self.outcomes["errors"] += 1
+        self._agents.unsubscribed(*agent)
+
+    async def _alert(self, op: str, alertType: str, alertContent: dict):
+        start = time.perf_counter()
+        await self._post("alert", "127.0.0.1", "/alert", {"alertType": alertType, "alertContent": alertContent})
+        await self._controller.alert_queue.join()
+        self.latency[op].append(time.perf_counter() - start)
+
+    async def node_failure(self, event: dict):
+        self._cluster.fail_node(event["nodeName"])
+        await self._alert("node_failure", "workernode_failure", {"nodeName": event["nodeName"]})
+        asyncio.get_running_loop().call_later(
+            event.get("recoverAfter", 30.0) / self._speed, self._cluster.recover_node, event["nodeName"]
+        )
+
+    async def pod_failure(self, event: dict):
+        service_list = [
+            service for service in self._controller.cluster_state.service_list
+            if service['serviceType'] == event["serviceType"]
+        ]
+        if not service_list:
+            self.outcomes["failuresSkipped"] += 1
+            return
+        service = self._rng.choice(service_list)
+        podName = sys.modules["port_allocator"].pod_name(service['serviceType'], service['nodeName'], service['hostPort'])
+        self._cluster.fail_pod(podName)
+        await self._alert("pod_failure", "pod_failure", {"podName": podName})
+
+    async def _run_sequence(self, event_list: list):
+        for event in event_list:
+            delay = event["at"] / self._speed - (time.perf_counter() - self._start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # 負載產生器跟不上 trace 的時間
+            self.scheduleLag.append(max(0.0, -delay))
+            await getattr(self, event["op"])(event)
+
+    async def _sample(self):
+        while True:
+            self.samples.append(dict(
+                allocation_quality(self._controller.cluster_state.service_list), at=round(self._elapsed(), 3)
+            ))
+            await asyncio.sleep(self._sample_interval / self._speed)
+
+    async def replay(self, event_list: list):
+        sequence_dict = {}
+        for event in event_list:
+            if event["op"] in FAILURE_OPS:
+                key = "failures"
+            elif event["op"] in AGENT_OPS:
+                key = (event["agentIP"], event["agentPort"])
+            else:
+                raise ValueError(f"unknown op {event['op']}")
+            sequence_dict.setdefault(key, []).append(event)
+        self._start = time.perf_counter()
+        sampler = asyncio.create_task(self._sample())
+        try:
+            await asyncio.gather(*(self._run_sequence(sequence) for sequence in sequence_dict.values()))
+            await self._controller.alert_queue.join()
+        finally:
+            sampler.cancel()
+            for client in self._clients.values():
+                await client.aclose()
+
+    async def run(self, event_list: list) -> dict:
+        async with self._controller.app.router.lifespan_context(self._controller.app):
+            await self.replay(event_list)
+            requests = sum(len(self.latency[op]) for op in ("subscribe", "unsubscribe", "alert"))
+            notifications = self._agents.stats["notifications"]
+            return {
+                "outcomes": self.outcomes,
+                "latency": {op: latency_summary(seconds_list) for op, seconds_list in self.latency.items()},
+                "scheduleLag": latency_summary(self.scheduleLag),
+                "notifications": {
+                    "received": notifications,
+                    "perRequest": round(notifications / requests, 3) if requests else None,
+                    "batches": self._agents.stats["batches"],
+                    "notifier": self._controller.agent_notifier.metrics(),
+                },
+                "consistency": self.consistency(),
+                "quality": allocation_quality(self._controller.cluster_state.service_list),
+                "recovery": self._controller.recovery_timer.metrics(),
+                "pods": dict(self._cluster.stats),
+                "samples": self.samples,
+            }
+
+    def consistency(self) -> dict:
+        """Agents whose service differs from the one the Controller assigned them, and agents it forgot."""
+        cluster_state = self._controller.cluster_state
+        service_dict = {service['podIP']: service for service in cluster_state.service_list}
+        expected = {}
+        for _, subscription in cluster_state.subscriptions.items():
+            service = service_dict.get(subscription['podIP'])
+            expected[(subscription['agentIP'], int(subscription['agentPort']), subscription['serviceType'])] = (
+                None if service is None
+                else (str(service['hostIP']), int(service['hostPort']), service['currentFrequency'])
+            )
+        agentConfig_dict = self._agents.configs()
+        return {
+            "subscriptions": len(expected),
+            "staleAgents": sum(1 for key, agentConfig in expected.items() if agentConfig_dict.get(key) != agentConfig),
+            "orphanedAgents": sum(1 for key in agentConfig_dict if key not in expected),
+        }
+
+
+def simulate(args, event_list: list, serviceSpec_list: list, nodeName_list: list) -> dict:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="controller-simulation-")
+    overrides = prepare_workdir(workdir, serviceSpec_list)
+    config = load_config()
+
+    cluster = FakeCluster(
+        [
+            (nodeName, f"127.1.{index // 250}.{index % 250 + 1}", {
+                "arha-node-type": "computing-node",
+                config.GPU_MEMORY_LABEL: str(args.gpu_memory),
+            })
+            for index, nodeName in enumerate(nodeName_list)
+        ],
+        pod_start=args.pod_start, pod_ready=args.pod_ready, pod_terminate=args.pod_terminate,
+    )
+    agents = FakeAgents(event["agentPort"] for event in event_list if event["op"] in AGENT_OPS)
+    cluster.start()
+    agents.start()
+    overrides.update({
+        "KUBE_API_HOST": cluster.api_host,
+        "NODE_HEALTH_PORT": cluster.kubelet_port,
+        "AGENT_BATCH_PORT": agents.batch_port,
+        "POD_SCHEDULE_TIMEOUT": args.pod_timeout,
+        "POD_READY_TIMEOUT": args.pod_timeout,
+    })
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    os.environ["OPTIMIZER_FUNCTION"] = args.optimizer[0]
+    os.chdir(workdir)
+    started = time.perf_counter()
+    try:
+        controller = load_controller(config)
+        simulation = Simulation(controller, cluster, agents, args.speed, args.sample_interval, args.seed)
+        report = asyncio.run(simulation.run(event_list))
+    finally:
+        agents.stop()
+        cluster.stop()
+    return dict({
+        "optimizer": args.optimizer[0],
+        "events": len(event_list),
+        "seconds": round(time.perf_counter() - started, 3),
+        "workdir": workdir,
+    }, **report)
+
+
+def summary(report: dict) -> str:
+    latency = report["latency"]
+    quality = report["quality"]
+    return (
+        f"{report['optimizer']:16s}"
+        f" subscribe p50 {latency['subscribe']['p50Ms']} p99 {latency['subscribe']['p99Ms']} ms,"
+        f" unsubscribe p50 {latency['unsubscribe']['p50Ms']} p99 {latency['unsubscribe']['p99Ms']} ms,"
+        f" accepted {report['outcomes']['accepted']} rejected {report['outcomes']['rejected']},"
+        f" notifications {report['notifications']['received']},"
+        f" stale agents {report['consistency']['staleAgents']},"
+        f" fps {quality['deliveredFps']} min {quality['minFrequency']} mean {quality['meanFrequency']}"
+        f" below minimum {quality['belowMinimumFraction']:.3f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--optimizer", nargs="+", default=["optimize"], choices=OPTIMIZERS + ("all",))
+    parser.add_argument("--trace", help="replay this trace instead of generating one")
+    parser.add_argument("--save-trace", help="write the generated trace here")
+    parser.add_argument("--service-spec", help="serviceSpec.json to use, the nodes are the ones of its workAbility")
+    parser.add_argument("--nodes", type=int, default=8)
+    parser.add_argument("--gpu-memory", type=int, default=24)
+    parser.add_argument("--agents", type=int, default=200)
+    parser.add_argument("--agents-per-host", type=int, default=4)
+    parser.add_argument("--agent-port", type=int, default=10000)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--arrival-rate", type=float, default=5.0)
+    parser.add_argument("--hold-time", type=float, default=20.0)
+    parser.add_argument("--node-failures", type=int, default=0)
+    parser.add_argument("--pod-failures", type=int, default=0)
+    parser.add_argument("--recover-after", type=float, default=30.0)
+    parser.add_argument("--speed", type=float, default=1.0, help="replay the trace this many times faster")
+    parser.add_argument("--pod-start", type=float, default=0.5)
+    parser.add_argument("--pod-ready", type=float, default=1.0)
+    parser.add_argument("--pod-terminate", type=float, default=0.5)
+    parser.add_argument("--pod-timeout", type=float, default=30.0)
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    if args.output:
+        # simulate() changes into the work directory
+        args.output = os.path.abspath(args.output)
+
+    if args.service_spec:
+        with open(args.service_spec, 'r', encoding='utf-8') as f:
+            serviceSpec_list = json.load(f)
+        nodeName_list = sorted({nodeName for serviceSpec in serviceSpec_list for nodeName in serviceSpec["workAbility"]})
+    else:
+        nodeName_list = [f"workergpu{index}" for index in range(args.nodes)]
+        serviceSpec_list = default_service_spec(nodeName_list, args.seed)
+
+    if args.trace:
+        event_list = load_trace(args.trace)
+    else:
+        event_list = generate_trace(
+            [serviceSpec["serviceType"] for serviceSpec in serviceSpec_list], nodeName_list,
+            duration=args.duration, agents=args.agents, agents_per_host=args.agents_per_host,
+            agent_port=args.agent_port, arrival_rate=args.arrival_rate, hold_time=args.hold_time,
+            node_failures=args.node_failures, pod_failures=args.pod_failures,
+            recover_after=args.recover_after, seed=args.seed,
+        )
+        if args.save_trace:
+            save_trace(event_list, args.save_trace)
+
+    optimizer_list = list(OPTIMIZERS) if "all" in args.optimizer else list(dict.fromkeys(args.optimizer))
+    for name in optimizer_list:
+        if not hasattr(optimizer, name):
+            raise SystemExit(f"optimizer.py has no {name}()")
+
+    if len(optimizer_list) == 1:
+        args.optimizer = optimizer_list
+        report_list = [simulate(args, event_list, serviceSpec_list, nodeName_list)]
+    else:
+        # 每個演算法在各自的 process 重播同一個 trace
+        report_list = []
+        with tempfile.TemporaryDirectory() as tmp:
+            trace_path = os.path.join(tmp, "trace.jsonl")
+            save_trace(event_list, trace_path)
+            for name in optimizer_list:
+                output = os.path.join(tmp, f"{name}.json")
+                subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), *sys.argv[1:],
+                     "--optimizer", name, "--trace", trace_path, "--output", output],
+                    check=True, stdout=subprocess.DEVNULL,
+                )
+                with open(output, 'r', encoding='utf-8') as f:
+                    report_list.extend(json.load(f)["runs"])
+
+    for report in report_list:
+        print(summary(report))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"runs": report_list}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Subscription and failure traces for benchmarks/simulate.py.
+
+A trace is a list of events ordered by "at", the seconds since the start:
+
+    {"at": 1.25, "op": "subscribe", "agentIP": "127.2.0.1", "agentPort": 10000, "serviceType": "pose"}
+    {"at": 9.80, "op": "unsubscribe", "agentIP": "127.2.0.1", "agentPort": 10000}
+    {"at": 30.0, "op": "node_failure", "nodeName": "workergpu3", "recoverAfter": 30.0}
+    {"at": 42.5, "op": "pod_failure", "serviceType": "gesture"}
+
+and is stored as one JSON object per line. pod_failure takes a running Pod
+of serviceType at that time.
+"""
+import heapq
+import json
+import random
+from typing import List
+
+AGENT_OPS = ("subscribe", "unsubscribe")
+FAILURE_OPS = ("node_failure", "pod_failure")
+
+
+def agent_address(agent: int, agents_per_host: int, agent_port: int) -> tuple:
+    """(agentIP, agentPort) of the agent-th agent, agents_per_host agents share a 127.2.x.x address."""
+    host = agent // agents_per_host
+    return f"127.2.{host // 250}.{host % 250 + 1}", agent_port + agent % agents_per_host
+
+
+def generate_trace(serviceType_list: List[str], nodeName_list: List[str], duration: float = 60.0,
+                   agents: int = 100, agents_per_host: int = 4, agent_port: int = 10000,
+                   arrival_rate: float = 5.0, hold_time: float = 20.0, node_failures: int = 0,
+                   pod_failures: int = 0, recover_after: float = 30.0, seed: int = 0) -> List[dict]:
+    """
+    Subscriptions arrive as a Poisson process of arrival_rate per second,
+    each from an agent without a subscription, to a random serviceType, and
+    are held for an exponential time of mean hold_time. Arrivals while every
+    agent is subscribed are dropped. The failures happen at random times in
+    the middle of the trace, on distinct nodes.
+    """
+    rng = random.Random(seed)
+    event_list = []
+    idle_list = list(range(agents))
+    busy_heap = []
+    at = 0.0
+    while True:
+        at += rng.expovariate(arrival_rate)
+        if at >= duration:
+            break
+        while busy_heap and busy_heap[0][0] <= at:
+            idle_list.append(heapq.heappop(busy_heap)[1])
+        if not idle_list:
+            continue
+        agent = idle_list.pop(rng.randrange(len(idle_list)))
+        agentIP, agentPort = agent_address(agent, agents_per_host, agent_port)
+        event_list.append({
+            "at": round(at, 6), "op": "subscribe", "agentIP": agentIP, "agentPort": agentPort,
+            "serviceType": rng.choice(serviceType_list),
+        })
+        release = at + rng.expovariate(1.0 / hold_time)
+        if release < duration:
+            event_list.append({"at": round(release, 6), "op": "unsubscribe", "agentIP": agentIP, "agentPort": agentPort})
+            heapq.heappush(busy_heap, (release, agent))
+
+    for nodeName in rng.sample(nodeName_list, min(node_failures, len(nodeName_list))):
+        event_list.append({
+            "at": round(rng.uniform(0.2, 0.8) * duration, 6), "op": "node_failure",
+            "nodeName": nodeName, "recoverAfter": recover_after,
+        })
+    for _ in range(pod_failures):
+        event_list.append({
+            "at": round(rng.uniform(0.1, 0.9) * duration, 6), "op": "pod_failure",
+            "serviceType": rng.choice(serviceType_list),
+        })
+    event_list.sort(key=lambda event: event["at"])
+    return event_list
+
+
+def load_trace(path: str) -> List[dict]:
+    with open(path, 'r', encoding='utf-8') as traceFile:
+        event_list = [json.loads(line) for line in traceFile if line.strip()]
+    event_list.sort(key=lambda event: event["at"])
+    return event_list
+
+
+def save_trace(event_list: List[dict], path: str):
+    with open(path, 'w', encoding='utf-8') as traceFile:
+        for event in event_list:
+            traceFile.write(json.dumps(event) + '\n')
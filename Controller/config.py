@@ -5,3 +5,39 @@ SERVICESPEC_FILE = './information/serviceSpec.json'
 SUBSCRIPTION_FILE = './information/subscription.json'
 NODE_STATUS_FILE = './information/nodestatus.json'
 LOG_FILE = './logdir/controller.log'
+AGENT_NOTIFY_CONCURRENCY = 64
+AGENT_NOTIFY_TIMEOUT = 2.0
+AGENT_NOTIFY_RETRIES = 2
+AGENT_NOTIFY_BACKOFF = 0.2
+AGENT_BATCH_PORT = 8890
+KUBE_API_HOST = None
+KUBE_CONNECTION_POOL = 16
+KUBE_REQUEST_TIMEOUT = 10.0
+KUBE_WATCH_TIMEOUT = 300
+KUBE_CACHE_SYNC_TIMEOUT = 10
+POD_SCHEDULE_TIMEOUT = 120
+POD_READY_TIMEOUT = 60
+POD_POLL_INTERVAL = 0.5
+BLOCKING_WORKERS = 16
+LOOP_LAG_INTERVAL = 0.1
+LOOP_LAG_WARNING = 0.2
+WARM_POOL_INTERVAL = 30
+WARM_POOL_READY_TIMEOUT = 300
+FORECAST_INTERVAL = 10
+FORECAST_WINDOW = 60
+FORECAST_ALPHA = 0.5
+FORECAST_BETA = 0.3
+FORECAST_HORIZON = 6
+FORECAST_SCALE_IN_DELAY = 300
+HOST_PORT_FIRST = 30500
+HOST_PORT_LAST = 31000
+ACCESS_LOG_SAMPLE_RATE = 0.1
+ACCESS_LOG_BODY_LIMIT = 1024
+STATE_JOURNAL_FILE = './information/state.journal'
+STATE_SNAPSHOT_FILE = './information/state.snapshot.json'
+STATE_COMPACT_RECORDS = 1000
+STATE_JOURNAL_FSYNC = False
+NODE_HEALTH_PORT = 10248
+NODE_HEALTH_TIMEOUT = 1.0
+NODE_HEALTH_TTL = 10
+NODE_HEALTH_INTERVAL = 5
@@ -1,113 +1,109 @@
 from fastapi import FastAPI, Request, HTTPException
 from pydantic import BaseModel
-import json
-from kubernetes import client, config
-from starlette.responses import JSONResponse
 import logging
 import asyncio
+import time
+from contextlib import asynccontextmanager
 
 from config import (
     GPU_MEMORY_LABEL,
-    IN_CLUSTER,
-    SERVICE_FILE,
-    SERVICESPEC_FILE,
-    SUBSCRIPTION_FILE,
-    NODE_STATUS_FILE,
     LOG_FILE,
+    ACCESS_LOG_SAMPLE_RATE,
+    ACCESS_LOG_BODY_LIMIT,
+    KUBE_CACHE_SYNC_TIMEOUT,
 )
-from service_manager import compute_frequnecy, adjust_frequency
+from access_log import AccessLogMiddleware, start_logging
+from state import cluster_state, SERVICES, SUBSCRIPTIONS
+from locks import service_locks
+from agent_notifier import agent_notifier
+from kube_cache import kube_cache
+from kube_client import kube_client
+from loop_monitor import loop_monitor
+from node_health import node_health
+from worker_pool import worker_pool
+from stage_timer import StageTimer
+from service_manager import (
+    compute_frequnecy,
+    scale_out_service_types,
+    reallocate_agents,
+    deploy_services,
+    adjust_frequency,
+    collect_notifications,
+    notify_agents,
+    admit_agent,
+    release_agent,
+    adopt_standby_pods,
+    reserve_used_ports,
+    warm_pool_refiller,
+    forecast_demand,
+    demand_forecaster,
+)
+from warm_pool import warm_pool
 from kube_utils import (
-    get_node_ip,
-    curl_health_check,
     deploy_pod,
-    communicate_with_agent,
     delete_pod,
-    node_status_sync,
     is_pod_terminating,
+    port_allocator,
 )
 
-locked = False
-
 
-# 設定 logging，將所有日誌寫入到 LOG_FILE
-logging.basicConfig(
-    filename= LOG_FILE,
-    format='%(asctime)s %(levelname)s: %(message)s',
-    level=logging.INFO
-)
+# 設定 logging，日誌經由 queue 交給背景 thread 寫入到 LOG_FILE
+log_listener = start_logging(LOG_FILE)
 
 class SubscriptionRequest(BaseModel):
     ip: str
     port: int
     serviceType: str
     
-def lifespan(app: FastAPI):
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 將 information 檔案載入記憶體，阻塞的工作都交給 worker_pool，event loop 只處理請求
+    await worker_pool.run(cluster_state.load)
+
     # 初始化 NODE_STATUS_FILE
-    config.load_incluster_config() if IN_CLUSTER else config.load_kube_config()
-    core_api = client.CoreV1Api()
+    # 以 watch 維護節點與服務 Pod 的快取
+    kube_cache.start(cluster_state.serviceSpec_dict.keys())
     node_status_list = []
 
     # 獲取所有節點的標籤
-    nodes = core_api.list_node().items
-    for node in nodes:
-        labels = node.metadata.labels
+    if await worker_pool.run(kube_cache.wait_synced, timeout=KUBE_CACHE_SYNC_TIMEOUT):
+        nodes = [(node['name'], node['labels']) for node in kube_cache.nodes()]
+    else:
+        node_list = await worker_pool.run(kube_client.core_api().list_node)
+        nodes = [(node.metadata.name, node.metadata.labels) for node in node_list.items]
+    for node_name, labels in nodes:
         if labels.get('arha-node-type') == 'computing-node':
-            node_status_list.append(node.metadata.name)
-
-    node_health_status = {}
-    for node in node_status_list:
-        ip = get_node_ip(node)
-        if ip != "Error":
-            try:
-                if curl_health_check(ip).strip().lower() == 'ok':
-                    node_health_status[node] = "healthy"
-                else:
-                    node_health_status[node] = "unhealthy"
-            except Exception as e:
-                node_health_status[node] = "unhealthy"
-        else:
-            node_health_status[node] = "unhealthy"
-
-    with open(NODE_STATUS_FILE, 'w') as node_status_file:
-        json.dump(node_health_status, node_status_file, indent=4)
-    yield 
+            node_status_list.append(node_name)
+
+    # 同時檢查所有節點的健康狀態，之後在背景定期更新
+    await node_health.start(node_status_list)
+    # 重新啟動前留下的備用Pod放回 warm_pool，超過 warmPool 的刪除，不足的部分在背景補齊
+    reserve_used_ports()
+    await adopt_standby_pods()
+    cluster_state.start()
+    await agent_notifier.start()
+    loop_monitor.start()
+    alert_task = asyncio.create_task(alert_worker())
+    warm_pool_task = asyncio.create_task(warm_pool_refiller())
+    forecast_task = asyncio.create_task(forecast_demand())
+    yield
+    forecast_task.cancel()
+    warm_pool_task.cancel()
+    alert_task.cancel()
+    await loop_monitor.stop()
+    await agent_notifier.close()
+    await node_health.close()
+    kube_cache.stop()
+    kube_client.close()
+    worker_pool.shutdown()
+    # 關閉前將尚未寫入的資料寫回檔案
+    cluster_state.stop()
+    log_listener.stop()
 
 app = FastAPI(lifespan=lifespan)
 
-# 中間件，用來紀錄每個 API 呼叫的詳情
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    # 取得 API 名稱 (路徑)、請求內容、來源 IP
-    api_name = request.url.path
-    request_body = await request.body()
-    client_ip = request.client.host  # 取得來源 IP
-    request_log = request_body.decode("utf-8") if request_body else None
-    logging.info(f"{api_name} receive request {request_log} from IP: {client_ip}")
-
-    # 呼叫 API 並取得回應
-    try:
-        response = await call_next(request)
-        response_body = b"".join([chunk async for chunk in response.body_iterator])
-        status_code = response.status_code  # 取得狀態碼
-        response = JSONResponse(content=json.loads(response_body), status_code=status_code)
-    except Exception as e:
-        status_code = 500
-        response = JSONResponse(content={"error": str(e)}, status_code=status_code)
-    
-    # 組合 log 訊息
-    log_message = {
-        "api_name": api_name,
-        "client_ip": client_ip,  # 新增來源 IP 記錄
-        "request": request_body.decode("utf-8") if request_body else None,
-        "response": response.body.decode("utf-8"),
-        "status_code": status_code  # 新增狀態碼記錄
-    }
-    response_log = response.body.decode("utf-8")
-    # 將 log 訊息寫入到日誌檔
-    # logging.info(json.dumps(log_message))
-    logging.info(f"{api_name} response {response_log} and status code: {status_code}")
-    
-    return response
+# 中間件，用來紀錄每個 API 呼叫的詳情，依 ACCESS_LOG_SAMPLE_RATE 取樣
+app.add_middleware(AccessLogMiddleware, sample_rate=ACCESS_LOG_SAMPLE_RATE, body_limit=ACCESS_LOG_BODY_LIMIT)
 
 @app.post('/subscribe') # 接收訂閱請求
 async def subscribe(request: Request, subscription: SubscriptionRequest):
@@ -121,234 +117,234 @@ async def subscribe(request: Request, subscription: SubscriptionRequest):
         raise HTTPException(status_code=400, detail="Invalid input")
 
     # 檢查請求中的serviceType是否存在
-    try:
-        with open(SERVICESPEC_FILE, 'r') as serviceSpec_jsonFile:
-            try:
-                serviceSpec_data = json.load(serviceSpec_jsonFile)
-                for serviceSpec in serviceSpec_data:
-                    if serviceSpec['serviceType'] == serviceType:
-                        serviceNotFound = False
-                        break
-                if (serviceNotFound):
-                    raise HTTPException(status_code=500, detail="Service not in serviceSpec file")
-            except json.decoder.JSONDecodeError: 
-                raise HTTPException(status_code=500, detail="ServiceSpec file is empty")
-    except FileNotFoundError:
-        raise HTTPException(status_code=500, detail="ServiceSpec file not found")
-
-    global locked
-    while locked:
-        await asyncio.sleep(1)
-
-    locked = True
-    agentCounter = 1
-    with open(SUBSCRIPTION_FILE, 'r') as subscription_jsonFile:
-        try:
-            subscription_list = json.load(subscription_jsonFile)
-        except json.decoder.JSONDecodeError: 
-            subscription_list = []
+    if not cluster_state.serviceSpec_list:
+        raise HTTPException(status_code=500, detail="ServiceSpec file is empty")
+    if serviceType in cluster_state.serviceSpec_dict:
+        serviceNotFound = False
+    if (serviceNotFound):
+        raise HTTPException(status_code=500, detail="Service not in serviceSpec file")
+
+    demand_forecaster.record_arrival(serviceType)
+    async with service_locks.hold(serviceType):
+        agentCounter = 1
+        agentCounter += cluster_state.subscriptions.count(serviceType)
+        relation_list = await compute_frequnecy(serviceType, agentCounter)
+
+        newAgentCounter = 0
+        for relation in relation_list:
+            if relation['serviceType'] == serviceType:
+                newAgentCounter += int(relation['currentConnection'])
     
-    agentCounter += sum(1 for subscription in subscription_list if subscription['serviceType'] == serviceType)
-    relation_list = compute_frequnecy(serviceType, agentCounter)
-
-    newAgentCounter = 0
-    for relation in relation_list:
-        if relation['serviceType'] == serviceType:
-            newAgentCounter += int(relation['currentConnection'])
-    
-    if newAgentCounter == (agentCounter-1):
-        locked = False
-        return 'reject the subscription' 
-    elif newAgentCounter == agentCounter:
-        with open(SERVICE_FILE, 'w') as service_jsonFile:
-            json.dump(relation_list, service_jsonFile, indent=4)
-
-        # 這邊adjust_frequency只會調整new agent以外的配對關係
-        serviceIndex = adjust_frequency(serviceType)
-
-        with open(SUBSCRIPTION_FILE, 'r') as subscription_jsonFile:
-            try:
-                subscription_list = json.load(subscription_jsonFile)
-            except json.decoder.JSONDecodeError: 
-                subscription_list = []
-
-        if serviceIndex is None:
-            locked = False
-            logging.info(f"Function adjust_frequency() return None")
-            return 'controller program bug'
+        if newAgentCounter == (agentCounter-1):
+            return 'reject the subscription' 
+        elif newAgentCounter == agentCounter:
+            # 配對關係與新的訂閱在同一個 mutate() 中寫入，之後才 await 通知其他Agent
+            notification_list, service = admit_agent(relation_list, serviceType, agent_ip, agent_port)
+            await notify_agents(notification_list, [serviceType])
+
+            if service is None:
+                logging.info("Function admit_agent() return None")
+                return 'controller program bug'
+            else:
+                return {
+                    "IP": service['hostIP'],
+                    "Port": service['hostPort'],
+                    "Frequency": service['currentFrequency']
+                }
         else:
-            subscription_list.append({
-                "agentIP": agent_ip,
-                "agentPort": agent_port,
-                "podIP": relation_list[serviceIndex]['podIP'],
-                "serviceType": serviceType,
-                "nodeName": relation_list[serviceIndex]['nodeName']            
-            })
-        with open(SUBSCRIPTION_FILE, 'w') as subscription_jsonFile:
-            json.dump(subscription_list, subscription_jsonFile, indent=4)
-            locked = False
-            return {
-                "IP": relation_list[serviceIndex]['hostIP'],
-                "Port": relation_list[serviceIndex]['hostPort'],
-                "Frequency": relation_list[serviceIndex]['currentFrequency']
-            }
-    else:
-        locked = False
-        return f"newAgentCounter={newAgentCounter} and agentCounter={agentCounter}" 
+            return f"newAgentCounter={newAgentCounter} and agentCounter={agentCounter}" 
+
+# 故障通知先放進佇列，由 alert_worker() 依序處理
+alert_queue = asyncio.Queue()
+# workernode_failure 每個處理階段花費的時間
+recovery_timer = StageTimer()
 
 @app.post('/alert')
 async def alert(request: Request):
 
-    global locked
-    while locked:
-        await asyncio.sleep(1)
-    locked = True    
     data = await request.json()
-    alertType = data['alertType']
-    alertContent = data['alertContent']
-
-    # 處理Computing Node 故障的Case
+    if data['alertType'] == 'workernode_failure':
+        # 在排隊等待處理之前就不再部署到故障的節點上
+        node_health.mark_unhealthy(data['alertContent']['nodeName'])
+    alert_queue.put_nowait((data['alertType'], data['alertContent'], time.perf_counter()))
+    return (f"message: Alert {data['alertType']} accepted")
+
+async def alert_worker():
+    while True:
+        alertType, alertContent, receivedTime = await alert_queue.get()
+        try:
+            await handle_alert(alertType, alertContent)
+            logging.info(f"Alert {alertType} handled {time.perf_counter() - receivedTime:.3f} seconds after it was received")
+        except Exception:
+            logging.exception(f"Failed to handle alert {alertType} {alertContent}")
+        finally:
+            if alertType == 'workernode_failure':
+                # 節點之後是否能再部署，由下一次檢查決定
+                node_health.failure_handled(alertContent['nodeName'])
+            alert_queue.task_done()
+
+async def handle_alert(alertType: str, alertContent: dict):
+
+    # 節點故障會影響該節點上所有類型的服務，Pod 故障只影響該 Pod 的服務類型
     if alertType == 'workernode_failure':
-        
-        failnodeName = alertContent['nodeName']
+        lockedServiceType_list = list(cluster_state.serviceSpec_dict.keys())
+    else:
+        lockedServiceType_list = [str(alertContent['podName']).split('-')[0]]
 
-        # 將故障的Computing Node上的所有服務從資料中清除
-        try:
-            with open(SERVICE_FILE, 'r') as service_file:
-                try:
-                    service_list = json.load(service_file)
-                except json.decoder.JSONDecodeError:
-                    service_list = []
-        except FileNotFoundError:
-            raise HTTPException(status_code=500, detail="Service file not found")
+    async with service_locks.hold(*lockedServiceType_list):
+        # 處理Computing Node 故障的Case
+        if alertType == 'workernode_failure':
         
-        failed_service_list = [item for item in service_list if item.get('nodeName') == failnodeName]
-        service_list = [item for item in service_list if item.get('nodeName') != failnodeName]
-
-        try:
-            with open(SERVICE_FILE, 'w') as service_file:
-                json.dump(service_list, service_file, indent=4)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail="Failed to write to service file")
-
-        # 處理故障節點上的所有service
-        for failed_service in failed_service_list:
-            
-            # 從k8s中刪除service
-            delete_pod(str(failed_service['serviceType'])+'-'+str(failed_service['nodeName'])+'-'+str(failed_service['hostPort']),'default')
-            
-            # 打開訂閱資料
-            try:
-                with open(SUBSCRIPTION_FILE, 'r') as subscription_jsonFile:
-                    try:
-                        subscription_list = json.load(subscription_jsonFile)
-                    except json.decoder.JSONDecodeError:
-                        subscription_list = []
-            except FileNotFoundError:
-                raise HTTPException(status_code=500, detail="Subscription file not found")
-            
-            # 若沒有任何終端訂閱故障service
-            if failed_service['currentConnection'] == 0:
-                continue
-
-            # 若有終端訂閱故障之service
-            agentCounter = 0
-            agentCounter += sum(1 for subscription in subscription_list if subscription['serviceType'] == failed_service['serviceType'])
-            relation_list = compute_frequnecy(str(failed_service['serviceType']), agentCounter)
-
-            # 計算最後有多少Agent能使用服務 
-            newAgentCounter = 0
-            for relation in relation_list:
-                if relation['serviceType'] == str(failed_service['serviceType']):
-                    newAgentCounter += int(relation['currentConnection'])
-
-            # 若非所有Agent都能使用服務
-            if newAgentCounter < agentCounter:
-                count = 0
-                unsunscribedAgentCounter = agentCounter - newAgentCounter
-                for i in reversed(range(len(subscription_list))):
-                    if subscription_list[i]['podIP'] == str(failed_service['podIP']):
-                        del subscription_list[i]
-                        count += 1
-                        if count >= unsunscribedAgentCounter:
-                            break
-                with open(SUBSCRIPTION_FILE, 'w') as subscription_file:
-                    json.dump(subscription_list, subscription_file, indent=4)
-
-            # 將新的配對方式存入service_file中
-            with open(SERVICE_FILE, 'w') as service_file:
-                json.dump(relation_list, service_file, indent=4)                
-            adjust_frequency(str(failed_service['serviceType']))        
-    elif alertType == 'pod_failure':
-
-        failPodName = str(alertContent['podName'])
-        serviceType, nodeName, hostPort = failPodName.split('-')
-        hostPort = int(hostPort)
-        delete_pod(failPodName)
-
-        with open(SERVICE_FILE, 'r') as service_file:
-            try:
-                service_list = json.load(service_file)
-            except json.decoder.JSONDecodeError:
-                service_list = []
-
-        # 找到符合條件的元素
-        failed_service = next(
-            (service for service in service_list if 
-                service['serviceType'] == serviceType and 
-                service['nodeName'] == nodeName and 
-                service['hostPort'] == hostPort), 
-            None  # 若找不到，返回 None
-        )
-
-        # 如果找到，則從 service_list 刪除
-        if failed_service:
-            service_list.remove(failed_service)
-
-        with open(SERVICE_FILE, 'w') as service_file:
-            json.dump(service_list, service_file, indent=4)
-
-        if failed_service['currentConnection'] != 0:
-
-            # 打開訂閱資料
-            try:
-                with open(SUBSCRIPTION_FILE, 'r') as subscription_jsonFile:
-                    try:
-                        subscription_list = json.load(subscription_jsonFile)
-                    except json.decoder.JSONDecodeError:
-                        subscription_list = []
-            except FileNotFoundError:
-                raise HTTPException(status_code=500, detail="Subscription file not found")
-            
-            agentCounter = 0
-            agentCounter += sum(1 for subscription in subscription_list if subscription['serviceType'] == failed_service['serviceType'])
-            relation_list = compute_frequnecy(str(failed_service['serviceType']), agentCounter)
-
-            # 計算最後有多少Agent能使用服務 
-            newAgentCounter = 0
-            for relation in relation_list:
-                if relation['serviceType'] == str(failed_service['serviceType']):
-                    newAgentCounter += int(relation['currentConnection'])
-
-            # 若非所有Agent都能使用服務
-            if newAgentCounter < agentCounter:
-                count = 0
-                unsunscribedAgentCounter = agentCounter - newAgentCounter
-                for i in reversed(range(len(subscription_list))):
-                    if subscription_list[i]['podIP'] == str(failed_service['podIP']):
-                        del subscription_list[i]
-                        count += 1
-                        if count >= unsunscribedAgentCounter:
-                            break
-                with open(SUBSCRIPTION_FILE, 'w') as subscription_file:
-                    json.dump(subscription_list, subscription_file, indent=4)
-
-            with open(SERVICE_FILE, 'w') as service_file:
-                json.dump(relation_list, service_file, indent=4)
-
-        adjust_frequency(str(failed_service['serviceType']))  
-    locked = False
-    return (f"message: Alert {alertType} handled successfully")
+            failnodeName = alertContent['nodeName']
+            recoveryStart = time.perf_counter()
+            # 將故障的Computing Node上的備用Pod與所有服務從資料中清除
+            failedPodName_list = []
+            for standby in warm_pool.on_node(failnodeName):
+                warm_pool.remove(standby['podName'], failed=True)
+                failedPodName_list.append(standby['podName'])
+            warm_pool.wakeup()
+            with cluster_state.mutate(SERVICES):
+                service_list = cluster_state.service_list
+                failed_service_list = [item for item in service_list if item.get('nodeName') == failnodeName]
+                cluster_state.service_list = [item for item in service_list if item.get('nodeName') != failnodeName]
+            for failed_service in failed_service_list:
+                failedPodName_list.append(str(failed_service['serviceType'])+'-'+str(failed_service['nodeName'])+'-'+str(failed_service['hostPort']))
+
+            # 1. 同時從k8s中刪除故障節點上的所有Pod
+            with recovery_timer.stage("delete"):
+                result_list = await asyncio.gather(
+                    *(worker_pool.run(delete_pod, podName, 'default') for podName in failedPodName_list),
+                    return_exceptions=True,
+                )
+            for podName, result in zip(failedPodName_list, result_list):
+                if isinstance(result, Exception):
+                    logging.error(f"Failed to delete Pod {podName}: {result}")
+
+            # 有終端訂閱的故障service一起重新分配
+            agentCounter_dict = {}
+            for failed_service in failed_service_list:
+                if failed_service['currentConnection'] != 0:
+                    agentCounter_dict[str(failed_service['serviceType'])] = cluster_state.subscriptions.count(failed_service['serviceType'])
+            if agentCounter_dict:
+                # 2. 缺少的 instance 一起部署
+                with recovery_timer.stage("deploy"):
+                    scaleOut_list = scale_out_service_types(agentCounter_dict)
+                    if scaleOut_list:
+                        await deploy_services(scaleOut_list)
+
+                # 3. 每個受影響的 serviceType 重新分配一次
+                with recovery_timer.stage("reoptimize"), cluster_state.mutate(SERVICES, SUBSCRIPTIONS):
+                    relation_list = reallocate_agents(agentCounter_dict, scaleOut_list)
+
+                    for failed_service in failed_service_list:
+                        agentCounter = agentCounter_dict.get(str(failed_service['serviceType']))
+                        if agentCounter is None:
+                            continue
+
+                        # 計算最後有多少Agent能使用服務
+                        newAgentCounter = 0
+                        for relation in relation_list:
+                            if relation['serviceType'] == str(failed_service['serviceType']):
+                                newAgentCounter += int(relation['currentConnection'])
+
+                        # 若非所有Agent都能使用服務
+                        if newAgentCounter < agentCounter:
+                            count = 0
+                            unsunscribedAgentCounter = agentCounter - newAgentCounter
+                            for subscriptionId in reversed(cluster_state.subscriptions.ids_on_pod(str(failed_service['podIP']))):
+                                subscription = cluster_state.subscriptions.remove(subscriptionId)
+                                agent_notifier.forget(subscription['agentIP'], subscription['agentPort'], subscription['serviceType'])
+                                count += 1
+                                if count >= unsunscribedAgentCounter:
+                                    break
+
+                    # 將新的配對方式存入service_file中，和取消的訂閱、移動的配對是同一筆 journal
+                    cluster_state.service_list = relation_list
+                    notification_list = collect_notifications(list(agentCounter_dict))
+
+                # 4. 同時通知所有受影響的Agent
+                with recovery_timer.stage("notify"):
+                    await notify_agents(notification_list, list(agentCounter_dict))
+
+            recovery_timer.record("total", time.perf_counter() - recoveryStart)
+            logging.info(
+                f"Recovery of {failnodeName}: "
+                + ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in recovery_timer.last().items())
+            )
+        elif alertType == 'pod_failure':
+
+            failPodName = str(alertContent['podName'])
+            if warm_pool.remove(failPodName, failed=True) is not None:
+                # 故障的是備用Pod，沒有Agent受影響
+                await worker_pool.run(delete_pod, failPodName)
+                warm_pool.wakeup()
+                return (f"message: Alert {alertType} handled successfully")
+            serviceType, nodeName, hostPort = failPodName.split('-')
+            hostPort = int(hostPort)
+            await worker_pool.run(delete_pod, failPodName)
+
+            with cluster_state.mutate(SERVICES):
+                service_list = cluster_state.service_list
+
+                # 找到符合條件的元素
+                failed_service = next(
+                    (service for service in service_list if 
+                        service['serviceType'] == serviceType and 
+                        service['nodeName'] == nodeName and 
+                        service['hostPort'] == hostPort), 
+                    None  # 若找不到，返回 None
+                )
+
+                # 如果找到，則從 service_list 刪除
+                if failed_service:
+                    service_list.remove(failed_service)
+
+            if failed_service['currentConnection'] != 0:
+
+                agentCounter = 0
+                agentCounter += cluster_state.subscriptions.count(failed_service['serviceType'])
+                relation_list = await compute_frequnecy(str(failed_service['serviceType']), agentCounter)
+
+                # 計算最後有多少Agent能使用服務 
+                newAgentCounter = 0
+                for relation in relation_list:
+                    if relation['serviceType'] == str(failed_service['serviceType']):
+                        newAgentCounter += int(relation['currentConnection'])
+
+                with cluster_state.mutate(SERVICES, SUBSCRIPTIONS):
+                    # 若非所有Agent都能使用服務
+                    if newAgentCounter < agentCounter:
+                        count = 0
+                        unsunscribedAgentCounter = agentCounter - newAgentCounter
+                        for subscriptionId in reversed(cluster_state.subscriptions.ids_on_pod(str(failed_service['podIP']))):
+                            subscription = cluster_state.subscriptions.remove(subscriptionId)
+                            agent_notifier.forget(subscription['agentIP'], subscription['agentPort'], subscription['serviceType'])
+                            count += 1
+                            if count >= unsunscribedAgentCounter:
+                                break
+
+                    cluster_state.service_list = relation_list
+                    notification_list = collect_notifications([str(failed_service['serviceType'])])
+                await notify_agents(notification_list, [str(failed_service['serviceType'])])
+            else:
+                await adjust_frequency(str(failed_service['serviceType']))
+        return (f"message: Alert {alertType} handled successfully")
+
+@app.get('/metrics')
+async def metrics():
+    return {
+        "locks": service_locks.metrics(),
+        "agentNotifier": agent_notifier.metrics(),
+        "eventLoop": loop_monitor.metrics(),
+        "workerPool": worker_pool.metrics(),
+        "alertQueue": alert_queue.qsize(),
+        "warmPool": warm_pool.metrics(),
+        "demandForecast": demand_forecaster.metrics(),
+        "hostPorts": port_allocator.metrics(),
+        "nodeHealth": node_health.metrics(),
+        "recovery": recovery_timer.metrics(),
+        "state": cluster_state.metrics(),
+    }
 
 @app.post('/deploypod')
 async def deploypod(request: Request):
@@ -357,21 +353,10 @@ async def deploypod(request: Request):
     hostPort = int(data['hostPort'])
     service_type = str(data['service_type'])
     serviceamountonnode = int(data['amount'])
-    resp = deploy_pod(service_type,hostPort, node_name)
-
-    try:
-        with open(SERVICE_FILE, 'r') as service_jsonFile:
-            try:
-                service_data = json.load(service_jsonFile)
-            except json.decoder.JSONDecodeError: # 要是當前集群中沒有任何Pod
-                service_data = []
-    except FileNotFoundError:
-        return "Service file not found"
-
-    with open(SERVICESPEC_FILE, 'r') as serviceSpec_jsonFile:
-        serviceSpec_list = json.load(serviceSpec_jsonFile)
-    
-    for serviceSpec in serviceSpec_list:
+    port_allocator.reserve(service_type, node_name, hostPort)
+    resp = await deploy_pod(service_type,hostPort, node_name)
+
+    for serviceSpec in cluster_state.serviceSpec_list:
         if serviceSpec['serviceType'] == service_type:
             workloadLimit = serviceSpec['workAbility'][node_name]
             frequencyLimit = serviceSpec['frequencyLimit']
@@ -389,20 +374,18 @@ async def deploypod(request: Request):
         else:
             workloadLimit = 255
     """
-    service_data.append({
-        "podIP" : str(resp.status.pod_ip),
-        "hostPort" : int(hostPort),
-        "serviceType" : service_type,
-        "currentConnection" : 0,
-        "nodeName" : str(node_name),
-        "hostIP" : str(resp.status.host_ip),
-        "frequencyLimit" : frequencyLimit,
-        "currentFrequency" : frequencyLimit[0],
-        "workloadLimit" : workloadLimit/serviceamountonnode        
-    })
-
-    with open(SERVICE_FILE, 'w') as service_file:
-        json.dump(service_data, service_file, indent=4)     
+    with cluster_state.mutate(SERVICES):
+        cluster_state.service_list.append({
+            "podIP" : str(resp.status.pod_ip),
+            "hostPort" : int(hostPort),
+            "serviceType" : service_type,
+            "currentConnection" : 0,
+            "nodeName" : str(node_name),
+            "hostIP" : str(resp.status.host_ip),
+            "frequencyLimit" : frequencyLimit,
+            "currentFrequency" : frequencyLimit[0],
+            "workloadLimit" : workloadLimit/serviceamountonnode        
+        })
 
     return 'deploy finish'
 
@@ -412,47 +395,29 @@ async def unsubscribe(request: Request):
     agent_ip = request.client.host
     agent_port = data['port']
 
-    try:
-        with open(SUBSCRIPTION_FILE, 'r') as subscription_jsonFile:
-            try:
-                subscription_data = json.load(subscription_jsonFile)
-            except json.decoder.JSONDecodeError:
-                subscription_data = []
-    except FileNotFoundError:
-        raise HTTPException(status_code=404, detail= "Subscription file not found")
-    
-    new_subscription_data = []
-    podip_set = set()
+    subscriptions = cluster_state.subscriptions
+    serviceType_set = {subscriptions[subscriptionId]['serviceType'] for subscriptionId in subscriptions.ids_of_agent(agent_ip, agent_port)}
 
-    for subscription in subscription_data:
-        if str(subscription['agentIP']) == str(agent_ip) and int(subscription['agentPort']) == int(agent_port):
-            podip_set.add(subscription['podIP'])
-            message = "unsubscribe successfully"
-        else:
-            new_subscription_data.append(subscription)
+    async with service_locks.hold(*serviceType_set):
+        podip_list = []
+        # 取消的訂閱、連線數與移動的配對是同一筆 journal，之後才 await 通知
+        with cluster_state.mutate(SERVICES, SUBSCRIPTIONS):
+            for subscriptionId in subscriptions.ids_of_agent(agent_ip, agent_port):
+                subscription = subscriptions.remove(subscriptionId)
+                agent_notifier.forget(subscription['agentIP'], subscription['agentPort'], subscription['serviceType'])
+                podip_list.append(subscription['podIP'])
+                message = "unsubscribe successfully"
 
-    try:
-        with open(SUBSCRIPTION_FILE, 'w') as subscription_file:
-            json.dump(new_subscription_data, subscription_file, indent=4)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="Failed to write to subscription file")
-    
-    try:
-        with open(SERVICE_FILE, 'r') as service_jsonFile:
-            try:
-                service_data = json.load(service_jsonFile)
-            except json.decoder.JSONDecodeError: # 要是當前集群中沒有任何Pod
+            if not cluster_state.service_list:
                 raise HTTPException(status_code=404, detail= "Service file is empty")
-    except FileNotFoundError:
-        raise HTTPException(status_code=404, detail= "Service file not found")
-    
-    for service in service_data:
-        # 更新服務當前的連線數
-        if service['podIP'] in podip_set:
-            service['currentConnection'] -=1 
 
-    with open(SERVICE_FILE, 'w') as service_jsonFile:
-        json.dump(service_data, service_jsonFile, indent=4)
+            # 更新服務當前的連線數，頻率有改變的服務類型要通知其他Agent
+            adjustFrequencyServiceType_list = []
+            for podIP in podip_list:
+                serviceType, frequencyChanged = release_agent(podIP)
+                if frequencyChanged and serviceType not in adjustFrequencyServiceType_list:
+                    adjustFrequencyServiceType_list.append(serviceType)
+            notification_list = collect_notifications(adjustFrequencyServiceType_list)
+        await notify_agents(notification_list, adjustFrequencyServiceType_list)
 
     return {'message' : 'unsubscribe finish'}
-
@@ -0,0 +1,73 @@
+from collections import deque
+from typing import Dict
+
+
+def holt(series, alpha: float, beta: float) -> tuple:
+    """Holt's linear exponential smoothing of series, returns the final (level, trend)."""
+    level = None
+    trend = 0.0
+    for value in series:
+        if level is None:
+            level = float(value)
+            continue
+        previousLevel = level
+        level = alpha * value + (1 - alpha) * (level + trend)
+        trend = beta * (level - previousLevel) + (1 - beta) * trend
+    return (0.0 if level is None else level), trend
+
+
+class DemandForecaster:
+    """
+    Projects the number of subscriptions of every serviceType from the
+    Controller's own subscribe/unsubscribe history.
+
+    sample() is called once per interval with the current subscription count
+    of every serviceType; the last window samples are smoothed with Holt's
+    linear method and forecast() extrapolates the level and trend horizon
+    intervals ahead. The trend is the net arrival rate in agents per interval.
+    """
+
+    def __init__(self, window: int, alpha: float, beta: float, horizon: int):
+        self._window = window
+        self._alpha = alpha
+        self._beta = beta
+        self._horizon = horizon
+        self._series: Dict[str, deque] = {}
+        self._arrivals: Dict[str, int] = {}
+        self._arrivalRate: Dict[str, float] = {}
+        self._fit: Dict[str, tuple] = {}
+
+    def record_arrival(self, serviceType: str):
+        self._arrivals[serviceType] = self._arrivals.get(serviceType, 0) + 1
+
+    def sample(self, count_dict: Dict[str, int]):
+        for serviceType, count in count_dict.items():
+            series = self._series.setdefault(serviceType, deque(maxlen=self._window))
+            series.append(count)
+            self._fit[serviceType] = holt(series, self._alpha, self._beta)
+            arrivals = self._arrivals.pop(serviceType, 0)
+            previousRate = self._arrivalRate.get(serviceType)
+            self._arrivalRate[serviceType] = float(arrivals) if previousRate is None else (
+                self._alpha * arrivals + (1 - self._alpha) * previousRate
+            )
+
+    def forecast(self, serviceType: str) -> float:
+        """Projected subscriptions of serviceType horizon intervals ahead, never below the current count."""
+        series = self._series.get(serviceType)
+        if not series:
+            return 0.0
+        level, trend = self._fit[serviceType]
+        return max(float(series[-1]), level + self._horizon * trend)
+
+    def metrics(self) -> dict:
+        return {
+            serviceType: {
+                "current": series[-1],
+                "level": self._fit[serviceType][0],
+                "trend": self._fit[serviceType][1],
+                "arrivalRate": self._arrivalRate.get(serviceType, 0.0),
+                "forecast": self.forecast(serviceType),
+            }
+            for serviceType, series in self._series.items() if series
+        }
+
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import threading
+from typing import List, Optional
+
+
+def diff_collection(previous: dict, current: dict) -> Optional[dict]:
+    """
+    Change from previous to current, both key -> entry in list order:
+    {"put": {key: entry}, "del": [key], "order": [key]}. "order" is only
+    there when the keys are not in the order put and del alone give.
+    Returns None if nothing changed.
+    """
+    put = {key: entry for key, entry in current.items() if previous.get(key) != entry}
+    deleted = [key for key in previous if key not in current]
+    if not put and not deleted:
+        if list(previous) == list(current):
+            return None
+    change = {}
+    if put:
+        change["put"] = put
+    if deleted:
+        change["del"] = deleted
+    expected = [key for key in previous if key in current] + [key for key in current if key not in previous]
+    if expected != list(current):
+        change["order"] = list(current)
+    return change
+
+
+def apply_change(collection: dict, change: dict) -> dict:
+    """Apply a change of diff_collection() to collection (key -> entry) and return it."""
+    for key in change.get("del", ()):
+        collection.pop(key, None)
+    for key, entry in change.get("put", {}).items():
+        collection[key] = entry
+    if "order" in change:
+        collection = {key: collection[key] for key in change["order"] if key in collection}
+    return collection
+
+
+class StateJournal:
+    """
+    Append-only journal of state changes, one JSON line per record.
+
+    A record is written with a single write() and flushed on the caller's
+    thread: a buffered write into the page cache of some microseconds, and
+    the record survives the process dying right after. With fsync the
+    records are also synced to disk, but by sync() from another thread, so
+    the caller never waits for the disk; a machine crash can lose what was
+    appended since the last sync(). A crash can only leave the last line
+    incomplete, replay() skips it.
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        self._path = path
+        self._fsync = fsync
+        self._file = None
+        # sync() reads the file from another thread
+        self._file_lock = threading.Lock()
+        self._unsynced = False
+        self.records = 0
+
+    def open(self):
+        with self._file_lock:
+            if self._file is None:
+                self._file = open(self._path, 'a', encoding='utf-8')
+
+    def close(self):
+        self.sync()
+        self._close()
+
+    def _close(self):
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._unsynced = False
+
+    def append(self, record: dict):
+        self.open()
+        with self._file_lock:
+            self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._file.flush()
+            self._unsynced = self._fsync
+        self.records += 1
+
+    def sync(self):
+        """fsync the records appended since the last sync(), if the journal was opened with fsync."""
+        with self._file_lock:
+            if not self._unsynced or self._file is None:
+                return
+            self._unsynced = False
+            # a duplicate of the descriptor stays valid if the journal is closed meanwhile
+            fd = os.dup(self._file.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def rotate(self) -> Optional[str]:
+        """Move the records so far to <path>.prev and start an empty journal, returns the old journal's path."""
+        # 由 compact() 持有 state lock 時呼叫，不在這裡等待 fsync，之後的 snapshot 會 fsync
+        self._close()
+        self.records = 0
+        previous_path = f"{self._path}.prev"
+        if not os.path.exists(self._path):
+            return previous_path if os.path.exists(previous_path) else None
+        if os.path.exists(previous_path):
+            # the last compaction did not finish, keep its records too
+            with open(self._path, 'r', encoding='utf-8') as journalFile, \
+                    open(previous_path, 'a', encoding='utf-8') as previousFile:
+                previousFile.write(journalFile.read())
+            os.remove(self._path)
+        else:
+            os.replace(self._path, previous_path)
+        return previous_path
+
+    def replay(self) -> List[dict]:
+        """Records of <path>.prev, left by an unfinished compaction, and of the journal, oldest first."""
+        record_list = []
+        for path in (f"{self._path}.prev", self._path):
+            try:
+                with open(path, 'r', encoding='utf-8') as journalFile:
+                    for line in journalFile:
+                        try:
+                            record_list.append(json.loads(line))
+                        except json.decoder.JSONDecodeError:
+                            logging.warning(f"Skip an incomplete record of {path}")
+            except FileNotFoundError:
+                continue
+        return record_list
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+from .config import KUBE_WATCH_TIMEOUT
+from .kube_client import kube_client
+
+
+def node_entry(node) -> dict:
+    ip = None
+    for address in node.status.addresses or ():
+        if address.type == "InternalIP":
+            ip = address.address
+            break
+    return {
+        "name": node.metadata.name,
+        "ip": ip,
+        "labels": dict(node.metadata.labels or {}),
+    }
+
+
+def pod_entry(pod) -> dict:
+    ready = False
+    for condition in pod.status.conditions or ():
+        if condition.type == 'Ready' and condition.status == 'True':
+            ready = True
+    return {
+        "name": pod.metadata.name,
+        "serviceType": (pod.metadata.labels or {}).get('app'),
+        "phase": pod.status.phase,
+        "ready": ready,
+        "podIP": pod.status.pod_ip,
+        "hostIP": pod.status.host_ip,
+        "nodeName": pod.spec.node_name,
+        "terminating": pod.metadata.deletion_timestamp is not None,
+        "object": pod,
+    }
+
+
+class KubeCache:
+    """
+    Informer style cache of the cluster's nodes and of the service pods
+    (label ``app=<serviceType>``) in namespace.
+
+    Each kind is listed once and then kept up to date by a watch.Watch stream
+    on a daemon thread; the stream is re-listed when the resourceVersion
+    expires or the connection drops. Until a kind has been listed, the
+    lookups return None and callers fall back to the Kubernetes API.
+
+    Coroutines can wait_for_pod() until a pod event satisfies a predicate,
+    the watch thread wakes them through their event loop.
+    """
+
+    def __init__(self, namespace: str = 'default', watch_timeout: int = KUBE_WATCH_TIMEOUT):
+        self._namespace = namespace
+        self._watch_timeout = watch_timeout
+        self._lock = threading.Lock()
+        self._nodes: Dict[str, dict] = {}
+        self._pods: Dict[str, dict] = {}
+        self._synced = {"nodes": threading.Event(), "pods": threading.Event()}
+        self._stopped = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._watches: List[watch.Watch] = []
+        self._pod_waiters: Dict[str, List[tuple]] = {}
+        self._pod_listeners: List[Callable] = []
+
+    def start(self, serviceType_list: Iterable[str]):
+        if self._threads:
+            return
+        self._stopped.clear()
+        core_api = kube_client.core_api()
+        label_selector = f"app in ({','.join(sorted(serviceType_list))})"
+        self._threads = [
+            threading.Thread(
+                target=self._run,
+                args=("nodes", self._nodes, node_entry, None, core_api.list_node, {}),
+                name='kube-cache-nodes',
+                daemon=True,
+            ),
+            threading.Thread(
+                target=self._run,
+                args=("pods", self._pods, pod_entry, self._pod_changed, core_api.list_namespaced_pod,
+                      {"namespace": self._namespace, "label_selector": label_selector}),
+                name='kube-cache-pods',
+                daemon=True,
+            ),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        for w in list(self._watches):
+            w.stop()
+        # the threads are daemons and may sit in a blocking read until the next event
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._threads = []
+        for synced in self._synced.values():
+            synced.clear()
+
+    def wait_synced(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for synced in self._synced.values():
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not synced.wait(remaining):
+                return False
+        return True
+
+    def _run(self, kind: str, store: dict, make_entry: Callable, on_change: Optional[Callable],
+             list_func: Callable, kwargs: dict):
+        backoff = 1
+        while not self._stopped.is_set():
+            try:
+                resp = list_func(**kwargs)
+                with self._lock:
+                    previous_name_set = set(store)
+                    store.clear()
+                    for item in resp.items:
+                        store[item.metadata.name] = make_entry(item)
+                    if on_change is not None:
+                        # deleted while the watch was down
+                        for name in previous_name_set - set(store):
+                            on_change(name, None)
+                        # a pod missing from the list may just not be created yet, only a DELETED event ends a wait
+                        for name in list(self._pod_waiters):
+                            if name in store:
+                                on_change(name, store[name])
+                self._synced[kind].set()
+                resource_version = resp.metadata.resource_version
+                while not self._stopped.is_set():
+                    w = watch.Watch()
+                    self._watches.append(w)
+                    try:
+                        for event in w.stream(
+                            list_func,
+                            resource_version=resource_version,
+                            timeout_seconds=self._watch_timeout,
+                            _request_timeout=self._watch_timeout + 10,
+                            **kwargs,
+                        ):
+                            if event['type'] not in ('ADDED', 'MODIFIED', 'DELETED'):
+                                continue
+                            item = event['object']
+                            with self._lock:
+                                if event['type'] == 'DELETED':
+                                    store.pop(item.metadata.name, None)
+                                else:
+                                    store[item.metadata.name] = make_entry(item)
+                                if on_change is not None:
+                                    on_change(item.metadata.name, store.get(item.metadata.name))
+                            resource_version = item.metadata.resource_version
+                    finally:
+                        self._watches.remove(w)
+                backoff = 1
+            except ApiException as e:
+                if e.status != 410:
+                    logging.warning(f"Watching {kind} failed: {e}")
+                    self._stopped.wait(backoff)
+                    backoff = min(backoff * 2, 30)
+            except Exception as e:
+                logging.warning(f"Watching {kind} failed: {e}")
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def nodes(self) -> Optional[List[dict]]:
+        if not self._synced["nodes"].is_set():
+            return None
+        with self._lock:
+            return [dict(node) for node in self._nodes.values()]
+
+    def node(self, node_name: str) -> Optional[dict]:
+        """The cached node, or None if it is unknown or the cache is not synced."""
+        if not self._synced["nodes"].is_set():
+            return None
+        with self._lock:
+            return self._nodes.get(node_name)
+
+    def pod(self, pod_name: str) -> Optional[dict]:
+        if not self._synced["pods"].is_set():
+            return None
+        with self._lock:
+            return self._pods.get(pod_name)
+
+    def pods(self) -> Optional[List[dict]]:
+        if not self._synced["pods"].is_set():
+            return None
+        with self._lock:
+            return list(self._pods.values())
+
+    def pods_synced(self) -> bool:
+        return self._synced["pods"].is_set()
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, pod: Optional[dict]):
+        if not future.done():
+            future.set_result(pod)
+
+    def add_pod_listener(self, listener: Callable[[str, Optional[dict]], None]):
+        """Call listener(pod_name, pod) from the watch thread on every pod change, pod is None once it is deleted."""
+        self._pod_listeners.append(listener)
+
+    def _pod_changed(self, pod_name: str, pod: Optional[dict]):
+        # called by the watch thread with self._lock held, pod is None once it is deleted
+        for listener in self._pod_listeners:
+            try:
+                listener(pod_name, pod)
+            except Exception as e:
+                logging.error(f"Pod listener failed on {pod_name}: {e}")
+        waiter_list = self._pod_waiters.get(pod_name)
+        if not waiter_list:
+            return
+        for waiter in list(waiter_list):
+            predicate, loop, future = waiter
+            if pod is None or predicate(pod):
+                waiter_list.remove(waiter)
+                loop.call_soon_threadsafe(self._resolve, future, pod)
+        if not waiter_list:
+            del self._pod_waiters[pod_name]
+
+    async def wait_for_pod(self, pod_name: str, predicate: Callable[[dict], bool], timeout: float) -> Optional[dict]:
+        """
+        Wait until the cached pod satisfies predicate and return it. Returns
+        None if the pod is deleted or timeout expires first.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (predicate, loop, future)
+        with self._lock:
+            pod = self._pods.get(pod_name)
+            if pod is not None and predicate(pod):
+                return pod
+            self._pod_waiters.setdefault(pod_name, []).append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._lock:
+                waiter_list = self._pod_waiters.get(pod_name)
+                if waiter_list and waiter in waiter_list:
+                    waiter_list.remove(waiter)
+                    if not waiter_list:
+                        del self._pod_waiters[pod_name]
+
+
+kube_cache = KubeCache()
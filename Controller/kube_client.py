@@ -0,0 +1,102 @@
+import logging
+import threading
+from typing import Optional
+
+from kubernetes import client, config
+
+from .config import (
+    IN_CLUSTER,
+    KUBE_API_HOST,
+    KUBE_CONNECTION_POOL,
+    KUBE_REQUEST_TIMEOUT,
+)
+
+
+class KubeClient:
+    """
+    Process-wide Kubernetes API client.
+
+    The kube config is parsed and the connection pool is built once, on first
+    use, and every caller shares the same CoreV1Api. Requests that do not pass
+    their own ``_request_timeout`` get request_timeout, so watch streams have to
+    pass one that outlives the watch.
+
+    ``host`` points the client at another API server, e.g. a local fake one in
+    tests, without loading any kube config.
+    """
+
+    def __init__(self, in_cluster: bool = IN_CLUSTER, host: Optional[str] = KUBE_API_HOST,
+                 pool_size: int = KUBE_CONNECTION_POOL, request_timeout: float = KUBE_REQUEST_TIMEOUT):
+        self._in_cluster = in_cluster
+        self._host = host
+        self._pool_size = pool_size
+        self._request_timeout = request_timeout
+        self._lock = threading.Lock()
+        self._api_client: Optional[client.ApiClient] = None
+        self._core_api: Optional[client.CoreV1Api] = None
+
+    def configure(self, in_cluster: Optional[bool] = None, host: Optional[str] = None,
+                  pool_size: Optional[int] = None, request_timeout: Optional[float] = None):
+        """Change the settings; the client is rebuilt on the next core_api() call."""
+        with self._lock:
+            if in_cluster is not None:
+                self._in_cluster = in_cluster
+            if host is not None:
+                self._host = host
+            if pool_size is not None:
+                self._pool_size = pool_size
+            if request_timeout is not None:
+                self._request_timeout = request_timeout
+            self._close()
+
+    def _build(self) -> client.ApiClient:
+        configuration = client.Configuration()
+        if self._host:
+            configuration.host = self._host
+        else:
+            try:
+                if self._in_cluster:
+                    config.load_incluster_config(client_configuration=configuration)
+                else:
+                    config.load_kube_config(client_configuration=configuration)
+            except Exception as e:
+                print(f"Error loading kubeconfig: {e}")
+                logging.error(f"Error loading kubeconfig: {e}")
+                raise
+        configuration.connection_pool_maxsize = self._pool_size
+        api_client = client.ApiClient(configuration)
+
+        rest_request = api_client.rest_client.request
+        request_timeout = self._request_timeout
+
+        def request(*args, _request_timeout=None, **kwargs):
+            if _request_timeout is None:
+                _request_timeout = request_timeout
+            return rest_request(*args, _request_timeout=_request_timeout, **kwargs)
+
+        api_client.rest_client.request = request
+        return api_client
+
+    def api_client(self) -> client.ApiClient:
+        with self._lock:
+            if self._api_client is None:
+                self._api_client = self._build()
+                self._core_api = client.CoreV1Api(self._api_client)
+            return self._api_client
+
+    def core_api(self) -> client.CoreV1Api:
+        self.api_client()
+        return self._core_api
+
+    def _close(self):
+        if self._api_client is not None:
+            self._api_client.close()
+        self._api_client = None
+        self._core_api = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+kube_client = KubeClient()
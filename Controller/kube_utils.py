@@ -1,25 +1,42 @@
-import json
-import time
+import asyncio
 import logging
 import yaml
-import concurrent.futures
-from typing import List
+from typing import Callable, Optional
 
-import requests
-from kubernetes import client, config
+from kubernetes import client
 from kubernetes.client.rest import ApiException
 
-from .config import IN_CLUSTER, NODE_STATUS_FILE
+from .config import (
+    POD_SCHEDULE_TIMEOUT,
+    POD_READY_TIMEOUT,
+    POD_POLL_INTERVAL,
+    HOST_PORT_FIRST,
+    HOST_PORT_LAST,
+)
+from .kube_cache import kube_cache, pod_entry
+from .kube_client import kube_client
+from .port_allocator import PortAllocator
+from .worker_pool import worker_pool
+
+port_allocator = PortAllocator(HOST_PORT_FIRST, HOST_PORT_LAST)
+
+
+def _release_deleted_pod_port(pod_name: str, pod: Optional[dict]):
+    if pod is None:
+        port_allocator.pod_deleted(pod_name)
+    else:
+        port_allocator.pod_seen(pod_name)
+
+
+kube_cache.add_pod_listener(_release_deleted_pod_port)
 
 
 def get_node_ip(node_name: str) -> str:
-    try:
-        config.load_incluster_config() if IN_CLUSTER else config.load_kube_config()
-    except Exception as e:
-        print(f"Error loading kubeconfig: {e}")
-        raise
+    node = kube_cache.node(node_name)
+    if node is not None and node['ip']:
+        return node['ip']
 
-    core_api = client.CoreV1Api()
+    core_api = kube_client.core_api()
 
     try:
         node = core_api.read_node(name=node_name)
@@ -33,28 +50,9 @@ def get_node_ip(node_name: str) -> str:
         return "Error"
 
 
-def curl_health_check(ip: str):
-    url = f"http://{ip}:10248/healthz"
-    try:
-        response = requests.get(url, timeout=1)
-        if response.status_code == 200:
-            return response.text
-        return f"Health check failed for {url}. Status Code: {response.status_code}"
-    except requests.exceptions.Timeout:
-        return f"Request to {url} timed out. The URL may not exist."
-    except requests.exceptions.RequestException as e:
-        return f"An error occurred while trying to reach {url}: {e}"
-
-
-def deploy_pod(service_type, hostPort, node_name):
-    try:
-        config.load_incluster_config() if IN_CLUSTER else config.load_kube_config()
-    except Exception as e:
-        print(f"Error loading kubeconfig: {e}")
-        logging.error(f"Error loading kubeconfig: {e}")
-        raise
-
-    core_api = client.CoreV1Api()
+def create_pod(service_type, hostPort, node_name) -> Optional[str]:
+    """Send the request of creating the Pod and return its name, or None if a Pod of that name is terminating."""
+    core_api = kube_client.core_api()
 
     try:
         with open(f"service_yaml/{service_type}.yaml") as f:
@@ -79,69 +77,79 @@ def deploy_pod(service_type, hostPort, node_name):
     except ApiException as e:
         logging.error(f"Exception when deploying Pod: {e}")
         raise
+    return unique_name
 
-    while True:
-        resp = core_api.read_namespaced_pod(name=unique_name, namespace='default')
-        if resp.spec.node_name and resp.status.pod_ip and resp.status.host_ip:
-            break
-        time.sleep(0.5)
+
+async def deploy_pod(service_type, hostPort, node_name):
+    unique_name = await worker_pool.run(create_pod, service_type, hostPort, node_name)
+    if unique_name is None:
+        return None
+
+    resp = await wait_for_pod(
+        unique_name,
+        lambda pod: bool(pod['nodeName'] and pod['podIP'] and pod['hostIP']),
+        POD_SCHEDULE_TIMEOUT,
+    )
+    if resp is None:
+        logging.error(f"Pod {unique_name} got no IP within {POD_SCHEDULE_TIMEOUT} seconds")
+        raise TimeoutError(f"Pod {unique_name} got no IP within {POD_SCHEDULE_TIMEOUT} seconds")
     return resp
 
 
-def communicate_with_agent(data: dict, agent_ip: str, agent_port: int):
-    url = f"http://{agent_ip}:{agent_port}/servicechange"
-    try:
-        response = requests.post(url, data=json.dumps(data))
-        logging.info(f"communicate with Agent {agent_ip} {agent_port}, body = {data}")
-        return response.status_code, response.text
-    except requests.exceptions.RequestException as e:
-        return None, str(e)
+async def wait_for_pod(pod_name: str, predicate: Callable[[dict], bool], timeout: float,
+                       namespace: str = 'default') -> Optional[client.V1Pod]:
+    """
+    Wait until predicate holds for the pod (see kube_cache.pod_entry) and return
+    the V1Pod, or None if the pod is deleted or timeout expires first.
 
+    Pod events come from the kube_cache watch; without it the pod is polled
+    from the worker pool.
+    """
+    if namespace == 'default' and kube_cache.pods_synced():
+        pod = await kube_cache.wait_for_pod(pod_name, predicate, timeout)
+        return None if pod is None else pod['object']
+
+    core_api = kube_client.core_api()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        try:
+            resp = await worker_pool.run(core_api.read_namespaced_pod, name=pod_name, namespace=namespace)
+            if predicate(pod_entry(resp)):
+                return resp
+        except ApiException as e:
+            if e.status != 404:
+                logging.error(f"Error reading Pod {pod_name}: {e}")
+        if loop.time() >= deadline:
+            return None
+        await asyncio.sleep(POD_POLL_INTERVAL)
 
-def delete_pod(pod_name, namespace='default'):
-    try:
-        config.load_incluster_config() if IN_CLUSTER else config.load_kube_config()
-    except Exception as e:
-        print(f"Error loading kubeconfig: {e}")
-        logging.error(f"Error loading kubeconfig: {e}")
-        raise
 
-    core_api = client.CoreV1Api()
+async def wait_for_pod_ready(pod_name: str, timeout: float = POD_READY_TIMEOUT) -> Optional[client.V1Pod]:
+    return await wait_for_pod(pod_name, lambda pod: pod['ready'], timeout)
+
+
+def delete_pod(pod_name, namespace='default'):
+    core_api = kube_client.core_api()
 
     try:
         core_api.delete_namespaced_pod(name=pod_name, namespace=namespace)
+        # 刪除完成前保留這個 hostPort，避免新的Pod用到同樣的名字；沒有 watch 時無法得知何時刪除完成，直接釋放
+        if kube_cache.pods_synced():
+            port_allocator.release_after_delete(pod_name)
+        else:
+            port_allocator.release(pod_name)
     except ApiException as e:
         if e.status != 404:
             print(f"Failed to delete Pod: {e}")
-
-
-def node_status_sync(node_name_list: List[str]):
-    node_health_status = {}
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_node = {}
-        for node_name in node_name_list:
-            ip = get_node_ip(node_name)
-            if ip != "Error":
-                future = executor.submit(curl_health_check, ip)
-                future_to_node[future] = node_name
-            else:
-                node_health_status[node_name] = "unhealthy"
-        for future in concurrent.futures.as_completed(future_to_node):
-            node_name = future_to_node[future]
-            try:
-                health_status = future.result()
-                if health_status.strip().lower() == 'ok':
-                    node_health_status[node_name] = "healthy"
-                else:
-                    node_health_status[node_name] = "unhealthy"
-            except Exception:
-                node_health_status[node_name] = "unhealthy"
-    with open(NODE_STATUS_FILE, 'w') as node_status_file:
-        json.dump(node_health_status, node_status_file, indent=4)
-    return json.dumps(node_health_status, indent=4)
+        else:
+            port_allocator.release(pod_name)
 
 
 def is_pod_terminating(core_api, pod_name, namespace="default"):
+    if namespace == "default" and kube_cache.pods_synced():
+        pod = kube_cache.pod(pod_name)
+        return pod is not None and pod['terminating']
     try:
         resp = core_api.read_namespaced_pod(name=pod_name, namespace=namespace)
         if resp.metadata.deletion_timestamp:
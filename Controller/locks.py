@@ -0,0 +1,70 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+
+class ServiceTypeLocks:
+    """
+    One asyncio.Lock per serviceType.
+
+    asyncio.Lock hands the lock to its waiters in FIFO order and a new caller
+    never overtakes a queued one, so requests of the same serviceType are
+    served fairly while different serviceTypes proceed in parallel.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._stats = {}
+
+    def _get(self, serviceType: str) -> asyncio.Lock:
+        if serviceType not in self._locks:
+            self._locks[serviceType] = asyncio.Lock()
+            self._stats[serviceType] = {
+                "waiting": 0,
+                "maxWaiting": 0,
+                "acquired": 0,
+                "totalWaitSeconds": 0.0,
+                "maxWaitSeconds": 0.0,
+            }
+        return self._locks[serviceType]
+
+    async def _acquire(self, serviceType: str):
+        lock = self._get(serviceType)
+        stats = self._stats[serviceType]
+        stats["waiting"] += 1
+        stats["maxWaiting"] = max(stats["maxWaiting"], stats["waiting"])
+        start = time.perf_counter()
+        try:
+            await lock.acquire()
+        finally:
+            stats["waiting"] -= 1
+        waited = time.perf_counter() - start
+        stats["acquired"] += 1
+        stats["totalWaitSeconds"] += waited
+        stats["maxWaitSeconds"] = max(stats["maxWaitSeconds"], waited)
+
+    @asynccontextmanager
+    async def hold(self, *serviceTypes: str):
+        # always lock in the same order so that multi-type holders cannot deadlock
+        ordered = sorted(set(serviceTypes))
+        acquired = []
+        try:
+            for serviceType in ordered:
+                await self._acquire(serviceType)
+                acquired.append(serviceType)
+            yield
+        finally:
+            for serviceType in reversed(acquired):
+                self._locks[serviceType].release()
+
+    def metrics(self) -> dict:
+        return {
+            serviceType: {
+                **stats,
+                "locked": self._locks[serviceType].locked(),
+            }
+            for serviceType, stats in self._stats.items()
+        }
+
+
+service_locks = ServiceTypeLocks()
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from typing import Optional
+
+from .config import LOOP_LAG_INTERVAL, LOOP_LAG_WARNING
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task that sleeps for interval
+    seconds. A lag close to zero means no handler is blocking the loop.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, warning: float = LOOP_LAG_WARNING):
+        self._interval = interval
+        self._warning = warning
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "samples": 0,
+            "lastLagSeconds": 0.0,
+            "maxLagSeconds": 0.0,
+            "totalLagSeconds": 0.0,
+            "slowSamples": 0,
+        }
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self._interval
+            await asyncio.sleep(self._interval)
+            lag = max(0.0, loop.time() - expected)
+            self._stats["samples"] += 1
+            self._stats["lastLagSeconds"] = lag
+            self._stats["maxLagSeconds"] = max(self._stats["maxLagSeconds"], lag)
+            self._stats["totalLagSeconds"] += lag
+            if lag >= self._warning:
+                self._stats["slowSamples"] += 1
+                logging.warning(f"Event loop was blocked for {lag:.3f} seconds")
+
+    def metrics(self) -> dict:
+        metrics = dict(self._stats)
+        metrics["meanLagSeconds"] = (
+            self._stats["totalLagSeconds"] / self._stats["samples"] if self._stats["samples"] else 0.0
+        )
+        return metrics
+
+
+loop_monitor = LoopLagMonitor()
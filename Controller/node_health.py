@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+
+from .config import (
+    NODE_HEALTH_PORT,
+    NODE_HEALTH_TIMEOUT,
+    NODE_HEALTH_TTL,
+    NODE_HEALTH_INTERVAL,
+)
+from .kube_cache import kube_cache
+from .kube_utils import get_node_ip
+from .worker_pool import worker_pool
+from .state import cluster_state, NODE_STATUS
+
+
+class NodeHealthProber:
+    """
+    Health of the computing nodes from the kubelet /healthz endpoint.
+
+    All nodes are probed concurrently over one httpx.AsyncClient and every
+    result is cached for ttl seconds in cluster_state.node_health_status.
+    A background task probes the nodes again every interval seconds, so
+    deploy_service() normally reads the health from memory; only nodes whose
+    result is older than ttl are probed before it is returned.
+
+    A node with a reported failure (/alert) is unhealthy right away and
+    stays unhealthy, whatever its kubelet answers, until the failure is
+    handled.
+    """
+
+    def __init__(self, port: int = NODE_HEALTH_PORT, timeout: float = NODE_HEALTH_TIMEOUT,
+                 ttl: float = NODE_HEALTH_TTL, interval: float = NODE_HEALTH_INTERVAL,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self._port = port
+        self._timeout = timeout
+        self._ttl = ttl
+        self._interval = interval
+        # None 表示真的連線，測試時傳入 httpx.MockTransport
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._nodeName_list: List[str] = []
+        # nodeName -> loop time of the last probe
+        self._checked: Dict[str, float] = {}
+        # nodeName -> 還沒處理完的故障通知數量
+        self._reported: Dict[str, int] = {}
+        self._stats = {
+            "sweeps": 0,
+            "probes": 0,
+            "unhealthy": 0,
+            "cacheHits": 0,
+            "lastSweepSeconds": 0.0,
+        }
+
+    async def _node_ip(self, nodeName: str) -> str:
+        node = kube_cache.node(nodeName)
+        if node is not None and node['ip']:
+            return node['ip']
+        return await worker_pool.run(get_node_ip, nodeName)
+
+    async def _probe_node(self, nodeName: str) -> str:
+        ip = await self._node_ip(nodeName)
+        if ip == "Error":
+            return "unhealthy"
+        try:
+            response = await self._client.get(f"http://{ip}:{self._port}/healthz")
+        except httpx.HTTPError as e:
+            logging.warning(f"Health check of {nodeName} failed: {e}")
+            return "unhealthy"
+        if response.status_code == 200 and response.text.strip().lower() == 'ok':
+            return "healthy"
+        logging.warning(f"Health check of {nodeName} failed. Status Code: {response.status_code}")
+        return "unhealthy"
+
+    async def probe(self, nodeName_list: Iterable[str]) -> Dict[str, str]:
+        """Probe the nodes concurrently and store the results."""
+        nodeName_list = list(dict.fromkeys(nodeName_list))
+        if not nodeName_list:
+            return {}
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        status_list = await asyncio.gather(*(self._probe_node(nodeName) for nodeName in nodeName_list))
+        now = loop.time()
+        result = dict(zip(nodeName_list, status_list))
+        for nodeName in result:
+            if nodeName in self._reported:
+                result[nodeName] = "unhealthy"
+        with cluster_state.mutate(NODE_STATUS):
+            cluster_state.node_health_status.update(result)
+        for nodeName in nodeName_list:
+            self._checked[nodeName] = now
+        self._stats["sweeps"] += 1
+        self._stats["probes"] += len(nodeName_list)
+        self._stats["unhealthy"] += sum(1 for status in status_list if status != "healthy")
+        self._stats["lastSweepSeconds"] = now - start
+        return result
+
+    async def status(self, nodeName_list: Iterable[str]) -> Dict[str, str]:
+        """Health of the nodes, probing only the ones without a result younger than ttl."""
+        nodeName_list = list(nodeName_list)
+        for nodeName in nodeName_list:
+            # 之後由背景的 refresher 一起檢查
+            if nodeName not in self._nodeName_list:
+                self._nodeName_list.append(nodeName)
+        now = asyncio.get_running_loop().time()
+        stale_list = [
+            nodeName for nodeName in nodeName_list
+            if now - self._checked.get(nodeName, float('-inf')) > self._ttl
+        ]
+        self._stats["cacheHits"] += len(nodeName_list) - len(stale_list)
+        await self.probe(stale_list)
+        return {nodeName: cluster_state.node_health_status.get(nodeName, "unhealthy") for nodeName in nodeName_list}
+
+    def mark_unhealthy(self, nodeName: str):
+        """A failure was reported for the node, it stays unhealthy until failure_handled()."""
+        self._reported[nodeName] = self._reported.get(nodeName, 0) + 1
+        with cluster_state.mutate(NODE_STATUS):
+            cluster_state.node_health_status[nodeName] = "unhealthy"
+        self._checked[nodeName] = asyncio.get_running_loop().time()
+
+    def failure_handled(self, nodeName: str):
+        """
+        A reported failure of the node is handled; once all of them are, the
+        next probe decides its health again.
+        """
+        if self._reported.get(nodeName, 0) > 1:
+            self._reported[nodeName] -= 1
+        else:
+            self._reported.pop(nodeName, None)
+
+    async def start(self, nodeName_list: Iterable[str]):
+        """Probe nodeName_list once and keep probing it in the background."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self._timeout, transport=self._transport)
+        self._nodeName_list = list(dict.fromkeys(nodeName_list))
+        await self.probe(self._nodeName_list)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.probe(self._nodeName_list)
+            except Exception:
+                logging.exception("Failed to probe the nodes")
+
+    def metrics(self) -> dict:
+        metrics = dict(self._stats)
+        metrics["nodes"] = dict(cluster_state.node_health_status)
+        metrics["reported"] = sorted(self._reported)
+        return metrics
+
+
+node_health = NodeHealthProber()
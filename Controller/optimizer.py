@@ -1,7 +1,368 @@
+import functools
+import heapq
+import math
+import struct
+
+
 def optimize(servicetype: str, agentcount: int, servicelist: list) -> tuple[str, list]:
     """
     Optimize the agent's transmission rate and the allocation.
 
+    Same result as optimize_sorted(), but the instances of the service type
+    are kept in a max-heap instead of re-sorting the servicelist after every
+    placement, so placing N agents on M instances costs O(N log M).
+
+    optimize_sorted() re-sorts a list that is already sorted, so among
+    instances with an equal key the one that was updated most recently comes
+    first, then the order of the previous phase. The heap entries carry an
+    update stamp to reproduce this order.
+
+    Parameters
+    ----------
+    servicetype : str
+        the type of the service
+    agentcount : int
+        number of agent that needs to be optimized
+    servicelist: list
+        a list of informations of all service instances
+
+    Returns
+    -------
+    status : str
+        the optimization is "success" or "fail"
+    servicelist : list
+        a list of updated informations of all service instances
+    """
+    status = "success"
+    hasdistributed, remain, stamp, target = _default_rate_phase(servicetype, agentcount, servicelist)
+
+    # if no agent is distributed, optimize_sorted() returns the list sorted by remainWorkload
+    if hasdistributed == 0:
+        if servicelist:
+            status = "fail"
+        order = sorted(range(len(servicelist)), key=lambda i: remain[i], reverse=True)
+        return status, [servicelist[i] for i in order]
+
+    # all instance is full, cannot add a agent with default transmission rate
+    rank = _phase_rank(target, remain, stamp)
+    heap = []
+    for i in target:
+        instance = servicelist[i]
+        predFreq = instance["workloadLimit"] / (instance["currentConnection"] + 1)
+        heap.append((-predFreq, 0, rank[i], i))
+    heapq.heapify(heap)
+    updated = 0
+    while hasdistributed < agentcount:
+        i = heap[0][3]
+        instance = servicelist[i]
+        # let agent join the instance which has the most predFreq
+        instance["currentConnection"] += 1
+        instance["currentFrequency"] = instance["workloadLimit"] / instance["currentConnection"]
+
+        # the freqency is under minimum FPS fli
+        if instance["currentFrequency"] < instance["frequencyLimit"][1]:
+            status = "fail"
+
+        predFreq = instance["workloadLimit"] / (instance["currentConnection"] + 1)
+        hasdistributed += 1
+        updated += 1
+        heapq.heapreplace(heap, (-predFreq, -updated, rank[i], i))
+
+    return status, servicelist
+
+
+def waterfill(servicetype: str, agentcount: int, servicelist: list) -> tuple[str, list]:
+    """
+    Same result as optimize(), but the agents that cannot be served at the
+    default transmission rate are distributed in closed form.
+
+    Giving every agent to the instance with the most predFreq is water
+    filling: the k-th extra agent of an instance is worth
+    workloadLimit / (currentConnection + k), and the greedy picks the largest
+    values first. The value of the last agent (the water level) is found by
+    bisection, every instance gets all its values above the level and the
+    values at the level are handed out with the tie order of optimize().
+    The cost no longer grows with the number of agents.
+
+    Parameters
+    ----------
+    servicetype : str
+        the type of the service
+    agentcount : int
+        number of agent that needs to be optimized
+    servicelist: list
+        a list of informations of all service instances
+
+    Returns
+    -------
+    status : str
+        the optimization is "success" or "fail"
+    servicelist : list
+        a list of updated informations of all service instances
+    """
+    target = [i for i, instance in enumerate(servicelist) if instance["serviceType"] == servicetype]
+    # the values of an instance without capacity never decrease, the level is undefined
+    if any(not servicelist[i]["workloadLimit"] > 0 for i in target):
+        return optimize(servicetype, agentcount, servicelist)
+
+    status = "success"
+    hasdistributed, remain, stamp, target = _default_rate_phase(servicetype, agentcount, servicelist)
+    if hasdistributed == 0:
+        if servicelist:
+            status = "fail"
+        order = sorted(range(len(servicelist)), key=lambda i: remain[i], reverse=True)
+        return status, [servicelist[i] for i in order]
+
+    remaining = agentcount - hasdistributed
+    if remaining <= 0:
+        return status, servicelist
+
+    workload = {i: servicelist[i]["workloadLimit"] for i in target}
+    connection = {i: servicelist[i]["currentConnection"] for i in target}
+
+    def count_from(i: int, level: float) -> int:
+        # number of extra agents k with workloadLimit / (currentConnection + k) >= level
+        k = max(int(workload[i] / level) - connection[i], 0)
+        while k > 0 and workload[i] / (connection[i] + k) < level:
+            k -= 1
+        while workload[i] / (connection[i] + k + 1) >= level:
+            k += 1
+        return k
+
+    def count(level: float) -> int:
+        return sum(count_from(i, level) for i in target)
+
+    # bisection on the bit pattern of positive floats, which sorts like the floats
+    high = _float_bits(max(workload[i] / (connection[i] + 1) for i in target))
+    low = _float_bits(max(workload[i] / (connection[i] + remaining) for i in target))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count(_bits_float(middle)) >= remaining:
+            low = middle
+        else:
+            high = middle - 1
+    level = _bits_float(low)
+
+    above = math.nextafter(level, math.inf)
+    extra = {i: count_from(i, above) for i in target}
+    atLevel = [i for i in target if count_from(i, level) > extra[i]]
+    rank = _phase_rank(target, remain, stamp)
+
+    def tie_order(i: int, j: int) -> int:
+        # order of optimize() between two instances whose next value equals the level
+        ki, kj = extra[i] + 1, extra[j] + 1
+        flipped = False
+        while True:
+            if ki == 1 and kj == 1:
+                result = rank[i] - rank[j]
+                break
+            # an instance that got an agent in this phase was re-sorted more recently
+            if ki == 1 or kj == 1:
+                result = 1 if ki == 1 else -1
+                break
+            previous_i = workload[i] / (connection[i] + ki - 1)
+            previous_j = workload[j] / (connection[j] + kj - 1)
+            # a smaller previous value was picked later, so it is the more recent one
+            if previous_i != previous_j:
+                result = -1 if previous_i < previous_j else 1
+                break
+            # both previous values were equal: whichever went first there went last here
+            if workload[i] == workload[j] and connection[i] + ki == connection[j] + kj:
+                step = min(ki, kj) - 1
+            else:
+                step = 1
+            ki -= step
+            kj -= step
+            flipped ^= step % 2 == 1
+        return -result if flipped else result
+
+    atLevel.sort(key=functools.cmp_to_key(tie_order))
+    for i in atLevel[:remaining - sum(extra.values())]:
+        extra[i] += 1
+
+    for i in target:
+        if extra[i] == 0:
+            continue
+        instance = servicelist[i]
+        instance["currentConnection"] += extra[i]
+        instance["currentFrequency"] = instance["workloadLimit"] / instance["currentConnection"]
+        # the freqency is under minimum FPS fli
+        if instance["currentFrequency"] < instance["frequencyLimit"][1]:
+            status = "fail"
+    return status, servicelist
+
+
+def _float_bits(value: float) -> int:
+    return struct.unpack("<q", struct.pack("<d", value))[0]
+
+
+def _bits_float(bits: int) -> float:
+    return struct.unpack("<d", struct.pack("<q", bits))[0]
+
+
+def add_agent(servicetype: str, servicelist: list) -> tuple[str, list, int]:
+    """
+    Add one agent to the current allocation without redistributing the others.
+
+    The agent joins the instance that optimize() would pick next: the one
+    with the most remainWorkload while it can still serve the default
+    transmission rate, otherwise the one with the most predFreq.
+
+    Parameters
+    ----------
+    servicetype : str
+        the type of the service
+    servicelist: list
+        a list of informations of all service instances
+
+    Returns
+    -------
+    status : str
+        "fail" if there is no instance of the service type or the frequency
+        of the chosen instance is under the minimum, otherwise "success"
+    servicelist : list
+        a list of updated informations of all service instances
+    index : int
+        index of the instance the agent joined, -1 if there is none
+    """
+    index = -1
+    bestKey = None
+    for i, instance in enumerate(servicelist):
+        if instance["serviceType"] != servicetype:
+            continue
+        remainWorkload = instance["workloadLimit"] - instance["currentConnection"] * instance["frequencyLimit"][0]
+        if remainWorkload >= instance["frequencyLimit"][0]:
+            key = (1, remainWorkload)
+        else:
+            key = (0, instance["workloadLimit"] / (instance["currentConnection"] + 1))
+        if bestKey is None or key > bestKey:
+            index, bestKey = i, key
+    if index == -1:
+        return "fail", servicelist, index
+
+    instance = servicelist[index]
+    instance["currentConnection"] += 1
+    instance["currentFrequency"] = _frequency(instance)
+    status = "fail" if instance["currentFrequency"] < instance["frequencyLimit"][1] else "success"
+    return status, servicelist, index
+
+
+def remove_agent(servicelist: list, index: int) -> list:
+    """
+    Remove one agent from the instance at index and give the remaining agents
+    of the instance the frequency they can get now.
+    """
+    instance = servicelist[index]
+    instance["currentConnection"] = max(instance["currentConnection"] - 1, 0)
+    instance["currentFrequency"] = _frequency(instance)
+    return servicelist
+
+
+def admission_capacity(servicetype: str, agentcount: int, servicelist: list) -> int:
+    """
+    Largest number of agents up to agentcount optimize() can distribute
+    without a frequency under frequencyLimit[1].
+
+    optimize() always gives the next agent to the instance with the most
+    predFreq, so it only fails once every instance i holds its
+    workloadLimit / frequencyLimit[1] agents. The instances of a service type
+    share the frequencyLimit of its spec, without a minimum frequency
+    (frequencyLimit[1] <= 0) optimize() never fails.
+
+    Parameters
+    ----------
+    servicetype : str
+        the type of the service
+    agentcount : int
+        number of agent that want to be admitted
+    servicelist: list
+        a list of informations of all service instances
+
+    Returns
+    -------
+    capacity : int
+        number of agents that can be admitted
+    """
+    capacity = 0
+    canStart = False
+    unbounded = False
+    for instance in servicelist:
+        if instance["serviceType"] != servicetype:
+            continue
+        # optimize() fails right away if no instance can take an agent at the default rate
+        if instance["workloadLimit"] >= instance["frequencyLimit"][0]:
+            canStart = True
+        if instance["frequencyLimit"][1] <= 0:
+            unbounded = True
+            continue
+        connection = int(instance["workloadLimit"] / instance["frequencyLimit"][1])
+        while connection > 0 and instance["workloadLimit"] / connection < instance["frequencyLimit"][1]:
+            connection -= 1
+        while instance["workloadLimit"] / (connection + 1) >= instance["frequencyLimit"][1]:
+            connection += 1
+        capacity += connection
+    if not canStart:
+        return 0
+    return agentcount if unbounded else min(capacity, agentcount)
+
+
+def _frequency(instance: dict) -> float:
+    # default transmission rate while it fits, otherwise share the workload equally
+    if instance["currentConnection"] * instance["frequencyLimit"][0] <= instance["workloadLimit"]:
+        return instance["frequencyLimit"][0]
+    return instance["workloadLimit"] / instance["currentConnection"]
+
+
+def _default_rate_phase(servicetype: str, agentcount: int, servicelist: list):
+    """
+    Distribute agents at the default transmission rate to the instance with
+    the most remainWorkload, shared by optimize() and waterfill().
+
+    Returns the number of distributed agents, the remainWorkload and the
+    update stamp of every instance and the indexes of the instances of the
+    service type.
+    """
+    remain = []
+    target = []
+    for i, instance in enumerate(servicelist):
+        # clear all the current connection to redistribute
+        if instance["serviceType"] == servicetype:
+            instance["currentConnection"] = 0
+            target.append(i)
+        remain.append(instance["workloadLimit"] - instance["currentConnection"] * instance["frequencyLimit"][0])
+    stamp = [0] * len(servicelist)
+
+    hasdistributed = 0
+    heap = [(-remain[i], 0, i) for i in target]
+    heapq.heapify(heap)
+    while hasdistributed < agentcount and heap:
+        i = heap[0][2]
+        instance = servicelist[i]
+        if remain[i] < instance["frequencyLimit"][0]:
+            break
+        # can distribute as default transmission rate
+        instance["currentConnection"] += 1
+        remain[i] -= instance["frequencyLimit"][0]
+        instance["currentFrequency"] = instance["frequencyLimit"][0]
+        hasdistributed += 1
+        stamp[i] = hasdistributed
+        heapq.heapreplace(heap, (-remain[i], -stamp[i], i))
+    return hasdistributed, remain, stamp, target
+
+
+def _phase_rank(target: list, remain: list, stamp: list) -> dict:
+    # position of each instance in the servicelist at the end of the default rate phase
+    order = sorted(target, key=lambda i: (-remain[i], -stamp[i], i))
+    return {i: rank for rank, i in enumerate(order)}
+
+
+def optimize_sorted(servicetype: str, agentcount: int, servicelist: list) -> tuple[str, list]:
+    """
+    Optimize the agent's transmission rate and the allocation.
+
+    Reference implementation that re-sorts the whole servicelist after every
+    placement, optimize() produces the same result with heaps.
+
     Parameters
     ----------
     servicetype : str
@@ -0,0 +1,123 @@
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional
+
+# workloadLimit: what the new instance gets after the node is split between its services
+# standbyReady: a ready standby Pod of the serviceType is waiting on the node
+Candidate = namedtuple("Candidate", ["nodeName", "workloadLimit", "standbyReady"])
+
+
+class ClusterView:
+    """
+    Per-node aggregates of service.json and the standby Pods, built in one
+    pass so that every node can be scored without scanning the service list
+    again.
+
+    - gpuMemoryRequested[node]: GPU memory of the services on the node
+    - standby[node][serviceType]: the standby Pod of serviceType on the node
+    - serviceTypes[node]: the serviceTypes deployed on the node
+    """
+
+    def __init__(self, service_list: list, standby_list: Iterable[dict], serviceSpec_dict: dict):
+        self._serviceSpec_dict = serviceSpec_dict
+        self.gpuMemoryRequested: Dict[str, int] = {}
+        self.standby: Dict[str, Dict[str, dict]] = {}
+        self.serviceTypes: Dict[str, List[str]] = {}
+        for service in service_list:
+            nodeName = service['nodeName']
+            serviceType = service['serviceType']
+            self.gpuMemoryRequested[nodeName] = (
+                self.gpuMemoryRequested.get(nodeName, 0) + serviceSpec_dict[serviceType]['gpuMemoryRequest']
+            )
+            self.serviceTypes.setdefault(nodeName, []).append(serviceType)
+        for standby in standby_list:
+            self.add_standby(standby)
+
+    def add_standby(self, standby: dict):
+        self.standby.setdefault(standby['nodeName'], {})[standby['serviceType']] = standby
+
+    def add_service(self, serviceType: str, nodeName: str):
+        """A new instance of serviceType is placed on nodeName, it takes the standby Pod of serviceType there if any."""
+        self.gpuMemoryRequested[nodeName] = (
+            self.gpuMemoryRequested.get(nodeName, 0) + self._serviceSpec_dict[serviceType]['gpuMemoryRequest']
+        )
+        self.serviceTypes.setdefault(nodeName, []).append(serviceType)
+        self.standby.get(nodeName, {}).pop(serviceType, None)
+
+    def gpu_memory_request(self, serviceType: str) -> int:
+        return self._serviceSpec_dict[serviceType]['gpuMemoryRequest']
+
+    def gpu_memory_requested(self, nodeName: str, excludedServiceType: Optional[str] = None) -> int:
+        """GPU memory requested on nodeName by the services and by the standby Pods other than excludedServiceType's."""
+        gpuMemoryRequest = self.gpuMemoryRequested.get(nodeName, 0)
+        for serviceType in self.standby.get(nodeName, {}):
+            if serviceType != excludedServiceType:
+                gpuMemoryRequest += self._serviceSpec_dict[serviceType]['gpuMemoryRequest']
+        return gpuMemoryRequest
+
+    def workload_limit(self, serviceType: str, nodeName: str) -> Optional[float]:
+        """
+        workloadLimit a new instance of serviceType would get on nodeName, or
+        None if it cannot be deployed there: the node already runs or is
+        starting one, or the split would bring an instance on the node below
+        frequencyLimit[0].
+        """
+        workAbility = self._serviceSpec_dict[serviceType]['workAbility']
+        if nodeName not in workAbility:
+            return None
+        standby = self.standby.get(nodeName, {}).get(serviceType)
+        if standby is not None and not standby['ready']:
+            return None
+        serviceTypeOnThisNode_list = self.serviceTypes.get(nodeName, [])
+        if serviceType in serviceTypeOnThisNode_list:
+            return None
+        split = len(serviceTypeOnThisNode_list) + 1
+        for serviceTypeOnThisNode in serviceTypeOnThisNode_list:
+            serviceSpec = self._serviceSpec_dict[serviceTypeOnThisNode]
+            if float(serviceSpec['workAbility'][nodeName]) / split < serviceSpec['frequencyLimit'][0]:
+                return None
+        workloadLimit = float(workAbility[nodeName]) / split
+        if workloadLimit < self._serviceSpec_dict[serviceType]['frequencyLimit'][0]:
+            return None
+        return workloadLimit
+
+    def candidates(self, serviceType: str, gpuMemory_dict: dict) -> List[Candidate]:
+        """
+        Nodes of gpuMemory_dict serviceType can be deployed on, best first:
+        nodes with a ready standby, then the largest workloadLimit, then the
+        order of gpuMemory_dict.
+        """
+        gpuMemoryRequest = self.gpu_memory_request(serviceType)
+        candidate_list = []
+        for nodeName, gpuMemory in gpuMemory_dict.items():
+            workloadLimit = self.workload_limit(serviceType, nodeName)
+            if workloadLimit is None:
+                continue
+            # 已經 Ready 的備用Pod 本身就是新的 instance，不需要再多要GPU記憶體
+            standbyReady = serviceType in self.standby.get(nodeName, {})
+            if self.gpu_memory_requested(nodeName, serviceType) + (0 if standbyReady else gpuMemoryRequest) > gpuMemory:
+                continue
+            candidate_list.append(Candidate(nodeName, workloadLimit, standbyReady))
+        # sorted() is stable, equal scores keep the order of gpuMemory_dict
+        candidate_list.sort(key=lambda candidate: (candidate.standbyReady, candidate.workloadLimit), reverse=True)
+        return candidate_list
+
+
+def plan_placement(serviceType_list: List[str], view: ClusterView, gpuMemory_dict: dict) -> Dict[str, Candidate]:
+    """
+    Joint placement of one new instance of every serviceType of
+    serviceType_list, first fit decreasing: the serviceTypes that request the
+    most GPU memory are placed first, each on the best candidate of view with
+    the instances placed before it. view is updated with the placement.
+
+    Returns serviceType -> Candidate for the serviceTypes that fit.
+    """
+    placement_dict = {}
+    for serviceType in sorted(
+        serviceType_list, key=lambda serviceType: view.gpu_memory_request(serviceType), reverse=True
+    ):
+        candidate_list = view.candidates(serviceType, gpuMemory_dict)
+        if not candidate_list:
+            continue
+        placement_dict[serviceType] = candidate_list[0]
+        view.add_service(serviceType, candidate_list[0].nodeName)
+    return placement_dict
@@ -0,0 +1,118 @@
+import threading
+from collections import deque
+from typing import Dict, Optional, Set, Tuple
+
+
+def pod_name(serviceType: str, nodeName: str, hostPort: int) -> str:
+    return f"{serviceType}-{nodeName}-{hostPort}"
+
+
+def parse_pod_name(podName: str, serviceType: str) -> Tuple[str, int]:
+    """(nodeName, hostPort) of a Pod named by pod_name()."""
+    nodeName, hostPort = podName[len(serviceType) + 1:].rsplit('-', 1)
+    return nodeName, int(hostPort)
+
+
+class PortAllocator:
+    """
+    hostPort allocator with one free list per node.
+
+    allocate() hands out the next free port of a node in O(1) and records the
+    Pod that will be created with it. When that Pod is deleted, its port stays
+    held until the Pod is really gone (pod_deleted()), so a new Pod never gets
+    the name of a terminating one. The watch may see the Pod disappear before
+    release_after_delete() is called (an unscheduled Pod or a zero grace
+    period), such a Pod is remembered and its port freed right away.
+
+    The free list is a deque of candidate ports plus the set of the ports that
+    are really free; ports reserved out of order are skipped lazily.
+    """
+
+    def __init__(self, first: int, last: int):
+        self._first = first
+        self._last = last
+        self._lock = threading.Lock()
+        self._free: Dict[str, deque] = {}
+        self._free_set: Dict[str, set] = {}
+        # podName -> (nodeName, hostPort)
+        self._allocated: Dict[str, Tuple[str, int]] = {}
+        self._terminating: Dict[str, Tuple[str, int]] = {}
+        # allocated Pods the watch has already seen deleted
+        self._deleted: Set[str] = set()
+
+    def _node(self, nodeName: str):
+        if nodeName not in self._free:
+            self._free[nodeName] = deque(range(self._first, self._last))
+            self._free_set[nodeName] = set(range(self._first, self._last))
+        return self._free[nodeName], self._free_set[nodeName]
+
+    def allocate(self, serviceType: str, nodeName: str) -> Optional[int]:
+        with self._lock:
+            free, free_set = self._node(nodeName)
+            while free:
+                hostPort = free.popleft()
+                if hostPort in free_set:
+                    free_set.discard(hostPort)
+                    podName = pod_name(serviceType, nodeName, hostPort)
+                    self._allocated[podName] = (nodeName, hostPort)
+                    self._deleted.discard(podName)
+                    return hostPort
+            return None
+
+    def reserve(self, serviceType: str, nodeName: str, hostPort: int):
+        """Record a Pod whose port was not chosen by allocate(), e.g. the ones found at startup."""
+        with self._lock:
+            _, free_set = self._node(nodeName)
+            free_set.discard(hostPort)
+            podName = pod_name(serviceType, nodeName, hostPort)
+            self._allocated[podName] = (nodeName, hostPort)
+            self._deleted.discard(podName)
+
+    def _free_port(self, nodeName: str, hostPort: int):
+        free, free_set = self._node(nodeName)
+        if self._first <= hostPort < self._last and hostPort not in free_set:
+            free_set.add(hostPort)
+            free.append(hostPort)
+
+    def release(self, podName: str):
+        """The Pod was never created, its port is free again."""
+        with self._lock:
+            self._deleted.discard(podName)
+            entry = self._allocated.pop(podName, None) or self._terminating.pop(podName, None)
+            if entry is not None:
+                self._free_port(*entry)
+
+    def release_after_delete(self, podName: str):
+        """The Pod is being deleted, hold its port until pod_deleted()."""
+        with self._lock:
+            entry = self._allocated.pop(podName, None)
+            if entry is None:
+                return
+            if podName in self._deleted:
+                # watch 已經收到 DELETED，不會再等到 pod_deleted()
+                self._deleted.discard(podName)
+                self._free_port(*entry)
+            else:
+                self._terminating[podName] = entry
+
+    def pod_deleted(self, podName: str):
+        with self._lock:
+            entry = self._terminating.pop(podName, None)
+            if entry is not None:
+                self._free_port(*entry)
+            elif podName in self._allocated:
+                self._deleted.add(podName)
+
+    def pod_seen(self, podName: str):
+        """The watch saw a Pod of this name, a DELETED seen before belonged to an older Pod."""
+        with self._lock:
+            self._deleted.discard(podName)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "allocated": len(self._allocated),
+                "terminating": len(self._terminating),
+                "deleted": len(self._deleted),
+                "free": {nodeName: len(free_set) for nodeName, free_set in self._free_set.items()},
+            }
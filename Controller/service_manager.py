@@ -1,209 +1,463 @@
-import json
-import copy
+import asyncio
 import logging
-import time
+import math
 import os
 
 from typing import List
 
-from kubernetes import client, config
 from kubernetes.client.rest import ApiException
 
 from .config import (
-    SERVICE_FILE,
-    SERVICESPEC_FILE,
-    SUBSCRIPTION_FILE,
-    NODE_STATUS_FILE,
     GPU_MEMORY_LABEL,
-    IN_CLUSTER,
+    WARM_POOL_INTERVAL,
+    WARM_POOL_READY_TIMEOUT,
+    FORECAST_INTERVAL,
+    FORECAST_WINDOW,
+    FORECAST_ALPHA,
+    FORECAST_BETA,
+    FORECAST_HORIZON,
+    FORECAST_SCALE_IN_DELAY,
 )
+from .forecaster import DemandForecaster
+from .placement import ClusterView, plan_placement
+from .kube_cache import kube_cache
+from .kube_client import kube_client
 from .kube_utils import (
     deploy_pod,
-    node_status_sync,
-    communicate_with_agent,
+    delete_pod,
+    wait_for_pod_ready,
+    port_allocator,
 )
+from .port_allocator import pod_name, parse_pod_name
+from .agent_notifier import agent_notifier
+from .node_health import node_health
+from .warm_pool import warm_pool
+from .worker_pool import worker_pool
+from .state import cluster_state, SERVICES, SUBSCRIPTIONS
 import optimizer
 
 # select optimizer function by environment variable
 optimize = getattr(optimizer, os.getenv("OPTIMIZER_FUNCTION", "optimize"))
+# add_agent() and admission_capacity() follow the greedy of optimize(),
+# the other strategies always redistribute all agents
+greedyOptimizer = optimize in (optimizer.optimize, optimizer.optimize_sorted, optimizer.waterfill)
 
+demand_forecaster = DemandForecaster(FORECAST_WINDOW, FORECAST_ALPHA, FORECAST_BETA, FORECAST_HORIZON)
+# serviceType -> 備用Pod超過目標數量開始的時間
+_surplusSince_dict = {}
 
-def compute_frequnecy(serviceType: str, agentCounter: int):
+
+def allocate_agents(serviceType: str, agentCounter: int):
+    """
+    Allocation of agentCounter agents on the current instances of
+    serviceType, and whether serviceType needs another instance to serve
+    them at frequencyLimit[0].
+    """
     mustAutoScaling = True
-    with open(SERVICE_FILE, 'r') as service_jsonFile:
-        try:
-            service_list = json.load(service_jsonFile)
-        except json.decoder.JSONDecodeError:
-            service_list = []
+    connectedAgentCounter = 0
+    relation_list = None
+    service_list = cluster_state.copy_service_list()
     for service in service_list:
         if service['serviceType'] == serviceType:
             mustAutoScaling = False
+            connectedAgentCounter += int(service['currentConnection'])
     if not mustAutoScaling:
-        status, relation_list = optimize(serviceType, agentCounter, service_list)
+        status = 'fail'
+        if greedyOptimizer and agentCounter == connectedAgentCounter + 1:
+            # 只新增一個Agent時，直接放到目前的配對上，不重新分配其他Agent
+            status, relation_list, _ = optimizer.add_agent(serviceType, service_list)
+        if status == 'fail':
+            service_list = cluster_state.copy_service_list()
+            status, relation_list = optimize(serviceType, agentCounter, service_list)
         for relation in relation_list:
             if relation['currentFrequency'] < relation['frequencyLimit'][0]:
                 mustAutoScaling = True
                 break
+    return mustAutoScaling, relation_list
+
+
+async def compute_frequnecy(serviceType: str, agentCounter: int):
+    mustAutoScaling, relation_list = allocate_agents(serviceType, agentCounter)
     if mustAutoScaling:
-        deploy_service(serviceType)
-        with open(SERVICE_FILE, 'r') as service_jsonFile:
-            try:
-                service_list = json.load(service_jsonFile)
-            except json.decoder.JSONDecodeError:
-                service_list = []
-        status, relation_list = optimize(serviceType, agentCounter, service_list)
-        while status == 'fail':
-            agentCounter -= 1
-            status, relation_list = optimize(serviceType, agentCounter, service_list)
+        await deploy_service(serviceType)
+        service_list = cluster_state.copy_service_list()
+        admittedAgentCounter, relation_list = max_admission(serviceType, agentCounter, service_list)
+        if admittedAgentCounter < agentCounter:
+            logging.info(f"Function compute_frequnecy() can only admit {admittedAgentCounter} of {agentCounter} {serviceType} agents")
     return relation_list
 
 
-def deploy_service(serviceType: str):
+def scale_out_service_types(agentCounter_dict: dict) -> List[str]:
+    """serviceTypes of agentCounter_dict that need another instance to serve their agents at frequencyLimit[0]."""
+    return [
+        serviceType for serviceType, agentCounter in agentCounter_dict.items()
+        if allocate_agents(serviceType, agentCounter)[0]
+    ]
+
+
+def reallocate_agents(agentCounter_dict: dict, scaleOut_list: List[str]) -> list:
+    """One service list with the allocation of every serviceType of agentCounter_dict."""
+    # 每個 serviceType 的最佳化只修改自己的 instance，依序套用在同一份 service_list 上
+    service_list = cluster_state.copy_service_list()
+    for serviceType, agentCounter in agentCounter_dict.items():
+        if serviceType in scaleOut_list:
+            admittedAgentCounter, service_list = max_admission(serviceType, agentCounter, service_list)
+            if admittedAgentCounter < agentCounter:
+                logging.info(f"Function reallocate_agents() can only admit {admittedAgentCounter} of {agentCounter} {serviceType} agents")
+        else:
+            _, service_list = optimize(serviceType, agentCounter, service_list)
+    return service_list
+
+
+def max_admission(serviceType: str, agentCounter: int, service_list: list):
+    """
+    Largest number of agents up to agentCounter that the optimizer can serve
+    and the allocation for it.
+    """
+    def allocate(count: int):
+        return optimize(serviceType, count, [dict(service) for service in service_list])
+
+    if greedyOptimizer:
+        # the capacity follows from workloadLimit / frequencyLimit[1] of every instance
+        guess = optimizer.admission_capacity(serviceType, agentCounter, service_list)
+    else:
+        guess = agentCounter
+
+    # low: the most agents known to fit, high: the most agents that may fit
+    low, high = 0, agentCounter
+    _, relation_list = allocate(0)
+    if guess > 0:
+        status, guessRelation_list = allocate(guess)
+        if status == 'success':
+            low, relation_list = guess, guessRelation_list
+        else:
+            high = guess - 1
+    if 0 < low < high:
+        # the guess is only the answer if one more agent does not fit
+        status, nextRelation_list = allocate(low + 1)
+        if status == 'success':
+            low, relation_list = low + 1, nextRelation_list
+        else:
+            high = low
+
+    # bisection over the agent count, a failed allocation stays failed with more agents
+    while low < high:
+        middle = (low + high + 1) // 2
+        status, middleRelation_list = allocate(middle)
+        if status == 'success':
+            low, relation_list = middle, middleRelation_list
+        else:
+            high = middle - 1
+    return low, relation_list
+
+
+def release_agent(podIP: str):
+    for index, service in enumerate(cluster_state.service_list):
+        if service['podIP'] != podIP:
+            continue
+        currentFrequency = service['currentFrequency']
+        with cluster_state.mutate(SERVICES):
+            if greedyOptimizer:
+                optimizer.remove_agent(cluster_state.service_list, index)
+            else:
+                service['currentConnection'] -= 1
+        return service['serviceType'], service['currentFrequency'] != currentFrequency
+    return None, False
+
+
+async def read_gpu_memory(nodeName_list: List[str]) -> dict:
+    """GPU memory label of every healthy node of nodeName_list, in the same order."""
+    core_api = kube_client.core_api()
+    node_status_data = cluster_state.node_health_status
+    gpuMemory_dict = {}
+    for nodeName in nodeName_list:
+        if node_status_data.get(nodeName) != 'healthy':
+            continue
+        node = kube_cache.node(nodeName)
+        if node is not None:
+            nodeLabels = node['labels']
+        else:
+            nodeLabels = (await worker_pool.run(core_api.read_node, name=nodeName)).metadata.labels
+        gpuMemory_dict[nodeName] = int(nodeLabels.get(GPU_MEMORY_LABEL))
+    # 讀取 label 期間收到故障通知的節點也不能部署
+    return {
+        nodeName: gpuMemory for nodeName, gpuMemory in gpuMemory_dict.items()
+        if cluster_state.node_health_status.get(nodeName) == 'healthy'
+    }
+
+
+def cluster_view(service_list: list, serviceSpec_dict: dict) -> ClusterView:
+    return ClusterView(service_list, warm_pool.standbys(), serviceSpec_dict)
+
+
+def commit_service_list(service_list: list, snapshotSeq: int):
+    """
+    Write back service_list, computed from the copy_service_list() taken
+    when cluster_state.seq was snapshotSeq. There must be no await between
+    the copy and the write back: nothing else can change the state then, and
+    the serviceTypes re-optimized on the way need not be locked.
+
+    Raises RuntimeError and writes nothing if the state changed since the
+    copy, the caller gives back what it took for the new instance.
+    """
+    if cluster_state.seq != snapshotSeq:
+        raise RuntimeError(f"the cluster state changed between copy_service_list() (seq {snapshotSeq}) and the write back (seq {cluster_state.seq})")
+    with cluster_state.mutate(SERVICES):
+        cluster_state.service_list = service_list
+
+
+def split_node(nodeName: str, service_list: list, serviceSpec_dict: dict, newInstances: int = 1):
+    """
+    Share the workAbility of nodeName between its services and newInstances
+    new ones, and re-optimize the serviceTypes on the node.
+
+    Returns the status, the updated service_list, the serviceTypes whose
+    frequencies changed and the workloadLimit of a new instance of each
+    serviceType on the node.
+    """
+    serviceOnThisNode_list = [service for service in service_list if service['nodeName'] == nodeName]
+    split = len(serviceOnThisNode_list) + newInstances
+    for service in serviceOnThisNode_list:
+        service['workloadLimit'] = serviceSpec_dict[service['serviceType']]['workAbility'][nodeName] / split
+    status = 'success'
+    adjustFrequencyServiceType_list = []
+    for serviceOnThisNode in serviceOnThisNode_list:
+        serviceType = serviceOnThisNode['serviceType']
+        instance_list = [service for service in service_list if service['serviceType'] == serviceType]
+        agentCounter = sum(int(service['currentConnection']) for service in instance_list)
+        if agentCounter == 0:
+            # 沒有Agent需要重新分配
+            continue
+        # 最佳化會原地修改 instance，只需要比較這個 serviceType 的連線數與頻率
+        before = [(service['currentConnection'], service['currentFrequency']) for service in instance_list]
+        optimizeStatus, service_list = optimize(serviceType, agentCounter, service_list)
+        if optimizeStatus == 'fail':
+            status = 'fail'
+        if [(service['currentConnection'], service['currentFrequency']) for service in instance_list] != before:
+            adjustFrequencyServiceType_list.append(serviceType)
+    return status, service_list, adjustFrequencyServiceType_list, split
+
+
+async def undo_split(nodeName: str, serviceSpec_dict: dict):
+    """Give the share of a new instance that could not be created back to the services on nodeName."""
+    snapshotSeq = cluster_state.seq
+    service_list = cluster_state.copy_service_list()
+    _, service_list, adjustFrequencyServiceType_list, _ = split_node(nodeName, service_list, serviceSpec_dict, 0)
+    commit_service_list(service_list, snapshotSeq)
+    for adjustFrequencyServiceType in adjustFrequencyServiceType_list:
+        await adjust_frequency(adjustFrequencyServiceType)
+
+
+async def deployable_gpu_memory():
+    """serviceSpec of every serviceType and the GPU memory of the healthy nodes they can run on."""
     nodeDeployed_list = []
-    workloadLimitAfterDeployed_dict = {}
     serviceSpec_dict = {}
-    usedPort = set()
-    with open(SERVICESPEC_FILE, 'r') as serviceSpec_jsonFile:
-        serviceSpec_list = json.load(serviceSpec_jsonFile)
-    for serviceSpec in serviceSpec_list:
+    for serviceSpec in cluster_state.serviceSpec_list:
         nodeDeployed_list.extend(serviceSpec["workAbility"].keys())
         serviceSpec_dict[serviceSpec['serviceType']] = {
             k: v for k, v in serviceSpec.items() if k != "serviceType"
         }
     nodeDeployed_list = list(set(nodeDeployed_list))
-    config.load_incluster_config() if IN_CLUSTER else config.load_kube_config()
-    core_api = client.CoreV1Api()
-    with open(SERVICE_FILE, 'r') as service_jsonFile:
-        try:
-            service_list = json.load(service_jsonFile)
-        except json.decoder.JSONDecodeError:
-            service_list = []
-    node_status_sync(nodeDeployed_list)
-    with open(NODE_STATUS_FILE, 'r') as node_status_jsonFile:
-        node_status_data = json.load(node_status_jsonFile)
-    for nodeDeployed in nodeDeployed_list:
-        if node_status_data[nodeDeployed] == 'unhealthy':
-            continue
-        canDeployOnThisNode = True
-        gpuMemoryRequest = 0
-        serviceTypeOnThisNode_list = []
-        for service in service_list:
-            if service['nodeName'] == nodeDeployed:
-                if service['serviceType'] == serviceType:
-                    canDeployOnThisNode = False
-                    break
-                else:
-                    serviceTypeOnThisNode_list.append(service['serviceType'])
-                    gpuMemoryRequest += serviceSpec_dict[service['serviceType']]['gpuMemoryRequest']
-        nodeInformation = core_api.read_node(name=nodeDeployed)
-        gpuMemory = int(nodeInformation.metadata.labels.get(GPU_MEMORY_LABEL))
-        if not canDeployOnThisNode or gpuMemoryRequest > gpuMemory:
-            continue
-        for serviceTypeOnThisNode in serviceTypeOnThisNode_list:
-            workloadLimitAfterDeployed = float(
-                serviceSpec_dict[serviceTypeOnThisNode]['workAbility'][nodeDeployed]
-            ) / (len(serviceTypeOnThisNode_list)+1)
-            if workloadLimitAfterDeployed < serviceSpec_dict[serviceTypeOnThisNode]['frequencyLimit'][0]:
-                canDeployOnThisNode = False
-                break
-        if float(serviceSpec_dict[serviceType]['workAbility'][nodeDeployed]) / (
-            len(serviceTypeOnThisNode_list)+1) < serviceSpec_dict[serviceType]['frequencyLimit'][0]:
-            canDeployOnThisNode = False
-        if canDeployOnThisNode:
-            workloadLimitAfterDeployed_dict[nodeDeployed] = float(
-                serviceSpec_dict[serviceType]['workAbility'][nodeDeployed]
-            ) / (len(serviceTypeOnThisNode_list)+1)
-    if len(workloadLimitAfterDeployed_dict) == 0:
+    # 節點狀態由背景定期更新，只有超過 NODE_HEALTH_TTL 的節點才會重新檢查
+    await node_health.status(nodeDeployed_list)
+    return serviceSpec_dict, await read_gpu_memory(nodeDeployed_list)
+
+
+async def deploy_service(serviceType: str, excludedNodeName_set: frozenset = frozenset()):
+    # 先讀取節點的GPU記憶體，取得 service_list 之後到寫回之前不能 await，否則會蓋掉其他請求的修改
+    serviceSpec_dict, gpuMemory_dict = await deployable_gpu_memory()
+    snapshotSeq = cluster_state.seq
+    service_list = cluster_state.copy_service_list()
+    # 有已經 Ready 的備用Pod的節點排在最前面，不需要等待新的Pod啟動
+    candidate_list = [
+        candidate for candidate in cluster_view(service_list, serviceSpec_dict).candidates(serviceType, gpuMemory_dict)
+        if candidate.nodeName not in excludedNodeName_set
+    ]
+    if len(candidate_list) == 0:
         return 'no enoungh computing resource'
-    workloadLimit = max(workloadLimitAfterDeployed_dict.values())
-    nodeName = next(
-        iter(k for k, v in workloadLimitAfterDeployed_dict.items() if v == workloadLimit)
+    for candidate in candidate_list:
+        nodeName = candidate.nodeName
+        if service_list is None:
+            # 前一個節點部署失敗，期間 service_list 可能被其他請求修改過
+            snapshotSeq = cluster_state.seq
+            service_list = cluster_state.copy_service_list()
+        status, service_list, adjustFrequencyServiceType_list, split = split_node(nodeName, service_list, serviceSpec_dict)
+        if status == 'fail':
+            service_list = None
+            continue
+        standby = warm_pool.take(serviceType, nodeName)
+        if standby is None:
+            hostPort = port_allocator.allocate(serviceType, nodeName)
+            if hostPort is None:
+                logging.error(f"No free hostPort on {nodeName}")
+                service_list = None
+                continue
+        try:
+            commit_service_list(service_list, snapshotSeq)
+        except RuntimeError:
+            # 沒有寫回就不會部署，hostPort 與備用Pod 要還回去
+            if standby is not None:
+                warm_pool.put_back(standby)
+            else:
+                port_allocator.release(pod_name(serviceType, nodeName, hostPort))
+            raise
+        service_list = None
+        # 同節點上其他 serviceType 的 Lock 不在這裡取得：呼叫者已經持有自己的 Lock，
+        # 再取得其他 Lock 不符合排序，可能和反方向的部署互相等待。寫回的 service list
+        # 是在沒有 await 的區段算出的 (commit_service_list() 檢查)，adjust_frequency()
+        # 也在第一個 await 之前就依照它更新配對關係。持有那些 Lock 的請求也不會在 await
+        # 期間留下寫到一半的狀態：/subscribe、/unsubscribe 與故障後的重新分配都在同一個
+        # mutate() 中寫入 service list 與訂閱 (admit_agent())。唯一的例外是 pod_failure
+        # 重新部署期間，故障 instance 的Agent暫時沒有 instance，重新最佳化只會分配其他Agent
+        for adjustFrequencyServiceType in adjustFrequencyServiceType_list:
+            await adjust_frequency(adjustFrequencyServiceType)
+        if standby is not None:
+            podIP = standby['podIP']
+            hostIP = standby['hostIP']
+            hostPort = standby['hostPort']
+            logging.info(f"promote standby Pod {standby['podName']}")
+        else:
+            try:
+                resp = await deploy_pod_with_port(serviceType, hostPort, nodeName)
+            except Exception as e:
+                logging.error(f"Failed to deploy {serviceType} on {nodeName}, try the next node: {e}")
+                await undo_split(nodeName, serviceSpec_dict)
+                continue
+            hostPort = resp.spec.containers[0].ports[0].host_port
+            podIP = resp.status.pod_ip
+            hostIP = resp.status.host_ip
+            podName = resp.metadata.name
+            if await wait_for_pod_ready(podName) is None:
+                logging.warning(f"Pod {podName} is not ready yet, add it to the service list anyway")
+        add_service(serviceType, nodeName, podIP, hostIP, hostPort, serviceSpec_dict, split)
+        return f"deploy {serviceType} service successfully"
+    return 'no enoungh computing resource'
+
+
+def add_service(serviceType: str, nodeName: str, podIP: str, hostIP: str, hostPort: int, serviceSpec_dict: dict, split: int):
+    with cluster_state.mutate(SERVICES):
+        cluster_state.service_list.append({
+            "podIP": str(podIP),
+            "hostPort": int(hostPort),
+            "serviceType": str(serviceType),
+            "currentConnection": 0,
+            "nodeName": nodeName,
+            "hostIP": str(hostIP),
+            "frequencyLimit": serviceSpec_dict[serviceType]['frequencyLimit'],
+            "currentFrequency": serviceSpec_dict[serviceType]['frequencyLimit'][0],
+            "workloadLimit": serviceSpec_dict[serviceType]['workAbility'][nodeName] / float(split)
+        })
+    logging.info(f"deploy {serviceType} service successfully")
+
+
+async def start_service(serviceType: str, nodeName: str, hostPort: int, serviceSpec_dict: dict, split: int) -> bool:
+    """Create the Pod of a new instance placed by deploy_services() and add it to the service list."""
+    try:
+        resp = await deploy_pod_with_port(serviceType, hostPort, nodeName)
+    except Exception as e:
+        logging.error(f"Failed to deploy {serviceType} on {nodeName}: {e}")
+        return False
+    podName = resp.metadata.name
+    if await wait_for_pod_ready(podName) is None:
+        logging.warning(f"Pod {podName} is not ready yet, add it to the service list anyway")
+    add_service(
+        serviceType, nodeName, resp.status.pod_ip, resp.status.host_ip,
+        resp.spec.containers[0].ports[0].host_port, serviceSpec_dict, split,
     )
-    serviceTypeOnThisNode = 1
-    serviceTypeOnThisNode += sum(1 for service in service_list if service['nodeName'] == nodeName)
-    serviceConnection_dict = {}
-    indexOfServiceOnDeployedNode = []
-    for index, service in enumerate(service_list):
-        if service['nodeName'] == nodeName:
-            indexOfServiceOnDeployedNode.append(index)
-        if service['serviceType'] not in serviceConnection_dict:
-            serviceConnection_dict[service['serviceType']] = 0
-        serviceConnection_dict[service['serviceType']] += int(service['currentConnection'])
-        usedPort.add(int(service['hostPort']))
-    adjustFrequencyServiceType_list = []
-    for index in indexOfServiceOnDeployedNode:
-        service_list[index]['workloadLimit'] = serviceSpec_dict[service_list[index]['serviceType']]['workAbility'][nodeName] / (
-            len(indexOfServiceOnDeployedNode)+1)
-        originalService_list = copy.deepcopy(service_list)
-        status, service_list = optimize(
-            service_list[index]['serviceType'],
-            serviceConnection_dict[service_list[index]['serviceType']],
-            service_list,
+    return True
+
+
+async def deploy_services(serviceType_list: List[str]):
+    """
+    One new instance of every serviceType of serviceType_list. The instances
+    are placed together by placement.plan_placement() and their Pods are
+    started concurrently, so the time it takes is the slowest Pod start
+    instead of the sum of all of them. A serviceType whose Pod cannot be
+    created falls back to deploy_service().
+    """
+    serviceSpec_dict, gpuMemory_dict = await deployable_gpu_memory()
+    snapshotSeq = cluster_state.seq
+    service_list = cluster_state.copy_service_list()
+    placement_dict = plan_placement(serviceType_list, cluster_view(service_list, serviceSpec_dict), gpuMemory_dict)
+    serviceType_dict = {}
+    for serviceType, candidate in placement_dict.items():
+        serviceType_dict.setdefault(candidate.nodeName, []).append(serviceType)
+    # serviceType -> 建立Pod失敗的節點
+    retry_dict = {serviceType: frozenset() for serviceType in serviceType_list if serviceType not in placement_dict}
+    adjustFrequencyServiceType_set = set()
+    # (serviceType, nodeName, standby, hostPort, split)
+    launch_list = []
+    for nodeName, serviceTypeOnThisNode_list in serviceType_dict.items():
+        # (serviceType, hostPort)，有 Ready 備用Pod的 serviceType 不需要 hostPort
+        nodeLaunch_list = []
+        for serviceType in serviceTypeOnThisNode_list:
+            hostPort = None
+            if not warm_pool.is_ready(serviceType, nodeName):
+                hostPort = port_allocator.allocate(serviceType, nodeName)
+                if hostPort is None:
+                    logging.error(f"No free hostPort on {nodeName}")
+                    continue
+            nodeLaunch_list.append((serviceType, hostPort))
+        if not nodeLaunch_list:
+            continue
+        # 沒有取得 hostPort 的 instance 不計入分配，每個節點只分割一次，
+        # 分割失敗時 service_list 維持原樣
+        status, splitService_list, adjustFrequencyServiceType_list, split = split_node(
+            nodeName, [dict(service) for service in service_list], serviceSpec_dict, len(nodeLaunch_list)
         )
         if status == 'fail':
-            return 'no enoungh computing resource'
-        if service_list != originalService_list:
-            adjustFrequencyServiceType_list.append(service_list[index]['serviceType'])
-    with open(SERVICE_FILE, 'w') as service_jsonFile:
-        json.dump(service_list, service_jsonFile, indent=4)
-    for adjustFrequencyServiceType in adjustFrequencyServiceType_list:
-        adjust_frequency(adjustFrequencyServiceType)
-    for i in range(30500, 31000):
-        if i not in usedPort:
-            hostPort = i
-            break
-    resp = deploy_pod(serviceType, hostPort, nodeName)
-    while resp is None:
-        for i in range(hostPort+1, 31000):
-            if i not in usedPort:
-                hostPort = i
-                break
-        resp = deploy_pod(serviceType, hostPort, nodeName)
-    podIP = resp.status.pod_ip
-    hostIP = resp.status.host_ip
-    nodeName = resp.spec.node_name
-    podName = resp.metadata.name
-    timeCounter = 0
-    isPodReady = False
-    while not isPodReady:
-        pod = core_api.read_namespaced_pod(name=podName, namespace='default')
-        for data in pod.status.conditions:
-            if data.type == 'Ready' and data.status == 'True':
-                isPodReady = True
-        if timeCounter == 12:
-            break
-        if not isPodReady:
-            time.sleep(5)
-            timeCounter += 1
-    service_list.append({
-        "podIP": str(podIP),
-        "hostPort": int(hostPort),
-        "serviceType": str(serviceType),
-        "currentConnection": 0,
-        "nodeName": nodeName,
-        "hostIP": str(hostIP),
-        "frequencyLimit": serviceSpec_dict[serviceType]['frequencyLimit'],
-        "currentFrequency": serviceSpec_dict[serviceType]['frequencyLimit'][0],
-        "workloadLimit": serviceSpec_dict[serviceType]['workAbility'][nodeName] / float(len(indexOfServiceOnDeployedNode)+1)
-    })
-    with open(SERVICE_FILE, 'w') as service_jsonFile:
-        json.dump(service_list, service_jsonFile, indent=4)
-    logging.info(f"deploy {serviceType} service successfully")
-    return f"deploy {serviceType} service successfully"
+            for serviceType, hostPort in nodeLaunch_list:
+                if hostPort is not None:
+                    port_allocator.release(pod_name(serviceType, nodeName, hostPort))
+            retry_dict.update((serviceType, frozenset()) for serviceType in serviceTypeOnThisNode_list)
+            continue
+        service_list = splitService_list
+        adjustFrequencyServiceType_set.update(adjustFrequencyServiceType_list)
+        launch_list.extend(
+            (serviceType, nodeName, warm_pool.take(serviceType, nodeName) if hostPort is None else None, hostPort, split)
+            for serviceType, hostPort in nodeLaunch_list
+        )
+    try:
+        commit_service_list(service_list, snapshotSeq)
+    except RuntimeError:
+        for serviceType, nodeName, standby, hostPort, split in launch_list:
+            if standby is not None:
+                warm_pool.put_back(standby)
+            elif hostPort is not None:
+                port_allocator.release(pod_name(serviceType, nodeName, hostPort))
+        raise
+    for adjustFrequencyServiceType in adjustFrequencyServiceType_set:
+        await adjust_frequency(adjustFrequencyServiceType)
+
+    task_list = []
+    for serviceType, nodeName, standby, hostPort, split in launch_list:
+        if standby is not None:
+            logging.info(f"promote standby Pod {standby['podName']}")
+            add_service(serviceType, nodeName, standby['podIP'], standby['hostIP'], standby['hostPort'], serviceSpec_dict, split)
+        else:
+            task_list.append((serviceType, nodeName, start_service(serviceType, nodeName, hostPort, serviceSpec_dict, split)))
+    started_list = await asyncio.gather(*(task for _, _, task in task_list))
+    failedNode_set = set()
+    for (serviceType, nodeName, _), started in zip(task_list, started_list):
+        if not started:
+            failedNode_set.add(nodeName)
+            retry_dict[serviceType] = frozenset([nodeName])
+    for nodeName in failedNode_set:
+        await undo_split(nodeName, serviceSpec_dict)
+    for serviceType, excludedNodeName_set in retry_dict.items():
+        await deploy_service(serviceType, excludedNodeName_set)
 
 
-def adjust_frequency(serviceType: str):
+def frequency_notifications(serviceType: str):
+    """
+    Move the agents of serviceType to the pairing of the service list and
+    return the notifications for the agents whose config changes, and the
+    index of an instance of serviceType with room for one more agent (or None).
+    """
     podIPIndex_dict = {}
-    with open(SERVICE_FILE, 'r') as service_jsonFile:
-        try:
-            service_list = json.load(service_jsonFile)
-        except json.decoder.JSONDecodeError:
-            service_list = []
-    with open(SUBSCRIPTION_FILE, 'r') as subscription_jsonFile:
-        try:
-            subscription_list = json.load(subscription_jsonFile)
-        except json.decoder.JSONDecodeError:
-            subscription_list = []
+    notification_list = []
+    service_list = cluster_state.service_list
+    subscriptions = cluster_state.subscriptions
     for index, service in enumerate(service_list):
         if service['serviceType'] == serviceType:
             podIPIndex_dict[service['podIP']] = {}
@@ -211,50 +465,315 @@ def adjust_frequency(serviceType: str):
             podIPIndex_dict[service['podIP']]['currentConnection'] = service['currentConnection']
             podIPIndex_dict[service['podIP']]['currentFrequency'] = service['currentFrequency']
             podIPIndex_dict[service['podIP']]['nodeName'] = service['nodeName']
-    reconfigureAgentIndex_list = []
-    for index, subscription in enumerate(subscription_list):
+    reconfigureAgentId_list = []
+    for subscriptionId in subscriptions.ids_of_service_type(serviceType):
+        subscription = subscriptions[subscriptionId]
         if (
             subscription['podIP'] in podIPIndex_dict.keys() and
-            podIPIndex_dict[subscription['podIP']]['currentConnection'] != 0 and
-            subscription['serviceType'] == serviceType
+            podIPIndex_dict[subscription['podIP']]['currentConnection'] != 0
         ):
             podIPIndex_dict[subscription['podIP']]['currentConnection'] -= 1
+            service = service_list[podIPIndex_dict[subscription['podIP']]['index']]
             body = {
                 'servicename': serviceType,
                 'ip': 'null',
                 'port': 0,
-                'frequency': service_list[podIPIndex_dict[subscription['podIP']]['index']]['currentFrequency'],
+                'frequency': service['currentFrequency'],
             }
-            communicate_with_agent(body, str(subscription['agentIP']), int(subscription['agentPort']))
-        elif subscription['serviceType'] == serviceType:
-            reconfigureAgentIndex_list.append(index)
+            # agentConfig is what the agent ends up with, 'null' means it keeps its current pod
+            notification_list.append((
+                body,
+                str(subscription['agentIP']),
+                int(subscription['agentPort']),
+                (str(service['hostIP']), int(service['hostPort']), service['currentFrequency']),
+            ))
+        else:
+            reconfigureAgentId_list.append(subscriptionId)
             if subscription['podIP'] in podIPIndex_dict.keys():
                 del podIPIndex_dict[subscription['podIP']]
-    for reconfigureAgentIndex in reconfigureAgentIndex_list:
-        for key, value in podIPIndex_dict.items():
-            if int(value['currentConnection']) != 0:
-                value['currentConnection'] -= 1
-                body = {
-                    'servicename': serviceType,
-                    'ip': str(service_list[value['index']]['hostIP']),
-                    'port': int(service_list[value['index']]['hostPort']),
-                    'frequency': service_list[value['index']]['currentFrequency'],
-                }
-                communicate_with_agent(
-                    body,
-                    str(subscription_list[reconfigureAgentIndex]['agentIP']),
-                    int(subscription_list[reconfigureAgentIndex]['agentPort']),
-                )
-                subscription_list[reconfigureAgentIndex]['podIP'] = str(key)
-                subscription_list[reconfigureAgentIndex]['nodeName'] = str(service_list[value['index']]['nodeName'])
-                break
-    with open(SUBSCRIPTION_FILE, 'w') as subscription_jsonFile:
-        json.dump(subscription_list, subscription_jsonFile, indent=4)
+    # 所有移動的Agent記錄成一筆 journal
+    with cluster_state.mutate(SUBSCRIPTIONS):
+        for reconfigureAgentId in reconfigureAgentId_list:
+            for key, value in podIPIndex_dict.items():
+                if int(value['currentConnection']) != 0:
+                    value['currentConnection'] -= 1
+                    body = {
+                        'servicename': serviceType,
+                        'ip': str(service_list[value['index']]['hostIP']),
+                        'port': int(service_list[value['index']]['hostPort']),
+                        'frequency': service_list[value['index']]['currentFrequency'],
+                    }
+                    notification_list.append((
+                        body,
+                        str(subscriptions[reconfigureAgentId]['agentIP']),
+                        int(subscriptions[reconfigureAgentId]['agentPort']),
+                        (body['ip'], body['port'], body['frequency']),
+                    ))
+                    subscriptions.move(reconfigureAgentId, str(key), str(service_list[value['index']]['nodeName']))
+                    break
     for key, value in podIPIndex_dict.items():
         if int(value['currentConnection']) != 0:
-            logging.info(
-                f"Function adjust_frequency() adjust frequency of {serviceType} and return {value['index']}"
-            )
-            return value['index']
+            return notification_list, value['index']
+    return notification_list, None
+
+
+def collect_notifications(serviceType_list: List[str]) -> list:
+    """frequency_notifications() of several serviceTypes, the pairings are moved as one journal record."""
+    notification_list = []
+    with cluster_state.mutate(SUBSCRIPTIONS):
+        for serviceType in serviceType_list:
+            notification_list.extend(frequency_notifications(serviceType)[0])
+    return notification_list
+
+
+async def notify_agents(notification_list: list, serviceType_list: List[str]) -> dict:
+    """Send the notifications of frequency_notifications() to the agents at the same time."""
+    report = await agent_notifier.notify(notification_list)
+    if report['failed']:
+        logging.warning(
+            f"Function notify_agents() {len(report['failed'])} of {len(notification_list)} agents of {serviceType_list} did not ack"
+        )
+    return report
+
+
+def admit_agent(relation_list: list, serviceType: str, agentIP: str, agentPort: int):
+    """
+    Write relation_list, the allocation with one more agent of serviceType,
+    and subscribe the agent to the instance that has room for it.
+
+    The service list, the moved pairings and the new subscription are one
+    journal record and nothing awaits in between, so no other request sees
+    the new connection without its subscription. Returns the notifications
+    for the other agents and the instance of the new agent (None if no
+    instance has room for it).
+    """
+    with cluster_state.mutate(SERVICES, SUBSCRIPTIONS):
+        cluster_state.service_list = relation_list
+        # 這邊只會調整 new agent 以外的配對關係
+        notification_list, serviceIndex = frequency_notifications(serviceType)
+        if serviceIndex is None:
+            return notification_list, None
+        service = relation_list[serviceIndex]
+        cluster_state.subscriptions.add({
+            "agentIP": agentIP,
+            "agentPort": agentPort,
+            "podIP": service['podIP'],
+            "serviceType": serviceType,
+            "nodeName": service['nodeName'],
+        })
+    agent_notifier.remember(agentIP, agentPort, serviceType, (
+        str(service['hostIP']), int(service['hostPort']), service['currentFrequency'],
+    ))
+    return notification_list, dict(service)
+
+
+async def adjust_frequency(serviceType: str):
+    notification_list, serviceIndex = frequency_notifications(serviceType)
+    # 配對關係已經更新，同時通知所有設定有改變的Agent
+    await notify_agents(notification_list, [serviceType])
+    if serviceIndex is not None:
+        logging.info(f"Function adjust_frequency() adjust frequency of {serviceType} and return {serviceIndex}")
+        return serviceIndex
     logging.info(f"Function adjust_frequency() adjust frequency of {serviceType}")
     return None
+
+
+async def deploy_pod_with_port(serviceType: str, hostPort: int, nodeName: str):
+    """
+    deploy_pod() with a port from port_allocator, the port is given back if
+    the Pod is not created and a Pod that is not scheduled in time is deleted.
+    """
+    while True:
+        try:
+            resp = await deploy_pod(serviceType, hostPort, nodeName)
+        except TimeoutError:
+            await worker_pool.run(delete_pod, pod_name(serviceType, nodeName, hostPort))
+            raise
+        except Exception:
+            port_allocator.release(pod_name(serviceType, nodeName, hostPort))
+            raise
+        if resp is not None:
+            return resp
+        # 同名的Pod還在刪除中，只有 watch 沒有同步時才會發生，保留這個 port 到刪除完成
+        port_allocator.release_after_delete(pod_name(serviceType, nodeName, hostPort))
+        hostPort = port_allocator.allocate(serviceType, nodeName)
+        if hostPort is None:
+            raise RuntimeError(f"No free hostPort on {nodeName}")
+
+
+async def start_standby(standby: dict):
+    podName = standby['podName']
+    try:
+        resp = await deploy_pod(standby['serviceType'], standby['hostPort'], standby['nodeName'])
+    except Exception as e:
+        logging.error(f"Failed to create standby Pod {podName}: {e}")
+        if not isinstance(e, TimeoutError):
+            port_allocator.release(podName)
+        resp = None
+    if resp is None:
+        port_allocator.release_after_delete(podName)
+        warm_pool.remove(podName, failed=True)
+        return
+    pod = await wait_for_pod_ready(podName, WARM_POOL_READY_TIMEOUT)
+    if pod is None:
+        logging.warning(f"Standby Pod {podName} is not ready after {WARM_POOL_READY_TIMEOUT} seconds, delete it")
+        warm_pool.remove(podName, failed=True)
+        await worker_pool.run(delete_pod, podName)
+        return
+    if warm_pool.mark_ready(podName, str(pod.status.pod_ip), str(pod.status.host_ip)) is None:
+        # 啟動期間節點故障，備用Pod已經從 warm_pool 移除
+        await worker_pool.run(delete_pod, podName)
+        return
+    logging.info(f"standby Pod {podName} is ready")
+
+
+def warm_pool_target(serviceType: str) -> int:
+    """
+    Standby Pods serviceType should have: the warmPool of its serviceSpec, or
+    more when the forecast subscriptions exceed what the current instances
+    serve at frequencyLimit[0].
+    """
+    serviceSpec = cluster_state.serviceSpec_dict[serviceType]
+    target = int(serviceSpec.get('warmPool', 0))
+    demand = demand_forecaster.forecast(serviceType)
+    defaultFrequency = serviceSpec['frequencyLimit'][0]
+    instanceCapacity_list = [
+        int(service['workloadLimit'] // defaultFrequency)
+        for service in cluster_state.service_list if service['serviceType'] == serviceType
+    ]
+    capacity = sum(instanceCapacity_list)
+    if demand > capacity:
+        if instanceCapacity_list:
+            capacityPerInstance = sum(instanceCapacity_list) / len(instanceCapacity_list)
+        else:
+            workAbility_list = list(serviceSpec['workAbility'].values())
+            capacityPerInstance = sum(workAbility_list) / len(workAbility_list) // defaultFrequency
+        target = max(target, math.ceil((demand - capacity) / max(1, capacityPerInstance)))
+    return target
+
+
+async def trim_warm_pool(serviceType: str, target: int):
+    """Delete the ready standby Pods above target once the forecast has stayed low for FORECAST_SCALE_IN_DELAY."""
+    loop = asyncio.get_running_loop()
+    surplus = warm_pool.count(serviceType) - target
+    if surplus <= 0:
+        _surplusSince_dict.pop(serviceType, None)
+        return
+    if loop.time() - _surplusSince_dict.setdefault(serviceType, loop.time()) < FORECAST_SCALE_IN_DELAY:
+        return
+    for standby in warm_pool.of_service_type(serviceType):
+        if surplus <= 0:
+            break
+        if standby['ready']:
+            warm_pool.remove(standby['podName'])
+            logging.info(f"delete surplus standby Pod {standby['podName']}")
+            await worker_pool.run(delete_pod, standby['podName'])
+            surplus -= 1
+    _surplusSince_dict.pop(serviceType, None)
+
+
+async def refill_warm_pool():
+    """Start standby Pods until every serviceType has warm_pool_target() of them."""
+    serviceSpec_dict = {serviceSpec['serviceType']: serviceSpec for serviceSpec in cluster_state.serviceSpec_list}
+    target_dict = {serviceType: warm_pool_target(serviceType) for serviceType in serviceSpec_dict}
+    for serviceType, target in target_dict.items():
+        await trim_warm_pool(serviceType, target)
+    missing_dict = {
+        serviceType: target - warm_pool.count(serviceType)
+        for serviceType, target in target_dict.items()
+    }
+    if all(missing <= 0 for missing in missing_dict.values()):
+        return
+    nodeDeployed_list = []
+    for serviceSpec in cluster_state.serviceSpec_list:
+        nodeDeployed_list.extend(serviceSpec["workAbility"].keys())
+    gpuMemory_dict = await read_gpu_memory(list(dict.fromkeys(nodeDeployed_list)))
+    view = cluster_view(cluster_state.service_list, serviceSpec_dict)
+    task_list = []
+    for serviceType, missing in missing_dict.items():
+        for _ in range(missing):
+            # 備用Pod只放在還有GPU記憶體、而且部署後不會讓其他服務低於 frequencyLimit[0] 的節點
+            candidate = next((
+                candidate for candidate in view.candidates(serviceType, gpuMemory_dict) if not candidate.standbyReady
+            ), None)
+            if candidate is None:
+                break
+            nodeName = candidate.nodeName
+            hostPort = port_allocator.allocate(serviceType, nodeName)
+            if hostPort is None:
+                break
+            standby = warm_pool.add_pending(serviceType, nodeName, hostPort)
+            view.add_standby(standby)
+            task_list.append(asyncio.create_task(start_standby(standby)))
+    if task_list:
+        await asyncio.gather(*task_list)
+
+
+async def adopt_standby_pods():
+    """
+    Take the ready service Pods that are not in service.json back into the
+    warm pool, e.g. after a restart, and delete the ones above the warmPool
+    of their serviceSpec or on a node that already runs their serviceType.
+    Call it after reserve_used_ports().
+    """
+    # 以Pod名稱比對，還沒 Ready 就加入的 service 沒有 podIP
+    podName_set = {
+        pod_name(service['serviceType'], service['nodeName'], int(service['hostPort'])) for service in cluster_state.service_list
+    }
+    # 同一個節點上已經有的 serviceType，那裡的備用Pod不能升級
+    deployed_set = {(service['serviceType'], service['nodeName']) for service in cluster_state.service_list}
+    orphanPodName_list = []
+    for pod in kube_cache.pods() or ():
+        serviceSpec = cluster_state.serviceSpec_dict.get(pod['serviceType'])
+        if serviceSpec is None or not pod['ready'] or pod['terminating'] or pod['name'] in podName_set:
+            continue
+        nodeName, hostPort = parse_pod_name(pod['name'], pod['serviceType'])
+        if (
+            warm_pool.count(pod['serviceType']) >= int(serviceSpec.get('warmPool', 0)) or
+            warm_pool.get(pod['serviceType'], nodeName) is not None or
+            (pod['serviceType'], nodeName) in deployed_set
+        ):
+            orphanPodName_list.append(pod['name'])
+            continue
+        warm_pool.add_pending(pod['serviceType'], nodeName, hostPort)
+        warm_pool.mark_ready(pod['name'], pod['podIP'], pod['hostIP'])
+        logging.info(f"adopt Pod {pod['name']} as standby")
+    # 沒有放回 warm_pool 的Pod不會再被使用，刪除後才會釋放GPU記憶體與 hostPort
+    for podName in orphanPodName_list:
+        logging.info(f"delete orphan Pod {podName}")
+    await asyncio.gather(*(worker_pool.run(delete_pod, podName) for podName in orphanPodName_list))
+
+
+def reserve_used_ports():
+    """Seed port_allocator with the ports of the services, the standby Pods and the Pods still being deleted."""
+    for service in cluster_state.service_list:
+        port_allocator.reserve(service['serviceType'], service['nodeName'], int(service['hostPort']))
+    for pod in kube_cache.pods() or ():
+        nodeName, hostPort = parse_pod_name(pod['name'], pod['serviceType'])
+        port_allocator.reserve(pod['serviceType'], nodeName, hostPort)
+        if pod['terminating']:
+            port_allocator.release_after_delete(pod['name'])
+
+
+async def forecast_demand():
+    """Sample the subscriptions every FORECAST_INTERVAL and wake the refiller when the forecast needs more standby Pods."""
+    while True:
+        await asyncio.sleep(FORECAST_INTERVAL)
+        demand_forecaster.sample({
+            serviceType: cluster_state.subscriptions.count(serviceType)
+            for serviceType in cluster_state.serviceSpec_dict
+        })
+        if any(
+            warm_pool_target(serviceType) > warm_pool.count(serviceType)
+            for serviceType in cluster_state.serviceSpec_dict
+        ):
+            warm_pool.wakeup()
+
+
+async def warm_pool_refiller():
+    while True:
+        try:
+            await refill_warm_pool()
+        except Exception:
+            logging.exception("Failed to refill the warm pool")
+        await warm_pool.wait(WARM_POOL_INTERVAL)
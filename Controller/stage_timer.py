@@ -0,0 +1,43 @@
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+class StageTimer:
+    """
+    Durations of the stages of an operation that runs in steps, e.g. the
+    recovery from a node failure: how often every stage ran and its last,
+    mean and longest duration.
+    """
+
+    def __init__(self):
+        self._stats: Dict[str, dict] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        stats = self._stats.setdefault(name, {
+            "count": 0,
+            "lastSeconds": 0.0,
+            "totalSeconds": 0.0,
+            "maxSeconds": 0.0,
+        })
+        stats["count"] += 1
+        stats["lastSeconds"] = seconds
+        stats["totalSeconds"] += seconds
+        stats["maxSeconds"] = max(stats["maxSeconds"], seconds)
+
+    def last(self) -> Dict[str, float]:
+        return {name: stats["lastSeconds"] for name, stats in self._stats.items()}
+
+    def metrics(self) -> dict:
+        return {
+            name: dict(stats, meanSeconds=stats["totalSeconds"] / stats["count"])
+            for name, stats in self._stats.items()
+        }
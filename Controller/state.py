@@ -0,0 +1,343 @@
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from .config import (
+    SERVICE_FILE,
+    SERVICESPEC_FILE,
+    SUBSCRIPTION_FILE,
+    NODE_STATUS_FILE,
+    STATE_JOURNAL_FILE,
+    STATE_SNAPSHOT_FILE,
+    STATE_COMPACT_RECORDS,
+    STATE_JOURNAL_FSYNC,
+)
+from .journal import StateJournal, apply_change, diff_collection
+from .subscription_registry import SubscriptionRegistry
+
+# names of the collections that are persisted by ClusterState
+SERVICES = 'services'
+SUBSCRIPTIONS = 'subscriptions'
+NODE_STATUS = 'node_status'
+
+
+def _load_json(path: str, default):
+    try:
+        with open(path, 'r') as jsonFile:
+            try:
+                return json.load(jsonFile)
+            except json.decoder.JSONDecodeError:
+                return default
+    except FileNotFoundError:
+        return default
+
+
+def _service_key(service: dict) -> str:
+    # the Pod name, unique among the instances
+    return f"{service['serviceType']}-{service['nodeName']}-{service['hostPort']}"
+
+
+class ClusterState:
+    """
+    In-process copy of the Controller's information files.
+
+    Handlers read and mutate the collections directly and wrap every change
+    in ``mutate()``. When it exits, the entries that changed in all the
+    collections it names are appended to the journal as one record, so a
+    change of several collections (e.g. /subscribe) is stored at once.
+    A ``mutate()`` inside another one joins it: only the outermost one
+    appends a record, with the collections of both.
+    The subscriptions report the ids they changed, the services and the
+    node status are small and compared entry by entry.
+    A background thread compacts the journal into a snapshot after
+    compact_records records; load() reads the snapshot and replays the
+    journal. The information files are exported with every snapshot.
+
+    The record is appended on the thread that calls mutate(), which is the
+    event loop for the handlers. That is not routed through the worker pool:
+    it is one buffered write and flush (about 20 microseconds) that has to be
+    in the file in seq order before the next mutate(). With fsync the disk
+    sync is left to the background thread, see StateJournal.
+    """
+
+    def __init__(self, service_file: str, serviceSpec_file: str, subscription_file: str,
+                 node_status_file: str, journal_file: str = STATE_JOURNAL_FILE,
+                 snapshot_file: str = STATE_SNAPSHOT_FILE, compact_records: int = STATE_COMPACT_RECORDS,
+                 fsync: bool = STATE_JOURNAL_FSYNC):
+        self.service_list = []
+        self.subscriptions = SubscriptionRegistry()
+        self.serviceSpec_list = []
+        self.serviceSpec_dict = {}
+        self.node_health_status = {}
+
+        self._paths = {
+            SERVICES: service_file,
+            SUBSCRIPTIONS: subscription_file,
+            NODE_STATUS: node_status_file,
+        }
+        self._serviceSpec_file = serviceSpec_file
+        self._snapshot_file = snapshot_file
+        self._compact_records = compact_records
+        self._journal = StateJournal(journal_file, fsync)
+        self._fsync = fsync
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        # collection -> key -> entry as of the last journal record
+        self._journaled = {SERVICES: {}, SUBSCRIPTIONS: {}, NODE_STATUS: {}}
+        self._seq = 0
+        # nesting depth of mutate() and the collections named so far, guarded by _lock
+        self._mutateDepth = 0
+        self._mutated_list = []
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._persister = None
+        self._stats = {
+            "records": 0,
+            "snapshots": 0,
+            "replayed": 0,
+        }
+
+    def load(self):
+        with self._lock:
+            replayed = self._load()
+        if replayed:
+            # 從新的 snapshot 開始，之後的 journal 只有這次啟動的變更
+            self.compact()
+
+    def _load(self) -> bool:
+        self.serviceSpec_list = _load_json(self._serviceSpec_file, [])
+        self.serviceSpec_dict = {
+            serviceSpec['serviceType']: serviceSpec for serviceSpec in self.serviceSpec_list
+        }
+        snapshot = _load_json(self._snapshot_file, None)
+        if snapshot is None:
+            # 第一次啟動，從 information 檔案開始
+            self._seq = 0
+            self.service_list = _load_json(self._paths[SERVICES], [])
+            self.subscriptions = SubscriptionRegistry(_load_json(self._paths[SUBSCRIPTIONS], []))
+            self.node_health_status = _load_json(self._paths[NODE_STATUS], {})
+        else:
+            self._seq = snapshot['seq']
+            self.service_list = snapshot[SERVICES]
+            self.subscriptions = SubscriptionRegistry()
+            for subscriptionId, subscription in snapshot[SUBSCRIPTIONS]:
+                self.subscriptions.add(subscription, subscriptionId)
+            self.node_health_status = snapshot[NODE_STATUS]
+        self._journaled = {name: self._copy(self._entries(name)) for name in self._journaled}
+        record_list = self._journal.replay()
+        for record in record_list:
+            if record['seq'] > self._seq:
+                self._apply(record)
+                self._stats["replayed"] += 1
+        self._journal.records = len(record_list)
+        # 載入與重播的訂閱已經在 _journaled 中
+        self.subscriptions.pop_changed()
+        return bool(record_list)
+
+    def _entries(self, name: str) -> dict:
+        """Current entries of a collection by key, the entries themselves are not copied."""
+        if name == SERVICES:
+            return {_service_key(service): service for service in self.service_list}
+        if name == SUBSCRIPTIONS:
+            return {str(subscriptionId): subscription for subscriptionId, subscription in self.subscriptions.items()}
+        return dict(self.node_health_status)
+
+    @staticmethod
+    def _copy_entry(entry):
+        return dict(entry) if isinstance(entry, dict) else entry
+
+    def _copy(self, entries: dict) -> dict:
+        return {key: self._copy_entry(entry) for key, entry in entries.items()}
+
+    def _apply(self, record: dict):
+        self._seq = record['seq']
+        for name, change in record['changes'].items():
+            self._journaled[name] = apply_change(self._journaled[name], change)
+            if name == SERVICES:
+                self.service_list = [dict(service) for service in self._journaled[name].values()]
+            elif name == NODE_STATUS:
+                self.node_health_status = dict(self._journaled[name])
+            else:
+                self._apply_subscriptions(change)
+
+    def _apply_subscriptions(self, change: dict):
+        for subscriptionId in change.get('del', ()):
+            if int(subscriptionId) in self.subscriptions:
+                self.subscriptions.remove(int(subscriptionId))
+        # ids grow monotonically, adding them in order keeps the list order of the indexes
+        for subscriptionId, subscription in sorted(change.get('put', {}).items(), key=lambda item: int(item[0])):
+            subscriptionId = int(subscriptionId)
+            if subscriptionId not in self.subscriptions:
+                self.subscriptions.add(dict(subscription), subscriptionId)
+                continue
+            current = self.subscriptions[subscriptionId]
+            if {k: v for k, v in current.items() if k not in ('podIP', 'nodeName')} == \
+                    {k: v for k, v in subscription.items() if k not in ('podIP', 'nodeName')}:
+                self.subscriptions.move(subscriptionId, subscription['podIP'], subscription['nodeName'])
+            else:
+                self.subscriptions.remove(subscriptionId)
+                self.subscriptions.add(dict(subscription), subscriptionId)
+
+    @property
+    def seq(self) -> int:
+        """Number of the last journal record, it changes with every mutate() that changed something."""
+        return self._seq
+
+    def copy_service_list(self) -> list:
+        # the optimizers add and delete fields on the instances they get,
+        # frequencyLimit is never modified so a shallow copy per instance is enough
+        with self._lock:
+            return [dict(service) for service in self.service_list]
+
+    @contextmanager
+    def mutate(self, *names: str):
+        """Hold the state lock while changing the given collections and append the changes to the journal."""
+        with self._lock:
+            self._mutateDepth += 1
+            self._mutated_list.extend(name for name in names if name not in self._mutated_list)
+            try:
+                yield self
+            finally:
+                self._mutateDepth -= 1
+                if self._mutateDepth == 0:
+                    mutated_list, self._mutated_list = self._mutated_list, []
+                    self._record(mutated_list)
+        if self._journal.records >= self._compact_records:
+            self._wakeup.set()
+
+    def _subscription_change(self):
+        """Change of the subscriptions the registry reports as changed since the last record."""
+        journaled = self._journaled[SUBSCRIPTIONS]
+        put = {}
+        deleted = []
+        for subscriptionId in self.subscriptions.pop_changed():
+            key = str(subscriptionId)
+            if subscriptionId in self.subscriptions:
+                subscription = self.subscriptions[subscriptionId]
+                if journaled.get(key) != subscription:
+                    put[key] = subscription
+                    journaled[key] = dict(subscription)
+            elif key in journaled:
+                deleted.append(key)
+                del journaled[key]
+        change = {}
+        if put:
+            change['put'] = put
+        if deleted:
+            change['del'] = deleted
+        return change or None
+
+    def _record(self, names):
+        changes = {}
+        for name in names:
+            if name == SUBSCRIPTIONS:
+                change = self._subscription_change()
+                if change is not None:
+                    changes[name] = change
+                continue
+            previous = self._journaled[name]
+            entries = self._entries(name)
+            change = diff_collection(previous, entries)
+            if change is not None:
+                changes[name] = change
+                # only the entries that changed are copied, the handlers keep changing the others in place
+                put = change.get('put', {})
+                self._journaled[name] = {
+                    key: self._copy_entry(entry) if key in put else previous[key] for key, entry in entries.items()
+                }
+        if not changes:
+            return
+        self._seq += 1
+        try:
+            self._journal.append({"seq": self._seq, "changes": changes})
+            self._stats["records"] += 1
+        except OSError as e:
+            logging.error(f"Failed to append to the state journal: {e}")
+        if self._fsync:
+            self._wakeup.set()
+
+    def start(self):
+        if self._persister is not None:
+            return
+        self._stopped.clear()
+        self._persister = threading.Thread(target=self._run, name='cluster-state-persister', daemon=True)
+        self._persister.start()
+
+    def stop(self):
+        if self._persister is None:
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        self._persister.join()
+        self._persister = None
+        self.compact()
+        self._journal.close()
+
+    def compact(self):
+        """Write a snapshot of all collections, export the information files and drop the journal before it."""
+        with self._compact_lock:
+            with self._lock:
+                snapshot = json.dumps({
+                    "seq": self._seq,
+                    SERVICES: self.service_list,
+                    SUBSCRIPTIONS: self.subscriptions.items(),
+                    NODE_STATUS: self.node_health_status,
+                }, separators=(',', ':'))
+                export = {name: json.dumps(self._collection(name), indent=4) for name in self._paths}
+                try:
+                    previous_journal = self._journal.rotate()
+                except OSError as e:
+                    logging.error(f"Failed to rotate the state journal: {e}")
+                    return
+            if not self._write(self._snapshot_file, snapshot):
+                # the records stay in <journal>.prev and are replayed with the older snapshot
+                return
+            self._stats["snapshots"] += 1
+            if previous_journal is not None:
+                os.remove(previous_journal)
+            for name, content in export.items():
+                self._write(self._paths[name], content)
+
+    def metrics(self) -> dict:
+        metrics = dict(self._stats)
+        metrics["seq"] = self._seq
+        metrics["journalRecords"] = self._journal.records
+        return metrics
+
+    def _collection(self, name: str):
+        if name == SERVICES:
+            return self.service_list
+        if name == SUBSCRIPTIONS:
+            return self.subscriptions.to_list()
+        return self.node_health_status
+
+    def _write(self, path: str, content: str) -> bool:
+        # write to a temporary file first so readers never see a half written file
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w') as jsonFile:
+                jsonFile.write(content)
+                jsonFile.flush()
+                os.fsync(jsonFile.fileno())
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            logging.error(f"Failed to persist {path}: {e}")
+            return False
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # 同一次喚醒前寫入的 record 一起 fsync，event loop 不等待磁碟
+            try:
+                self._journal.sync()
+            except OSError as e:
+                logging.error(f"Failed to sync the state journal: {e}")
+            if self._journal.records >= self._compact_records:
+                self.compact()
+
+
+cluster_state = ClusterState(SERVICE_FILE, SERVICESPEC_FILE, SUBSCRIPTION_FILE, NODE_STATUS_FILE)
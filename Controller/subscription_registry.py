@@ -0,0 +1,127 @@
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+class SubscriptionRegistry:
+    """
+    Subscription list with secondary indexes by podIP, serviceType, nodeName
+    and agent endpoint (agentIP, agentPort).
+
+    Every subscription gets an id when it is added. Ids grow monotonically, so
+    sorting ids gives back the order of the original subscription.json list,
+    which adjust_frequency() and the failure handling depend on.
+
+    The ids that are added, removed or moved are remembered until
+    pop_changed(), so ClusterState journals only those instead of comparing
+    every subscription.
+    """
+
+    def __init__(self, subscription_list: Iterable[dict] = ()):
+        self._next_id = 0
+        self._subscriptions = {}
+        self._by_podIP = {}
+        self._by_serviceType = {}
+        self._by_nodeName = {}
+        self._by_agent = {}
+        self._changed = set()
+        for subscription in subscription_list:
+            self.add(subscription)
+
+    @staticmethod
+    def _agent_key(agentIP, agentPort) -> tuple:
+        return (str(agentIP), int(agentPort))
+
+    @staticmethod
+    def _index_add(index: dict, key, subscriptionId: int):
+        index.setdefault(key, {})[subscriptionId] = None
+
+    @staticmethod
+    def _index_remove(index: dict, key, subscriptionId: int):
+        ids = index.get(key)
+        if ids is None:
+            return
+        ids.pop(subscriptionId, None)
+        if not ids:
+            del index[key]
+
+    def add(self, subscription: dict, subscriptionId: Optional[int] = None) -> int:
+        """Add subscription under a new id, or under subscriptionId when it is restored from the journal."""
+        if subscriptionId is None:
+            subscriptionId = self._next_id
+        self._next_id = max(self._next_id, subscriptionId + 1)
+        self._subscriptions[subscriptionId] = subscription
+        self._index_add(self._by_podIP, subscription['podIP'], subscriptionId)
+        self._index_add(self._by_serviceType, subscription['serviceType'], subscriptionId)
+        self._index_add(self._by_nodeName, subscription['nodeName'], subscriptionId)
+        self._index_add(
+            self._by_agent,
+            self._agent_key(subscription['agentIP'], subscription['agentPort']),
+            subscriptionId,
+        )
+        self._changed.add(subscriptionId)
+        return subscriptionId
+
+    def remove(self, subscriptionId: int) -> dict:
+        subscription = self._subscriptions.pop(subscriptionId)
+        self._index_remove(self._by_podIP, subscription['podIP'], subscriptionId)
+        self._index_remove(self._by_serviceType, subscription['serviceType'], subscriptionId)
+        self._index_remove(self._by_nodeName, subscription['nodeName'], subscriptionId)
+        self._index_remove(
+            self._by_agent,
+            self._agent_key(subscription['agentIP'], subscription['agentPort']),
+            subscriptionId,
+        )
+        self._changed.add(subscriptionId)
+        return subscription
+
+    def move(self, subscriptionId: int, podIP: str, nodeName: str):
+        """Re-pair a subscription with another service instance."""
+        subscription = self._subscriptions[subscriptionId]
+        self._index_remove(self._by_podIP, subscription['podIP'], subscriptionId)
+        self._index_remove(self._by_nodeName, subscription['nodeName'], subscriptionId)
+        subscription['podIP'] = podIP
+        subscription['nodeName'] = nodeName
+        self._index_add(self._by_podIP, podIP, subscriptionId)
+        self._index_add(self._by_nodeName, nodeName, subscriptionId)
+        self._changed.add(subscriptionId)
+
+    def pop_changed(self) -> List[int]:
+        """Ids added, removed or moved since the last call, in id order."""
+        changed = sorted(self._changed)
+        self._changed = set()
+        return changed
+
+    def __getitem__(self, subscriptionId: int) -> dict:
+        return self._subscriptions[subscriptionId]
+
+    def __contains__(self, subscriptionId: int) -> bool:
+        return subscriptionId in self._subscriptions
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self._subscriptions.values())
+
+    def count(self, serviceType: str) -> int:
+        return len(self._by_serviceType.get(serviceType, ()))
+
+    # a subscription is only ever added to the serviceType and agent indexes
+    # when it is created, so their insertion order is already the list order
+    def ids_of_service_type(self, serviceType: str) -> List[int]:
+        return list(self._by_serviceType.get(serviceType, ()))
+
+    def ids_of_agent(self, agentIP, agentPort) -> List[int]:
+        return list(self._by_agent.get(self._agent_key(agentIP, agentPort), ()))
+
+    # move() appends to the podIP and nodeName indexes, sort to get the list order back
+    def ids_on_pod(self, podIP: str) -> List[int]:
+        return sorted(self._by_podIP.get(podIP, ()))
+
+    def ids_on_node(self, nodeName: str) -> List[int]:
+        return sorted(self._by_nodeName.get(nodeName, ()))
+
+    def items(self) -> List[Tuple[int, dict]]:
+        return list(self._subscriptions.items())
+
+    def to_list(self) -> List[dict]:
+        return list(self._subscriptions.values())
@@ -0,0 +1,34 @@
+import importlib
+import os
+import sys
+import types
+
+import pytest
+
+CONTROLLER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the Controller modules are run from the Controller directory (uvicorn controller:app)
+sys.path.insert(0, CONTROLLER_DIR)
+
+PACKAGE = "edge_controller"
+
+
+@pytest.fixture
+def controller_module():
+    """
+    Import a Controller module that imports the others relatively
+    (service_manager, agent_notifier, ...) as a module of the Controller
+    package. Skips the test when a package of requirements.txt is missing.
+    """
+    def load(name: str):
+        if PACKAGE not in sys.modules:
+            package = types.ModuleType(PACKAGE)
+            package.__path__ = [CONTROLLER_DIR]
+            sys.modules[PACKAGE] = package
+        try:
+            return importlib.import_module(f"{PACKAGE}.{name}")
+        except ModuleNotFoundError as e:
+            if e.name.split('.')[0] == PACKAGE or os.path.exists(os.path.join(CONTROLLER_DIR, f"{e.name}.py")):
+                raise
+            pytest.skip(f"{e.name} is not installed")
+
+    return load
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import logging
+
+import pytest
+
+from access_log import AccessLogMiddleware
+
+
+def make_app(body_chunk_list, status=200):
+    async def app(scope, receive, send):
+        while True:
+            message = await receive()
+            if not message.get("more_body"):
+                break
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        for index, chunk in enumerate(body_chunk_list):
+            await send({"type": "http.response.body", "body": chunk, "more_body": index < len(body_chunk_list) - 1})
+    return app
+
+
+def call(middleware, request_chunk_list=(b"",)):
+    scope = {"type": "http", "path": "/subscribe", "method": "POST", "client": ("10.0.0.7", 5000)}
+    incoming = [
+        {"type": "http.request", "body": chunk, "more_body": index < len(request_chunk_list) - 1}
+        for index, chunk in enumerate(request_chunk_list)
+    ]
+    sent = []
+
+    async def receive():
+        return incoming.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent
+
+
+def access_entries(caplog):
+    return [json.loads(record.getMessage()) for record in caplog.records if record.name == "controller.access"]
+
+
+def test_response_is_streamed_unchanged_and_logged(caplog):
+    caplog.set_level(logging.INFO)
+    middleware = AccessLogMiddleware(make_app([b"plain ", b"text"]))
+    sent = call(middleware, [b'{"ip": ', b'"10.0.0.7"}'])
+    assert [message.get("body") for message in sent[1:]] == [b"plain ", b"text"]
+    entry, = access_entries(caplog)
+    assert entry["api"] == "/subscribe"
+    assert entry["clientIp"] == "10.0.0.7"
+    assert entry["statusCode"] == 200
+    assert entry["request"] == '{"ip": "10.0.0.7"}'
+    assert entry["response"] == "plain text"
+    assert entry["responseTruncated"] is False
+
+
+def test_bodies_are_cut_at_the_limit(caplog):
+    caplog.set_level(logging.INFO)
+    middleware = AccessLogMiddleware(make_app([b"abcdef", b"ghij"]), body_limit=8)
+    sent = call(middleware, [b"0123456789"])
+    assert b"".join(message.get("body", b"") for message in sent[1:]) == b"abcdefghij"
+    entry, = access_entries(caplog)
+    assert entry["request"] == "01234567"
+    assert entry["requestTruncated"] is True
+    assert entry["response"] == "abcdefgh"
+    assert entry["responseTruncated"] is True
+
+
+def test_only_sampled_successes_are_logged(caplog):
+    caplog.set_level(logging.INFO)
+    call(AccessLogMiddleware(make_app([b"ok"]), sample_rate=0.1, sampler=lambda: 0.5))
+    assert access_entries(caplog) == []
+    call(AccessLogMiddleware(make_app([b"ok"]), sample_rate=0.1, sampler=lambda: 0.05))
+    assert len(access_entries(caplog)) == 1
+
+
+def test_errors_are_always_logged(caplog):
+    caplog.set_level(logging.INFO)
+    call(AccessLogMiddleware(make_app([b"no"], status=404), sample_rate=0.0))
+    assert access_entries(caplog)[0]["statusCode"] == 404
+
+
+def test_exception_becomes_a_json_500(caplog):
+    caplog.set_level(logging.INFO)
+
+    async def app(scope, receive, send):
+        raise RuntimeError("boom")
+
+    sent = call(AccessLogMiddleware(app, sample_rate=0.0))
+    assert sent[0]["status"] == 500
+    assert json.loads(sent[1]["body"]) == {"error": "boom"}
+    assert access_entries(caplog)[0]["statusCode"] == 500
+
+
+def test_exception_after_the_response_started_is_raised():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        call(AccessLogMiddleware(app))
@@ -0,0 +1,82 @@
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+requests = pytest.importorskip("requests")
+pytest.importorskip("fastapi")
+pytest.importorskip("uvicorn")
+
+RELAY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "AgentManager", "agent_host_relay.py")
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+@pytest.fixture
+def relay(monkeypatch, tmp_path):
+    # the relay reads its port from argv and logs to ./logs
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["agent_host_relay.py"])
+    spec = importlib.util.spec_from_file_location("agent_host_relay", RELAY_FILE)
+    relay = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(relay)
+    relay.post_list = []
+    relay.status_dict = {}
+
+    def post(url, data, timeout):
+        relay.post_list.append((url, json.loads(data)))
+        status = relay.status_dict.get(url, 200)
+        if status is None:
+            raise requests.exceptions.ConnectionError("connection refused")
+        return Response(status)
+
+    monkeypatch.setattr(relay.requests, "post", post)
+    return relay
+
+
+def post_batch(relay, change_list):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=relay.app), base_url="http://relay") as client:
+            return await client.post("/servicechange/batch", json={"changes": change_list})
+
+    return asyncio.run(run())
+
+
+def test_batch_is_forwarded_to_every_local_agent(relay):
+    relay.status_dict["http://127.0.0.1:8003/servicechange"] = 500
+    response = post_batch(relay, [
+        {"agentPort": 8001, "servicename": "pose", "ip": "10.52.52.126", "port": 30501, "frequency": 15},
+        {"agentPort": 8002, "servicename": "gesture", "ip": "null", "port": 0, "frequency": 10},
+        {"agentPort": 8003, "servicename": "pose", "ip": "null", "port": 0, "frequency": 5},
+    ])
+
+    assert response.status_code == 200
+    assert response.json() == {"results": [
+        {"agentPort": 8001, "statusCode": 200, "error": None},
+        {"agentPort": 8002, "statusCode": 200, "error": None},
+        {"agentPort": 8003, "statusCode": 500, "error": None},
+    ]}
+    assert sorted(relay.post_list) == [
+        ("http://127.0.0.1:8001/servicechange", {"servicename": "pose", "ip": "10.52.52.126", "port": 30501, "frequency": 15}),
+        ("http://127.0.0.1:8002/servicechange", {"servicename": "gesture", "ip": "null", "port": 0, "frequency": 10}),
+        ("http://127.0.0.1:8003/servicechange", {"servicename": "pose", "ip": "null", "port": 0, "frequency": 5}),
+    ]
+
+
+def test_unreachable_agent_is_reported(relay):
+    relay.status_dict["http://127.0.0.1:8002/servicechange"] = None
+    response = post_batch(relay, [
+        {"agentPort": 8001, "servicename": "pose", "ip": "null", "port": 0, "frequency": 15},
+        {"agentPort": 8002, "servicename": "pose", "ip": "null", "port": 0, "frequency": 15},
+    ])
+    results = response.json()["results"]
+    assert results[0] == {"agentPort": 8001, "statusCode": 200, "error": None}
+    assert results[1]["agentPort"] == 8002 and results[1]["statusCode"] is None
+    assert "connection refused" in results[1]["error"]
@@ -0,0 +1,152 @@
+import asyncio
+import json
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+BATCH_PORT = 8890
+
+
+def notification(agentIP, agentPort, frequency, ip="10.52.52.126", port=30501, servicename="pose"):
+    body = {"servicename": servicename, "ip": ip, "port": port, "frequency": frequency}
+    return body, agentIP, agentPort, (ip, port, frequency)
+
+
+class Agents:
+    """Answers the notifier's requests: relay_hosts run a relay, the status codes of failing agents can be set."""
+
+    def __init__(self, relay_hosts=()):
+        self.relay_hosts = set(relay_hosts)
+        self.status_dict = {}
+        self.request_list = []
+
+    def __call__(self, request):
+        body = json.loads(request.content)
+        self.request_list.append((request.url.host, request.url.port, request.url.path, body))
+        if request.url.path == "/servicechange/batch":
+            if request.url.host not in self.relay_hosts:
+                return httpx.Response(404)
+            return httpx.Response(200, json={"results": [
+                {"agentPort": change["agentPort"], "statusCode": self.status_dict.get((request.url.host, change["agentPort"]), 200), "error": None}
+                for change in body["changes"]
+            ]})
+        return httpx.Response(self.status_dict.get((request.url.host, request.url.port), 200))
+
+
+@pytest.fixture
+def make_notifier(controller_module):
+    agent_notifier = controller_module("agent_notifier")
+
+    def make(agents, batch_port=BATCH_PORT):
+        return agent_notifier.AgentNotifier(
+            retries=1, backoff=0, batch_port=batch_port, transport=httpx.MockTransport(agents),
+        )
+
+    return make
+
+
+def notify(notifier, notification_list):
+    async def run():
+        try:
+            return await notifier.notify(notification_list)
+        finally:
+            await notifier.close()
+
+    return asyncio.run(run())
+
+
+def test_unchanged_configuration_is_suppressed(make_notifier):
+    agents = Agents()
+    notifier = make_notifier(agents)
+    notifier.remember("192.168.1.10", 8001, "pose", ("10.52.52.126", 30501, 10))
+    report = notify(notifier, [notification("192.168.1.10", 8001, 10)])
+    assert report["suppressed"] == 1 and report["acked"] == [] and report["failed"] == []
+    assert agents.request_list == []
+    assert notifier.metrics()["suppressed"] == 1
+
+
+def test_changed_configuration_is_sent_and_remembered(make_notifier):
+    agents = Agents()
+    notifier = make_notifier(agents)
+    notifier.remember("192.168.1.10", 8001, "pose", ("10.52.52.126", 30501, 10))
+    report = notify(notifier, [notification("192.168.1.10", 8001, 6)])
+    assert [(result["agentIP"], result["agentPort"]) for result in report["acked"]] == [("192.168.1.10", 8001)]
+    assert agents.request_list == [
+        ("192.168.1.10", 8001, "/servicechange", {"servicename": "pose", "ip": "10.52.52.126", "port": 30501, "frequency": 6}),
+    ]
+    # the acked frequency is now the one the agent has
+    report = notify(notifier, [notification("192.168.1.10", 8001, 6)])
+    assert report["suppressed"] == 1 and len(agents.request_list) == 1
+
+
+def test_new_endpoint_is_not_suppressed(make_notifier):
+    agents = Agents()
+    notifier = make_notifier(agents)
+    notifier.remember("192.168.1.10", 8001, "pose", ("10.52.52.126", 30501, 10))
+    report = notify(notifier, [notification("192.168.1.10", 8001, 10, ip="10.52.52.127", port=30502)])
+    assert len(report["acked"]) == 1 and report["suppressed"] == 0
+
+
+def test_failed_notification_is_retried_and_not_remembered(make_notifier):
+    agents = Agents()
+    agents.status_dict[("192.168.1.10", 8001)] = 503
+    notifier = make_notifier(agents)
+    report = notify(notifier, [notification("192.168.1.10", 8001, 6)])
+    assert report["failed"][0]["statusCode"] == 503 and report["failed"][0]["attempts"] == 2
+    assert notifier.metrics()["retried"] == 1
+
+    agents.status_dict.clear()
+    report = notify(notifier, [notification("192.168.1.10", 8001, 6)])
+    assert len(report["acked"]) == 1 and report["suppressed"] == 0
+
+
+def test_agents_of_a_host_are_batched(make_notifier):
+    agents = Agents(relay_hosts=["192.168.1.10"])
+    agents.status_dict[("192.168.1.10", 8003)] = 500
+    notifier = make_notifier(agents)
+    report = notify(notifier, [
+        notification("192.168.1.10", 8001, 6),
+        notification("192.168.1.11", 8001, 7),
+        notification("192.168.1.10", 8002, 8, servicename="gesture"),
+        notification("192.168.1.10", 8003, 9),
+    ])
+
+    batch_list = [request for request in agents.request_list if request[2] == "/servicechange/batch"]
+    assert batch_list == [("192.168.1.10", BATCH_PORT, "/servicechange/batch", {"changes": [
+        {"servicename": "pose", "ip": "10.52.52.126", "port": 30501, "frequency": 6, "agentPort": 8001},
+        {"servicename": "gesture", "ip": "10.52.52.126", "port": 30501, "frequency": 8, "agentPort": 8002},
+        {"servicename": "pose", "ip": "10.52.52.126", "port": 30501, "frequency": 9, "agentPort": 8003},
+    ]})]
+    # a single agent on a host gets its own request
+    assert ("192.168.1.11", 8001, "/servicechange", {"servicename": "pose", "ip": "10.52.52.126", "port": 30501, "frequency": 7}) \
+        in agents.request_list
+    assert len(agents.request_list) == 2
+    assert sorted((result["agentIP"], result["agentPort"]) for result in report["acked"]) == [
+        ("192.168.1.10", 8001), ("192.168.1.10", 8002), ("192.168.1.11", 8001),
+    ]
+    assert [(result["agentIP"], result["agentPort"], result["statusCode"]) for result in report["failed"]] == [
+        ("192.168.1.10", 8003, 500),
+    ]
+    assert notifier.metrics()["batches"] == 1
+
+
+def test_host_without_relay_falls_back_to_one_request_per_agent(make_notifier):
+    agents = Agents()
+    notifier = make_notifier(agents)
+    report = notify(notifier, [notification("192.168.1.10", 8001, 6), notification("192.168.1.10", 8002, 6)])
+    assert len(report["acked"]) == 2
+    assert [request[2] for request in agents.request_list] == ["/servicechange/batch", "/servicechange", "/servicechange"]
+    assert notifier.metrics()["batchFallbacks"] == 1
+
+    # the host is not asked for a batch again
+    agents.request_list.clear()
+    notify(notifier, [notification("192.168.1.10", 8001, 5), notification("192.168.1.10", 8002, 5)])
+    assert [request[2] for request in agents.request_list] == ["/servicechange", "/servicechange"]
+
+
+def test_batching_can_be_disabled(make_notifier):
+    agents = Agents(relay_hosts=["192.168.1.10"])
+    notifier = make_notifier(agents, batch_port=None)
+    notify(notifier, [notification("192.168.1.10", 8001, 6), notification("192.168.1.10", 8002, 6)])
+    assert sorted(request[1] for request in agents.request_list) == [8001, 8002]
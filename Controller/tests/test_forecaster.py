@@ -0,0 +1,45 @@
+import pytest
+
+from forecaster import DemandForecaster, holt
+
+
+def test_holt_follows_a_linear_ramp():
+    level, trend = holt([2 * i for i in range(40)], alpha=0.5, beta=0.3)
+    assert level == pytest.approx(78, abs=0.5)
+    assert trend == pytest.approx(2, abs=0.1)
+
+
+def test_holt_of_a_constant_series_has_no_trend():
+    assert holt([5] * 10, alpha=0.5, beta=0.3) == (5.0, 0.0)
+
+
+def test_forecast_projects_the_trend_ahead():
+    forecaster = DemandForecaster(window=30, alpha=0.5, beta=0.3, horizon=6)
+    for i in range(30):
+        forecaster.sample({"pose": 3 * i, "gesture": 4})
+    assert forecaster.forecast("pose") == pytest.approx(87 + 6 * 3, abs=2)
+    assert forecaster.forecast("gesture") == 4
+    assert forecaster.forecast("object") == 0
+
+
+def test_forecast_never_drops_below_the_current_count():
+    forecaster = DemandForecaster(window=30, alpha=0.5, beta=0.3, horizon=6)
+    for count in (40, 30, 20, 10, 10):
+        forecaster.sample({"pose": count})
+    assert forecaster.forecast("pose") == 10
+
+
+def test_window_forgets_old_samples():
+    forecaster = DemandForecaster(window=5, alpha=0.5, beta=0.3, horizon=6)
+    for count in [100] * 20 + [7] * 5:
+        forecaster.sample({"pose": count})
+    assert forecaster.forecast("pose") == 7
+
+
+def test_arrival_rate_is_smoothed_per_sample():
+    forecaster = DemandForecaster(window=5, alpha=0.5, beta=0.3, horizon=6)
+    for _ in range(4):
+        forecaster.record_arrival("pose")
+    forecaster.sample({"pose": 4})
+    forecaster.sample({"pose": 4})
+    assert forecaster.metrics()["pose"]["arrivalRate"] == 2
@@ -0,0 +1,78 @@
+import threading
+
+import journal
+from journal import StateJournal, apply_change, diff_collection
+
+
+def test_diff_has_only_the_changed_entries():
+    previous = {"a": {"x": 1}, "b": {"x": 2}, "c": {"x": 3}}
+    current = {"a": {"x": 1}, "b": {"x": 5}, "d": {"x": 4}}
+    assert diff_collection(previous, current) == {"put": {"b": {"x": 5}, "d": {"x": 4}}, "del": ["c"]}
+
+
+def test_diff_of_an_unchanged_collection_is_none():
+    assert diff_collection({"a": 1, "b": 2}, {"a": 1, "b": 2}) is None
+
+
+def test_diff_records_a_new_order():
+    change = diff_collection({"a": 1, "b": 2}, {"b": 2, "a": 1})
+    assert change == {"order": ["b", "a"]}
+    assert list(apply_change({"a": 1, "b": 2}, change)) == ["b", "a"]
+
+
+def test_apply_gives_back_the_current_collection():
+    previous = {"a": 1, "b": 2, "c": 3}
+    current = {"c": 3, "a": 7, "e": 5}
+    assert list(apply_change(dict(previous), diff_collection(previous, current)).items()) == list(current.items())
+
+
+def test_journal_replays_its_records(tmp_path):
+    journal = StateJournal(str(tmp_path / "state.journal"))
+    journal.append({"seq": 1, "changes": {}})
+    journal.append({"seq": 2, "changes": {}})
+    journal.close()
+    assert [record["seq"] for record in StateJournal(str(tmp_path / "state.journal")).replay()] == [1, 2]
+    assert journal.records == 2
+
+
+def test_incomplete_last_record_is_skipped(tmp_path):
+    path = tmp_path / "state.journal"
+    journal = StateJournal(str(path))
+    journal.append({"seq": 1, "changes": {}})
+    journal.close()
+    with open(path, "a") as journalFile:
+        journalFile.write('{"seq": 2, "chan')
+    assert [record["seq"] for record in journal.replay()] == [1]
+
+
+def test_rotate_keeps_the_records_until_the_previous_journal_is_removed(tmp_path):
+    path = tmp_path / "state.journal"
+    journal = StateJournal(str(path))
+    journal.append({"seq": 1, "changes": {}})
+    previous_path = journal.rotate()
+    journal.append({"seq": 2, "changes": {}})
+    assert journal.records == 1
+    assert [record["seq"] for record in journal.replay()] == [1, 2]
+    # a second rotation before the first snapshot is written appends to the previous journal
+    assert journal.rotate() == previous_path
+    assert [record["seq"] for record in journal.replay()] == [1, 2]
+    assert not path.exists()
+
+
+def test_fsync_is_left_to_sync(tmp_path, monkeypatch):
+    fsync_list = []
+    monkeypatch.setattr(journal.os, "fsync", lambda fd: fsync_list.append(threading.current_thread()))
+    stateJournal = StateJournal(str(tmp_path / "state.journal"), fsync=True)
+    stateJournal.append({"seq": 1, "changes": {}})
+    stateJournal.append({"seq": 2, "changes": {}})
+    assert fsync_list == []
+
+    # the persister thread syncs both records at once
+    thread = threading.Thread(target=stateJournal.sync)
+    thread.start()
+    thread.join()
+    assert fsync_list == [thread]
+    stateJournal.sync()
+    assert len(fsync_list) == 1
+    stateJournal.close()
+    assert len(stateJournal.replay()) == 2
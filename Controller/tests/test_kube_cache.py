@@ -0,0 +1,224 @@
+import asyncio
+import queue
+import time
+from types import SimpleNamespace
+
+import pytest
+
+
+def pod_object(name, ready=False, resource_version="1", serviceType="pose"):
+    return SimpleNamespace(
+        metadata=SimpleNamespace(
+            name=name, labels={"app": serviceType}, deletion_timestamp=None, resource_version=resource_version,
+        ),
+        status=SimpleNamespace(
+            phase="Running" if ready else "Pending",
+            conditions=[SimpleNamespace(type="Ready", status="True" if ready else "False")],
+            pod_ip="10.0.0.1" if ready else None,
+            host_ip="192.168.0.1",
+        ),
+        spec=SimpleNamespace(node_name="gpu1"),
+    )
+
+
+class Cluster:
+    """
+    Fake Kubernetes API for KubeCache: list calls return pod_dict, every
+    watch stream takes its events from a queue. Pushing an exception ends
+    the stream with it, e.g. ApiException(410) for an expired resourceVersion.
+    """
+
+    def __init__(self, ApiException):
+        self.ApiException = ApiException
+        self.pod_dict = {}
+        self.event_queue = queue.Queue()
+        self.pod_lists = 0
+
+    def core_api(self):
+        return self
+
+    def list_node(self, **kwargs):
+        return SimpleNamespace(items=[], metadata=SimpleNamespace(resource_version="1"))
+
+    def list_namespaced_pod(self, **kwargs):
+        self.pod_lists += 1
+        return SimpleNamespace(items=list(self.pod_dict.values()), metadata=SimpleNamespace(resource_version="1"))
+
+    def read_namespaced_pod(self, name, namespace):
+        if name not in self.pod_dict:
+            raise self.ApiException(status=404, reason="Not Found")
+        return self.pod_dict[name]
+
+    def push(self, eventType, pod):
+        if eventType == "DELETED":
+            self.pod_dict.pop(pod.metadata.name, None)
+        else:
+            self.pod_dict[pod.metadata.name] = pod
+        self.event_queue.put({"type": eventType, "object": pod})
+
+    def expire(self):
+        self.event_queue.put(self.ApiException(status=410, reason="Gone"))
+
+    def Watch(self):
+        cluster = self
+
+        class Watch:
+            def __init__(self):
+                self.stopped = False
+
+            def stop(self):
+                self.stopped = True
+
+            def stream(self, list_func, **kwargs):
+                # the nodes get no events
+                event_queue = cluster.event_queue if list_func == cluster.list_namespaced_pod else queue.Queue()
+                while not self.stopped:
+                    try:
+                        event = event_queue.get(timeout=0.01)
+                    except queue.Empty:
+                        continue
+                    if isinstance(event, Exception):
+                        raise event
+                    yield event
+
+        return Watch()
+
+
+@pytest.fixture
+def kube_utils(controller_module):
+    return controller_module("kube_utils")
+
+
+@pytest.fixture
+def cluster(controller_module, kube_utils, monkeypatch):
+    kube_cache_module = controller_module("kube_cache")
+    cluster = Cluster(kube_cache_module.ApiException)
+    monkeypatch.setattr(kube_cache_module, "kube_client", cluster)
+    monkeypatch.setattr(kube_cache_module.watch, "Watch", cluster.Watch)
+    monkeypatch.setattr(kube_utils, "kube_client", cluster)
+    monkeypatch.setattr(kube_utils, "POD_POLL_INTERVAL", 0.01)
+    cache = kube_cache_module.KubeCache()
+    monkeypatch.setattr(kube_utils, "kube_cache", cache)
+    cluster.cache = cache
+    yield cluster
+    cache.stop()
+
+
+def start(cluster):
+    cluster.cache.start(["pose"])
+    assert cluster.cache.wait_synced(timeout=1)
+
+
+def eventually(predicate, timeout=1):
+    """Wait for the watch thread to apply the pushed events."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_watch_events_update_the_cache(cluster):
+    cluster.pod_dict["pose-gpu1-30500"] = pod_object("pose-gpu1-30500")
+    start(cluster)
+    assert cluster.cache.pod("pose-gpu1-30500")["ready"] is False
+
+    cluster.push("MODIFIED", pod_object("pose-gpu1-30500", ready=True, resource_version="2"))
+    cluster.push("ADDED", pod_object("pose-gpu2-30500", resource_version="3"))
+    eventually(lambda: cluster.cache.pod("pose-gpu2-30500") is not None)
+    assert cluster.cache.pod("pose-gpu1-30500")["podIP"] == "10.0.0.1"
+
+    cluster.push("DELETED", pod_object("pose-gpu1-30500", resource_version="4"))
+    eventually(lambda: cluster.cache.pod("pose-gpu1-30500") is None)
+    assert [pod["name"] for pod in cluster.cache.pods()] == ["pose-gpu2-30500"]
+    assert cluster.pod_lists == 1
+
+
+def test_expired_resource_version_is_listed_again(cluster):
+    cluster.pod_dict["pose-gpu1-30500"] = pod_object("pose-gpu1-30500")
+    cluster.pod_dict["pose-gpu2-30500"] = pod_object("pose-gpu2-30500", ready=True)
+    start(cluster)
+
+    # while the watch is down one pod becomes ready and the other one is deleted
+    cluster.pod_dict["pose-gpu1-30500"] = pod_object("pose-gpu1-30500", ready=True, resource_version="5")
+    del cluster.pod_dict["pose-gpu2-30500"]
+    cluster.expire()
+    eventually(lambda: cluster.pod_lists == 2)
+    eventually(lambda: cluster.cache.pod("pose-gpu2-30500") is None)
+    assert cluster.cache.pod("pose-gpu1-30500")["ready"]
+
+
+def test_waiter_is_woken_by_the_watch(cluster, kube_utils):
+    cluster.pod_dict["pose-gpu1-30500"] = pod_object("pose-gpu1-30500")
+    start(cluster)
+
+    async def run():
+        task = asyncio.create_task(kube_utils.wait_for_pod_ready("pose-gpu1-30500", 5))
+        await asyncio.sleep(0.05)
+        assert not task.done()
+        cluster.push("MODIFIED", pod_object("pose-gpu1-30500", ready=True, resource_version="2"))
+        return await task
+
+    pod = asyncio.run(run())
+    assert pod.status.pod_ip == "10.0.0.1"
+    assert cluster.cache.pod("pose-gpu1-30500")["ready"]
+    assert cluster.cache._pod_waiters == {}
+
+
+def test_pod_that_is_already_ready_returns_at_once(cluster, kube_utils):
+    cluster.pod_dict["pose-gpu1-30500"] = pod_object("pose-gpu1-30500", ready=True)
+    start(cluster)
+
+    pod = asyncio.run(kube_utils.wait_for_pod_ready("pose-gpu1-30500", 0))
+    assert pod.metadata.name == "pose-gpu1-30500"
+    assert cluster.cache._pod_waiters == {}
+
+
+def test_wait_times_out(cluster, kube_utils):
+    cluster.pod_dict["pose-gpu1-30500"] = pod_object("pose-gpu1-30500")
+    start(cluster)
+
+    assert asyncio.run(kube_utils.wait_for_pod_ready("pose-gpu1-30500", 0.05)) is None
+    assert cluster.cache._pod_waiters == {}
+
+
+def test_deleted_pod_ends_the_wait(cluster, kube_utils):
+    cluster.pod_dict["pose-gpu1-30500"] = pod_object("pose-gpu1-30500")
+    start(cluster)
+
+    async def run():
+        task = asyncio.create_task(kube_utils.wait_for_pod_ready("pose-gpu1-30500", 5))
+        await asyncio.sleep(0.05)
+        cluster.push("DELETED", pod_object("pose-gpu1-30500", resource_version="2"))
+        return await task
+
+    assert asyncio.run(run()) is None
+    assert cluster.cache.pod("pose-gpu1-30500") is None
+
+
+def test_relist_wakes_the_waiter(cluster, kube_utils):
+    cluster.pod_dict["pose-gpu1-30500"] = pod_object("pose-gpu1-30500")
+    start(cluster)
+
+    async def run():
+        task = asyncio.create_task(kube_utils.wait_for_pod_ready("pose-gpu1-30500", 5))
+        await asyncio.sleep(0.05)
+        # the pod becomes ready while the watch is down
+        cluster.pod_dict["pose-gpu1-30500"] = pod_object("pose-gpu1-30500", ready=True, resource_version="5")
+        cluster.expire()
+        return await task
+
+    pod = asyncio.run(run())
+    assert pod.metadata.resource_version == "5"
+    assert cluster.pod_lists == 2
+
+
+def test_pod_is_polled_without_the_watch(cluster, kube_utils):
+    # the cache is not started, wait_for_pod() reads the pod from the API
+    async def run():
+        task = asyncio.create_task(kube_utils.wait_for_pod_ready("pose-gpu1-30500", 5))
+        await asyncio.sleep(0.05)
+        cluster.pod_dict["pose-gpu1-30500"] = pod_object("pose-gpu1-30500", ready=True)
+        return await task
+
+    assert asyncio.run(run()).metadata.name == "pose-gpu1-30500"
+    assert asyncio.run(kube_utils.wait_for_pod_ready("pose-gpu2-30500", 0.05)) is None
@@ -0,0 +1,54 @@
+import pytest
+
+rest = pytest.importorskip("kubernetes.client.rest")
+
+
+class Sent(Exception):
+    """Raised by the fake REST request instead of going to the network."""
+
+
+@pytest.fixture
+def timeout_list(monkeypatch):
+    timeout_list = []
+
+    def request(self, method, url, *args, _request_timeout=None, **kwargs):
+        timeout_list.append(_request_timeout)
+        raise Sent(url)
+
+    monkeypatch.setattr(rest.RESTClientObject, "request", request)
+    return timeout_list
+
+
+@pytest.fixture
+def KubeClient(controller_module):
+    return controller_module("kube_client").KubeClient
+
+
+def test_default_timeout_is_applied(KubeClient, timeout_list):
+    kube_client = KubeClient(host="http://127.0.0.1:6443", request_timeout=7)
+    with pytest.raises(Sent):
+        kube_client.core_api().list_node()
+    with pytest.raises(Sent):
+        kube_client.core_api().read_namespaced_pod(name="pose-gpu1-30500", namespace="default")
+    assert timeout_list == [7, 7]
+
+
+def test_caller_timeout_is_kept(KubeClient, timeout_list):
+    kube_client = KubeClient(host="http://127.0.0.1:6443", request_timeout=7)
+    # a watch passes a timeout that outlives the stream
+    with pytest.raises(Sent):
+        kube_client.core_api().list_namespaced_pod(namespace="default", _request_timeout=310)
+    assert timeout_list == [310]
+
+
+def test_client_is_shared_until_configure(KubeClient, timeout_list):
+    kube_client = KubeClient(host="http://127.0.0.1:6443", request_timeout=7)
+    core_api = kube_client.core_api()
+    assert kube_client.core_api() is core_api
+
+    kube_client.configure(request_timeout=3)
+    assert kube_client.core_api() is not core_api
+    with pytest.raises(Sent):
+        kube_client.core_api().list_node()
+    assert timeout_list == [3]
+    kube_client.close()
@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+import pytest
+
+
+@pytest.fixture
+def LoopLagMonitor(controller_module):
+    return controller_module("loop_monitor").LoopLagMonitor
+
+
+def monitor(loop_monitor, work):
+    async def run():
+        loop_monitor.start()
+        await asyncio.sleep(0.05)
+        await work()
+        await asyncio.sleep(0.05)
+        await loop_monitor.stop()
+
+    asyncio.run(run())
+    return loop_monitor.metrics()
+
+
+def test_blocking_callback_is_measured(LoopLagMonitor):
+    async def block():
+        # a handler calling a blocking function on the loop
+        asyncio.get_running_loop().call_soon(time.sleep, 0.2)
+        await asyncio.sleep(0.01)
+
+    metrics = monitor(LoopLagMonitor(interval=0.01, warning=0.1), block)
+    assert metrics["maxLagSeconds"] >= 0.15
+    assert metrics["slowSamples"] >= 1
+
+
+def test_work_in_the_worker_pool_does_not_lag_the_loop(LoopLagMonitor, controller_module):
+    worker_pool = controller_module("worker_pool").WorkerPool(max_workers=1)
+
+    async def offload():
+        await worker_pool.run(time.sleep, 0.2)
+
+    try:
+        metrics = monitor(LoopLagMonitor(interval=0.01, warning=0.1), offload)
+    finally:
+        worker_pool.shutdown()
+    assert metrics["samples"] >= 10
+    assert metrics["slowSamples"] == 0
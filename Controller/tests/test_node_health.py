@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+
+class Kubelets:
+    """Answers /healthz of the nodes, the status codes of failing nodes can be set."""
+
+    def __init__(self):
+        self.status_dict = {}
+        self.request_list = []
+
+    def __call__(self, request):
+        self.request_list.append(request.url.host)
+        status = self.status_dict.get(request.url.host, 200)
+        return httpx.Response(status, text="ok" if status == 200 else "unhealthy")
+
+
+class KubeCache:
+    def node(self, nodeName):
+        return {"ip": {"gpu1": "192.168.0.1", "gpu2": "192.168.0.2"}[nodeName], "labels": {}}
+
+
+@pytest.fixture
+def make_prober(controller_module, monkeypatch, tmp_path):
+    node_health = controller_module("node_health")
+    state = controller_module("state")
+    cluster_state = state.ClusterState(
+        str(tmp_path / "service.json"), str(tmp_path / "serviceSpec.json"), str(tmp_path / "subscription.json"),
+        str(tmp_path / "nodestatus.json"), str(tmp_path / "state.journal"), str(tmp_path / "state.snapshot.json"),
+    )
+    monkeypatch.setattr(node_health, "cluster_state", cluster_state)
+    monkeypatch.setattr(node_health, "kube_cache", KubeCache())
+
+    def make(kubelets, ttl=10):
+        return node_health.NodeHealthProber(ttl=ttl, interval=60, transport=httpx.MockTransport(kubelets))
+
+    return make
+
+
+def run(prober, work):
+    async def main():
+        await prober.start(["gpu1", "gpu2"])
+        try:
+            return await work()
+        finally:
+            await prober.close()
+
+    return asyncio.run(main())
+
+
+def test_fresh_results_are_read_from_the_cache(make_prober):
+    kubelets = Kubelets()
+    kubelets.status_dict["192.168.0.2"] = 500
+    prober = make_prober(kubelets)
+
+    status = run(prober, lambda: prober.status(["gpu1", "gpu2"]))
+    assert status == {"gpu1": "healthy", "gpu2": "unhealthy"}
+    # only the probe of start()
+    assert sorted(kubelets.request_list) == ["192.168.0.1", "192.168.0.2"]
+    assert prober.metrics()["cacheHits"] == 2
+
+
+def test_expired_results_are_probed_again(make_prober):
+    kubelets = Kubelets()
+    prober = make_prober(kubelets, ttl=0.05)
+
+    async def work():
+        await asyncio.sleep(0.1)
+        kubelets.status_dict["192.168.0.1"] = 500
+        return await prober.status(["gpu1"])
+
+    assert run(prober, work) == {"gpu1": "unhealthy"}
+    assert kubelets.request_list.count("192.168.0.1") == 2
+    assert prober.metrics()["cacheHits"] == 0
+
+
+def test_reported_node_stays_unhealthy_until_the_failure_is_handled(make_prober):
+    kubelets = Kubelets()
+    prober = make_prober(kubelets)
+
+    async def work():
+        prober.mark_unhealthy("gpu1")
+        result_list = [await prober.status(["gpu1"])]
+        # the kubelet still answers, e.g. only the pods failed
+        result_list.append(await prober.probe(["gpu1"]))
+        prober.failure_handled("gpu1")
+        result_list.append(await prober.probe(["gpu1"]))
+        return result_list
+
+    assert run(prober, work) == [{"gpu1": "unhealthy"}, {"gpu1": "unhealthy"}, {"gpu1": "healthy"}]
+    # mark_unhealthy() counts as a fresh result, status() did not probe
+    assert kubelets.request_list.count("192.168.0.1") == 3
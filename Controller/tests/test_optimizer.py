@@ -0,0 +1,122 @@
+import copy
+import random
+
+import pytest
+
+import optimizer
+
+
+def make_servicelist(rng: random.Random, instances: int, servicetypes=("pose", "gesture", "object")) -> list:
+    # small integer workloads on purpose, they produce a lot of ties between instances
+    frequencyLimit = {"pose": [20, 10], "gesture": [30, 15], "object": [8, 4]}
+    servicelist = []
+    for i in range(instances):
+        serviceType = rng.choice(servicetypes)
+        workloadLimit = rng.choice([0, 5, 8, 30, 40, 60, 90, 90.5, 170, 255]) / rng.choice([1, 1, 2, 3])
+        servicelist.append({
+            "podIP": f"10.244.0.{i}",
+            "hostPort": 30500 + i,
+            "serviceType": serviceType,
+            "currentConnection": rng.randint(0, 6),
+            "nodeName": f"node{i % 4}",
+            "hostIP": f"10.52.52.{i % 4}",
+            "frequencyLimit": frequencyLimit[serviceType],
+            "currentFrequency": frequencyLimit[serviceType][0],
+            "workloadLimit": workloadLimit,
+        })
+    return servicelist
+
+
+def assert_same_result(function, servicetype: str, agentcount: int, servicelist: list):
+    expected = optimizer.optimize_sorted(servicetype, agentcount, copy.deepcopy(servicelist))
+    actual = function(servicetype, agentcount, copy.deepcopy(servicelist))
+    assert actual == expected
+
+
+FUNCTIONS = [optimizer.optimize, optimizer.waterfill]
+
+
+@pytest.mark.parametrize("function", FUNCTIONS)
+@pytest.mark.parametrize("seed", range(300))
+def test_matches_optimize_sorted(function, seed):
+    rng = random.Random(seed)
+    servicelist = make_servicelist(rng, rng.randint(0, 12))
+    servicetype = rng.choice(["pose", "gesture", "object"])
+    assert_same_result(function, servicetype, rng.randint(0, 60), servicelist)
+
+
+@pytest.mark.parametrize("function", FUNCTIONS)
+@pytest.mark.parametrize("agentcount", [0, 1, 2, 3, 7, 8, 9, 25, 100])
+def test_matches_optimize_sorted_on_identical_instances(function, agentcount):
+    servicelist = make_servicelist(random.Random(0), 6, servicetypes=("pose",))
+    for instance in servicelist:
+        instance["workloadLimit"] = 45
+    assert_same_result(function, "pose", agentcount, servicelist)
+
+
+@pytest.mark.parametrize("function", FUNCTIONS)
+def test_without_instance_of_service_type(function):
+    servicelist = make_servicelist(random.Random(1), 5, servicetypes=("pose",))
+    status, result = function("gesture", 3, copy.deepcopy(servicelist))
+    assert status == "fail"
+    assert_same_result(function, "gesture", 3, servicelist)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_waterfill_matches_optimize_with_many_agents(seed):
+    rng = random.Random(seed)
+    servicelist = make_servicelist(rng, 40, servicetypes=("pose", "gesture"))
+    for instance in servicelist:
+        instance["workloadLimit"] = instance["workloadLimit"] or 45
+    expected = optimizer.optimize("pose", 5000, copy.deepcopy(servicelist))
+    assert optimizer.waterfill("pose", 5000, copy.deepcopy(servicelist)) == expected
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_add_agent_follows_optimize(seed):
+    rng = random.Random(seed)
+    servicelist = make_servicelist(rng, 8, servicetypes=("pose", "gesture"))
+    for instance in servicelist:
+        # distinct workloads, ties may be broken differently
+        instance["workloadLimit"] = rng.uniform(20, 200)
+    servicelist[0].update(serviceType="pose", frequencyLimit=[20, 10])
+    agentcount = rng.randint(1, 80)
+
+    _, expected = optimizer.optimize("pose", agentcount, copy.deepcopy(servicelist))
+    _, actual = optimizer.optimize("pose", 0, copy.deepcopy(servicelist))
+    actual = sorted(actual, key=lambda instance: instance["podIP"])
+    for _ in range(agentcount):
+        _, actual, index = optimizer.add_agent("pose", actual)
+        assert index != -1
+    assert sorted(actual, key=lambda instance: instance["podIP"]) == sorted(expected, key=lambda instance: instance["podIP"])
+
+
+def test_remove_agent_restores_default_rate():
+    servicelist = make_servicelist(random.Random(2), 1, servicetypes=("pose",))
+    servicelist[0]["workloadLimit"] = 45
+    _, servicelist = optimizer.optimize("pose", 3, servicelist)
+    assert servicelist[0]["currentFrequency"] == 15
+    optimizer.remove_agent(servicelist, 0)
+    assert servicelist[0]["currentConnection"] == 2
+    assert servicelist[0]["currentFrequency"] == 20
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_admission_capacity_is_the_last_successful_agentcount(seed):
+    rng = random.Random(seed)
+    servicelist = make_servicelist(rng, rng.randint(1, 5))
+    servicetype = rng.choice(["pose", "gesture", "object"])
+    if seed % 4 == 0:
+        # a service type without a minimum frequency takes any number of agents
+        for instance in servicelist:
+            if instance["serviceType"] == servicetype:
+                instance["frequencyLimit"] = [instance["frequencyLimit"][0], 0]
+    agentcount = rng.randint(0, 400)
+    capacity = optimizer.admission_capacity(servicetype, agentcount, servicelist)
+    assert capacity <= agentcount
+    if capacity > 0:
+        status, _ = optimizer.optimize(servicetype, capacity, copy.deepcopy(servicelist))
+        assert status == "success"
+    if capacity < agentcount:
+        status, _ = optimizer.optimize(servicetype, capacity + 1, copy.deepcopy(servicelist))
+        assert status == "fail"
@@ -0,0 +1,104 @@
+from placement import Candidate, ClusterView, plan_placement
+
+SERVICE_SPEC = {
+    "pose": {"gpuMemoryRequest": 2, "frequencyLimit": [10, 5], "workAbility": {"gpu1": 40, "gpu2": 60, "gpu3": 30}},
+    "gesture": {"gpuMemoryRequest": 3, "frequencyLimit": [15, 5], "workAbility": {"gpu1": 45, "gpu2": 30, "gpu3": 30}},
+    "object": {"gpuMemoryRequest": 4, "frequencyLimit": [10, 5], "workAbility": {"gpu1": 30}},
+}
+GPU_MEMORY = {"gpu1": 8, "gpu2": 8, "gpu3": 8}
+
+
+def service(serviceType, nodeName, currentConnection=0):
+    return {"serviceType": serviceType, "nodeName": nodeName, "currentConnection": currentConnection}
+
+
+def standby(serviceType, nodeName, ready=True):
+    return {"serviceType": serviceType, "nodeName": nodeName, "ready": ready}
+
+
+def test_aggregates_are_built_in_one_pass():
+    view = ClusterView([service("pose", "gpu1", 3), service("gesture", "gpu1", 2)], [standby("object", "gpu1")], SERVICE_SPEC)
+    assert view.serviceTypes == {"gpu1": ["pose", "gesture"]}
+    assert view.gpu_memory_requested("gpu1") == 9
+    assert view.gpu_memory_requested("gpu1", "object") == 5
+    assert view.gpu_memory_requested("gpu2") == 0
+
+
+def test_candidates_are_ranked_by_workload_limit():
+    view = ClusterView([service("gesture", "gpu1")], [], SERVICE_SPEC)
+    assert view.candidates("pose", GPU_MEMORY) == [
+        Candidate("gpu2", 60.0, False),
+        Candidate("gpu3", 30.0, False),
+        Candidate("gpu1", 20.0, False),
+    ]
+
+
+def test_ready_standby_comes_first():
+    view = ClusterView([], [standby("pose", "gpu3")], SERVICE_SPEC)
+    assert [candidate.nodeName for candidate in view.candidates("pose", GPU_MEMORY)] == ["gpu3", "gpu2", "gpu1"]
+
+
+def test_nodes_that_cannot_take_the_service_are_skipped():
+    view = ClusterView(
+        [service("pose", "gpu1"), service("gesture", "gpu2")],
+        [standby("pose", "gpu3", ready=False)],
+        SERVICE_SPEC,
+    )
+    # gpu1 already runs pose, gpu2 would leave gesture at 15 and pose at 30, gpu3 is starting a standby
+    assert view.candidates("pose", GPU_MEMORY) == [Candidate("gpu2", 30.0, False)]
+    # gesture at 45 / 2 on gpu1 is fine, pose at 40 / 2 too
+    assert view.candidates("gesture", GPU_MEMORY) == [Candidate("gpu3", 30.0, False), Candidate("gpu1", 22.5, False)]
+    # object only runs on gpu1
+    assert view.candidates("object", GPU_MEMORY) == [Candidate("gpu1", 15.0, False)]
+
+
+def test_split_below_the_default_frequency_is_rejected():
+    view = ClusterView([service("gesture", "gpu3")], [], SERVICE_SPEC)
+    # gesture would get 30 / 2 = 15, still its frequencyLimit[0]; pose gets 15
+    assert view.workload_limit("pose", "gpu3") == 15.0
+    view = ClusterView([service("gesture", "gpu2"), service("object", "gpu2")], [], SERVICE_SPEC)
+    assert view.workload_limit("pose", "gpu2") is None
+
+
+def test_gpu_memory_of_standbys_counts():
+    view = ClusterView([service("object", "gpu1")], [standby("gesture", "gpu1")], SERVICE_SPEC)
+    assert view.candidates("pose", {"gpu1": 8}) == []
+    assert view.candidates("pose", {"gpu1": 9}) == [Candidate("gpu1", 20.0, False)]
+
+
+def test_ready_standby_needs_no_more_gpu_memory():
+    view = ClusterView([service("gesture", "gpu1")], [standby("pose", "gpu1")], SERVICE_SPEC)
+    assert view.candidates("pose", {"gpu1": 3}) == [Candidate("gpu1", 20.0, True)]
+
+
+def test_add_standby_updates_the_view():
+    view = ClusterView([], [], SERVICE_SPEC)
+    view.add_standby(standby("pose", "gpu2", ready=False))
+    assert view.gpu_memory_requested("gpu2") == 2
+    assert "gpu2" not in [candidate.nodeName for candidate in view.candidates("pose", GPU_MEMORY)]
+
+
+def test_plan_places_the_largest_request_first():
+    view = ClusterView([], [], SERVICE_SPEC)
+    # object (4) goes first and takes gpu1, the only node it runs on
+    placement_dict = plan_placement(["pose", "gesture", "object"], view, {"gpu1": 4, "gpu2": 8, "gpu3": 2})
+    assert {serviceType: candidate.nodeName for serviceType, candidate in placement_dict.items()} == {
+        "object": "gpu1",
+        "gesture": "gpu2",
+        # 60 / 2 next to gesture ties with gpu3 alone, gpu2 comes first
+        "pose": "gpu2",
+    }
+    assert view.serviceTypes == {"gpu1": ["object"], "gpu2": ["gesture", "pose"]}
+
+
+def test_plan_accounts_for_instances_placed_before():
+    view = ClusterView([], [], SERVICE_SPEC)
+    placement_dict = plan_placement(["pose", "gesture"], view, {"gpu2": 8})
+    # pose gets 60 / 2 next to gesture, gesture 30 / 2 is still its frequencyLimit[0]
+    assert placement_dict == {"gesture": Candidate("gpu2", 30.0, False), "pose": Candidate("gpu2", 30.0, False)}
+    assert view.gpu_memory_requested("gpu2") == 5
+
+
+def test_plan_skips_service_types_that_do_not_fit():
+    view = ClusterView([], [], SERVICE_SPEC)
+    assert list(plan_placement(["pose", "object"], view, {"gpu1": 4})) == ["object"]
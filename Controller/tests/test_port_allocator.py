@@ -0,0 +1,70 @@
+from port_allocator import PortAllocator, parse_pod_name, pod_name
+
+
+def test_allocate_hands_out_ports_in_order_per_node():
+    allocator = PortAllocator(30500, 30503)
+    assert [allocator.allocate("pose", "workergpu") for _ in range(3)] == [30500, 30501, 30502]
+    assert allocator.allocate("pose", "workergpu") is None
+    assert allocator.allocate("pose", "workergpu2") == 30500
+
+
+def test_reserved_ports_are_skipped():
+    allocator = PortAllocator(30500, 30504)
+    allocator.reserve("pose", "workergpu", 30500)
+    allocator.reserve("gesture", "workergpu", 30502)
+    assert allocator.allocate("pose", "workergpu") == 30501
+    assert allocator.allocate("pose", "workergpu") == 30503
+    assert allocator.allocate("pose", "workergpu") is None
+
+
+def test_released_port_is_reused():
+    allocator = PortAllocator(30500, 30502)
+    hostPort = allocator.allocate("pose", "workergpu")
+    allocator.allocate("pose", "workergpu")
+    allocator.release(pod_name("pose", "workergpu", hostPort))
+    assert allocator.allocate("gesture", "workergpu") == hostPort
+
+
+def test_port_of_a_terminating_pod_is_held_until_it_is_deleted():
+    allocator = PortAllocator(30500, 30501)
+    hostPort = allocator.allocate("pose", "workergpu")
+    allocator.release_after_delete(pod_name("pose", "workergpu", hostPort))
+    assert allocator.allocate("pose", "workergpu") is None
+    assert allocator.metrics()["terminating"] == 1
+    allocator.pod_deleted(pod_name("pose", "workergpu", hostPort))
+    assert allocator.allocate("pose", "workergpu") == hostPort
+
+
+def test_pod_deleted_keeps_the_port_of_an_allocated_pod():
+    allocator = PortAllocator(30500, 30501)
+    hostPort = allocator.allocate("pose", "workergpu")
+    allocator.pod_deleted(pod_name("pose", "workergpu", hostPort))
+    allocator.pod_deleted(pod_name("pose", "workergpu", 30600))
+    assert allocator.metrics() == {"allocated": 1, "terminating": 0, "deleted": 1, "free": {"workergpu": 0}}
+
+
+def test_pod_deleted_before_release_after_delete_frees_the_port():
+    allocator = PortAllocator(30500, 30501)
+    hostPort = allocator.allocate("pose", "workergpu")
+    # an unscheduled Pod is gone before delete_namespaced_pod() returns
+    allocator.pod_deleted(pod_name("pose", "workergpu", hostPort))
+    allocator.release_after_delete(pod_name("pose", "workergpu", hostPort))
+    assert allocator.metrics()["terminating"] == 0
+    assert allocator.metrics()["deleted"] == 0
+    assert allocator.allocate("pose", "workergpu") == hostPort
+
+
+def test_deleted_pod_that_is_seen_again_is_held():
+    allocator = PortAllocator(30500, 30501)
+    hostPort = allocator.allocate("pose", "workergpu")
+    # DELETED of an older Pod with the same name, then the new Pod shows up
+    allocator.pod_deleted(pod_name("pose", "workergpu", hostPort))
+    allocator.pod_seen(pod_name("pose", "workergpu", hostPort))
+    allocator.release_after_delete(pod_name("pose", "workergpu", hostPort))
+    assert allocator.allocate("pose", "workergpu") is None
+    allocator.pod_deleted(pod_name("pose", "workergpu", hostPort))
+    assert allocator.allocate("pose", "workergpu") == hostPort
+
+
+def test_parse_pod_name_handles_dashes_in_node_names():
+    assert parse_pod_name(pod_name("pose", "worker-gpu-2", 30512), "pose") == ("worker-gpu-2", 30512)
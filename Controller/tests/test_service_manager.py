@@ -0,0 +1,197 @@
+import asyncio
+import json
+
+import pytest
+
+SERVICE_SPEC = {
+    "pose": {"gpuMemoryRequest": 2, "frequencyLimit": [10, 5], "workAbility": {"gpu1": 60}},
+    "object": {"gpuMemoryRequest": 2, "frequencyLimit": [8, 4], "workAbility": {"gpu1": 32}},
+    "gesture": {"gpuMemoryRequest": 2, "frequencyLimit": [15, 5], "workAbility": {"gpu1": 90}},
+}
+
+
+def instance(serviceType, podIP, currentConnection, currentFrequency, workloadLimit):
+    return {
+        "podIP": podIP,
+        "hostPort": 30500,
+        "serviceType": serviceType,
+        "currentConnection": currentConnection,
+        "nodeName": "gpu1",
+        "hostIP": "192.168.0.1",
+        "frequencyLimit": SERVICE_SPEC[serviceType]["frequencyLimit"],
+        "currentFrequency": currentFrequency,
+        "workloadLimit": workloadLimit,
+    }
+
+
+@pytest.fixture
+def service_manager(controller_module, monkeypatch, tmp_path):
+    service_manager = controller_module("service_manager")
+    state = controller_module("state")
+    cluster_state = state.ClusterState(
+        str(tmp_path / "service.json"), str(tmp_path / "serviceSpec.json"), str(tmp_path / "subscription.json"),
+        str(tmp_path / "nodestatus.json"), str(tmp_path / "state.journal"), str(tmp_path / "state.snapshot.json"),
+    )
+    monkeypatch.setattr(service_manager, "cluster_state", cluster_state)
+    monkeypatch.setattr(service_manager, "warm_pool", controller_module("warm_pool").WarmPool())
+    monkeypatch.setattr(service_manager, "port_allocator", controller_module("port_allocator").PortAllocator(30500, 30510))
+    monkeypatch.setattr(service_manager, "optimize", controller_module("optimizer").optimize)
+    monkeypatch.setattr(service_manager, "agent_notifier", controller_module("agent_notifier").AgentNotifier())
+
+    async def deployable_gpu_memory():
+        return SERVICE_SPEC, {"gpu1": 24}
+
+    async def start_service(serviceType, nodeName, hostPort, serviceSpec_dict, split):
+        service_manager.add_service(serviceType, nodeName, "10.0.0.9", "192.168.0.1", hostPort, serviceSpec_dict, split)
+        return True
+
+    service_manager.adjusted = []
+    service_manager.redeployed = []
+
+    async def adjust_frequency(serviceType):
+        service_manager.adjusted.append(serviceType)
+
+    async def deploy_service(serviceType, excludedNodeName_set=frozenset()):
+        service_manager.redeployed.append((serviceType, excludedNodeName_set))
+
+    monkeypatch.setattr(service_manager, "deployable_gpu_memory", deployable_gpu_memory)
+    monkeypatch.setattr(service_manager, "start_service", start_service)
+    monkeypatch.setattr(service_manager, "adjust_frequency", adjust_frequency)
+    monkeypatch.setattr(service_manager, "deploy_service", deploy_service)
+    return service_manager
+
+
+def test_colocated_service_types_are_adjusted(service_manager):
+    service_manager.cluster_state.service_list = [
+        instance("pose", "10.0.0.1", 3, 10, 30.0),
+        instance("object", "10.0.0.2", 2, 8, 16.0),
+    ]
+    asyncio.run(service_manager.deploy_services(["gesture"]))
+
+    # gpu1 is split three ways: pose drops to 20 / 3 fps and object to 32 / 3 / 2 fps
+    assert sorted(service_manager.adjusted) == ["object", "pose"]
+    workloadLimit_dict = {service["serviceType"]: service["workloadLimit"] for service in service_manager.cluster_state.service_list}
+    assert workloadLimit_dict == {"pose": 20.0, "object": 32 / 3, "gesture": 30.0}
+    assert service_manager.redeployed == []
+
+
+def test_failed_split_keeps_the_node_and_frees_the_port(service_manager):
+    # five pose agents need 25 fps at frequencyLimit[1], a third of gpu1 only has 20
+    service_list = [
+        instance("pose", "10.0.0.1", 5, 6, 30.0),
+        instance("object", "10.0.0.2", 2, 8, 16.0),
+    ]
+    service_manager.cluster_state.service_list = [dict(service) for service in service_list]
+    asyncio.run(service_manager.deploy_services(["gesture"]))
+
+    assert service_manager.cluster_state.service_list == service_list
+    assert service_manager.adjusted == []
+    assert service_manager.redeployed == [("gesture", frozenset())]
+    assert service_manager.port_allocator.metrics()["allocated"] == 0
+
+
+def test_write_back_checks_that_nothing_changed_since_the_copy(service_manager):
+    cluster_state = service_manager.cluster_state
+    cluster_state.service_list = [instance("pose", "10.0.0.1", 3, 10, 30.0)]
+    snapshotSeq = cluster_state.seq
+    service_list = cluster_state.copy_service_list()
+    service_list[0]["currentFrequency"] = 8
+    service_manager.commit_service_list(service_list, snapshotSeq)
+    assert cluster_state.service_list[0]["currentFrequency"] == 8
+
+    # another request wrote in between, e.g. across an await
+    snapshotSeq = cluster_state.seq
+    service_list = cluster_state.copy_service_list()
+    service_manager.add_service("object", "gpu1", "10.0.0.2", "192.168.0.1", 30501, SERVICE_SPEC, 2)
+    with pytest.raises(RuntimeError):
+        service_manager.commit_service_list(service_list, snapshotSeq)
+    assert [service["serviceType"] for service in cluster_state.service_list] == ["pose", "object"]
+
+
+def test_stale_write_back_gives_the_port_and_the_standby_back(service_manager, monkeypatch):
+    service_manager.cluster_state.service_list = [instance("pose", "10.0.0.1", 3, 10, 30.0)]
+    warm_pool = service_manager.warm_pool
+    warm_pool.add_pending("object", "gpu1", 30509)
+    warm_pool.mark_ready("object-gpu1-30509", "10.0.0.8", "192.168.0.1")
+    split_node = service_manager.split_node
+
+    def split_node_and_write(*args):
+        # another request writes between the copy and the write back
+        service_manager.add_service("pose", "gpu1", "10.0.0.3", "192.168.0.1", 30508, SERVICE_SPEC, 2)
+        return split_node(*args)
+
+    monkeypatch.setattr(service_manager, "split_node", split_node_and_write)
+    with pytest.raises(RuntimeError):
+        asyncio.run(service_manager.deploy_services(["object", "gesture"]))
+
+    assert service_manager.port_allocator.metrics()["allocated"] == 0
+    assert warm_pool.is_ready("object", "gpu1")
+    assert warm_pool.metrics()["promoted"] == 0
+
+
+def test_new_subscription_is_one_record_with_the_service_list(service_manager, tmp_path):
+    cluster_state = service_manager.cluster_state
+    with cluster_state.mutate(service_manager.SERVICES, service_manager.SUBSCRIPTIONS):
+        cluster_state.service_list = [instance("pose", "10.0.0.1", 1, 10, 30.0)]
+        cluster_state.subscriptions.add({
+            "agentIP": "192.168.1.10", "agentPort": 8000, "podIP": "10.0.0.1", "serviceType": "pose", "nodeName": "gpu1",
+        })
+    relation_list = [instance("pose", "10.0.0.1", 2, 10, 30.0)]
+
+    notification_list, service = service_manager.admit_agent(relation_list, "pose", "192.168.1.11", 8001)
+
+    assert service["podIP"] == "10.0.0.1" and service["currentConnection"] == 2
+    assert [notification[1:3] for notification in notification_list] == [("192.168.1.10", 8000)]
+    with open(tmp_path / "state.journal") as journalFile:
+        record_list = [json.loads(line) for line in journalFile]
+    # the new connection and the subscription of the new agent are one record
+    assert len(record_list) == 2
+    assert record_list[1]["changes"]["services"]["put"]["pose-gpu1-30500"]["currentConnection"] == 2
+    assert record_list[1]["changes"]["subscriptions"] == {"put": {"1": {
+        "agentIP": "192.168.1.11", "agentPort": 8001, "podIP": "10.0.0.1", "serviceType": "pose", "nodeName": "gpu1",
+    }}}
+
+
+class KubeCache:
+    def __init__(self, label):
+        self.label = label
+
+    def node(self, nodeName):
+        return {"labels": {self.label: "24"}, "ip": None}
+
+
+class KubeClient:
+    def core_api(self):
+        return None
+
+
+def test_deploy_after_a_node_failure_alert_avoids_the_node(service_manager, controller_module, monkeypatch):
+    node_health = controller_module("node_health")
+    cluster_state = service_manager.cluster_state
+    cluster_state.node_health_status = {"gpu1": "healthy", "gpu2": "healthy"}
+    serviceSpec_dict = {"gesture": {"gpuMemoryRequest": 2, "frequencyLimit": [15, 5], "workAbility": {"gpu1": 90, "gpu2": 60}}}
+    prober = node_health.NodeHealthProber()
+    monkeypatch.setattr(node_health, "cluster_state", cluster_state)
+    monkeypatch.setattr(service_manager, "kube_cache", KubeCache(service_manager.GPU_MEMORY_LABEL))
+    monkeypatch.setattr(service_manager, "kube_client", KubeClient())
+
+    async def deployable_gpu_memory():
+        return serviceSpec_dict, await service_manager.read_gpu_memory(["gpu1", "gpu2"])
+
+    async def probe_node(nodeName):
+        # the kubelet of gpu1 still answers
+        return "healthy"
+
+    monkeypatch.setattr(service_manager, "deployable_gpu_memory", deployable_gpu_memory)
+    monkeypatch.setattr(prober, "_probe_node", probe_node)
+
+    async def run():
+        # /alert marks the node before the alert is queued
+        prober.mark_unhealthy("gpu1")
+        await prober.probe(["gpu1", "gpu2"])
+        await service_manager.deploy_services(["gesture"])
+        prober.failure_handled("gpu1")
+        return await prober.probe(["gpu1"])
+
+    assert asyncio.run(run()) == {"gpu1": "healthy"}
+    assert [(service["serviceType"], service["nodeName"]) for service in cluster_state.service_list] == [("gesture", "gpu2")]
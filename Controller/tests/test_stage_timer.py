@@ -0,0 +1,32 @@
+import pytest
+
+from stage_timer import StageTimer
+
+
+def test_stage_records_its_duration(monkeypatch):
+    clock = iter([10.0, 10.5, 20.0, 21.5])
+    monkeypatch.setattr("stage_timer.time.perf_counter", lambda: next(clock))
+    timer = StageTimer()
+    with timer.stage("delete"):
+        pass
+    with timer.stage("delete"):
+        pass
+    assert timer.metrics() == {
+        "delete": {"count": 2, "lastSeconds": 1.5, "totalSeconds": 2.0, "maxSeconds": 1.5, "meanSeconds": 1.0},
+    }
+
+
+def test_stage_is_recorded_when_it_raises():
+    timer = StageTimer()
+    with pytest.raises(RuntimeError):
+        with timer.stage("deploy"):
+            raise RuntimeError
+    assert timer.metrics()["deploy"]["count"] == 1
+
+
+def test_last_has_the_latest_duration_of_every_stage():
+    timer = StageTimer()
+    timer.record("delete", 0.2)
+    timer.record("notify", 0.1)
+    timer.record("delete", 0.4)
+    assert timer.last() == {"delete": 0.4, "notify": 0.1}
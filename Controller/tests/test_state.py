@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+
+import pytest
+
+
+def subscription(agentPort, podIP="10.0.0.1", nodeName="gpu1"):
+    return {"agentIP": "192.168.1.10", "agentPort": agentPort, "podIP": podIP, "serviceType": "pose", "nodeName": nodeName}
+
+
+@pytest.fixture
+def state(controller_module):
+    return controller_module("state")
+
+
+@pytest.fixture
+def make_state(state, tmp_path):
+    def make():
+        cluster_state = state.ClusterState(
+            str(tmp_path / "service.json"), str(tmp_path / "serviceSpec.json"), str(tmp_path / "subscription.json"),
+            str(tmp_path / "nodestatus.json"), str(tmp_path / "state.journal"), str(tmp_path / "state.snapshot.json"),
+        )
+        cluster_state.load()
+        return cluster_state
+
+    return make
+
+
+def records(tmp_path):
+    with open(tmp_path / "state.journal") as journalFile:
+        return [json.loads(line) for line in journalFile]
+
+
+def test_only_the_changed_subscriptions_are_journaled(state, make_state, tmp_path):
+    cluster_state = make_state()
+    with cluster_state.mutate(state.SUBSCRIPTIONS):
+        for agentPort in range(5):
+            cluster_state.subscriptions.add(subscription(agentPort))
+    with cluster_state.mutate(state.SUBSCRIPTIONS):
+        cluster_state.subscriptions.move(1, "10.0.0.2", "gpu2")
+        cluster_state.subscriptions.move(3, "10.0.0.2", "gpu2")
+        cluster_state.subscriptions.remove(4)
+    with cluster_state.mutate(state.SUBSCRIPTIONS):
+        # moved back and forth, nothing to journal
+        cluster_state.subscriptions.move(0, "10.0.0.2", "gpu2")
+        cluster_state.subscriptions.move(0, "10.0.0.1", "gpu1")
+
+    record_list = records(tmp_path)
+    assert len(record_list) == 2
+    assert sorted(record_list[0]["changes"]["subscriptions"]["put"]) == ["0", "1", "2", "3", "4"]
+    assert record_list[1]["changes"]["subscriptions"] == {
+        "put": {"1": subscription(1, "10.0.0.2", "gpu2"), "3": subscription(3, "10.0.0.2", "gpu2")},
+        "del": ["4"],
+    }
+
+
+def test_replayed_journal_gives_back_the_subscriptions(state, make_state):
+    cluster_state = make_state()
+    with cluster_state.mutate(state.SUBSCRIPTIONS):
+        for agentPort in range(4):
+            cluster_state.subscriptions.add(subscription(agentPort))
+    with cluster_state.mutate(state.SUBSCRIPTIONS):
+        cluster_state.subscriptions.move(2, "10.0.0.2", "gpu2")
+        cluster_state.subscriptions.remove(0)
+    cluster_state._journal.close()
+
+    restored = make_state()
+    assert restored.subscriptions.items() == cluster_state.subscriptions.items()
+    assert restored.subscriptions.ids_on_node("gpu2") == [2]
+    assert restored.subscriptions.pop_changed() == []
+
+
+def test_nested_mutate_appends_one_record(state, make_state, tmp_path):
+    cluster_state = make_state()
+    with cluster_state.mutate(state.SERVICES):
+        cluster_state.service_list = [{"serviceType": "pose", "nodeName": "gpu1", "hostPort": 30500, "currentConnection": 1}]
+        with cluster_state.mutate(state.SUBSCRIPTIONS):
+            cluster_state.subscriptions.add(subscription(8000))
+        assert cluster_state.seq == 0
+
+    record_list = records(tmp_path)
+    assert len(record_list) == 1 and cluster_state.seq == 1
+    assert sorted(record_list[0]["changes"]) == ["services", "subscriptions"]
+
+
+def test_fsync_runs_on_the_persister_thread(state, controller_module, tmp_path, monkeypatch):
+    fsync_list = []
+    monkeypatch.setattr(controller_module("journal").os, "fsync", lambda fd: fsync_list.append(threading.current_thread().name))
+    cluster_state = state.ClusterState(
+        str(tmp_path / "service.json"), str(tmp_path / "serviceSpec.json"), str(tmp_path / "subscription.json"),
+        str(tmp_path / "nodestatus.json"), str(tmp_path / "state.journal"), str(tmp_path / "state.snapshot.json"),
+        fsync=True,
+    )
+    cluster_state.load()
+    cluster_state.start()
+    try:
+        with cluster_state.mutate(state.SUBSCRIPTIONS):
+            cluster_state.subscriptions.add(subscription(8000))
+        deadline = time.monotonic() + 1
+        while not fsync_list and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert fsync_list == ["cluster-state-persister"]
+    finally:
+        cluster_state.stop()
@@ -0,0 +1,112 @@
+from subscription_registry import SubscriptionRegistry
+
+
+def subscription(agentIP, agentPort, serviceType="pose", podIP="10.0.0.1", nodeName="gpu1"):
+    return {"agentIP": agentIP, "agentPort": agentPort, "podIP": podIP, "serviceType": serviceType, "nodeName": nodeName}
+
+
+def indexes(registry):
+    return {
+        "podIP": registry._by_podIP,
+        "serviceType": registry._by_serviceType,
+        "nodeName": registry._by_nodeName,
+        "agent": registry._by_agent,
+    }
+
+
+def rebuilt(registry):
+    """Indexes of a registry built from scratch with the same subscriptions."""
+    fresh = SubscriptionRegistry()
+    for subscriptionId, entry in registry.items():
+        fresh.add(dict(entry), subscriptionId)
+    return {name: {key: sorted(ids) for key, ids in index.items()} for name, index in indexes(fresh).items()}
+
+
+def normalized(registry):
+    return {name: {key: sorted(ids) for key, ids in index.items()} for name, index in indexes(registry).items()}
+
+
+def test_add_indexes_every_key():
+    registry = SubscriptionRegistry([
+        subscription("192.168.1.10", 8000),
+        subscription("192.168.1.10", 8001, "gesture", "10.0.0.2", "gpu2"),
+        subscription("192.168.1.11", 8000, podIP="10.0.0.3", nodeName="gpu2"),
+    ])
+    assert registry.ids_on_pod("10.0.0.1") == [0]
+    assert registry.ids_of_service_type("pose") == [0, 2]
+    assert registry.count("gesture") == 1
+    assert registry.ids_on_node("gpu2") == [1, 2]
+    assert registry.ids_of_agent("192.168.1.10", "8001") == [1]
+
+
+def test_ids_keep_the_list_order():
+    registry = SubscriptionRegistry([subscription("192.168.1.10", port) for port in range(8000, 8004)])
+    registry.move(0, "10.0.0.2", "gpu2")
+    registry.move(2, "10.0.0.2", "gpu2")
+    registry.move(0, "10.0.0.1", "gpu1")
+    assert registry.ids_on_pod("10.0.0.1") == [0, 1, 3]
+    assert registry.ids_on_node("gpu2") == [2]
+    assert [entry["agentPort"] for entry in registry.to_list()] == [8000, 8001, 8002, 8003]
+
+
+def test_move_updates_only_the_pod_and_node_indexes():
+    registry = SubscriptionRegistry([subscription("192.168.1.10", 8000), subscription("192.168.1.10", 8001)])
+    registry.move(1, "10.0.0.2", "gpu2")
+    assert registry[1]["podIP"] == "10.0.0.2" and registry[1]["nodeName"] == "gpu2"
+    assert registry.ids_on_pod("10.0.0.1") == [0]
+    assert registry.ids_on_pod("10.0.0.2") == [1]
+    assert registry.ids_of_service_type("pose") == [0, 1]
+    assert registry.ids_of_agent("192.168.1.10", 8001) == [1]
+    assert normalized(registry) == rebuilt(registry)
+
+
+def test_remove_drops_empty_buckets():
+    registry = SubscriptionRegistry([
+        subscription("192.168.1.10", 8000),
+        subscription("192.168.1.11", 8000, "gesture", "10.0.0.2", "gpu2"),
+    ])
+    removed = registry.remove(1)
+    assert removed["serviceType"] == "gesture"
+    assert 1 not in registry and len(registry) == 1
+    assert "10.0.0.2" not in registry._by_podIP
+    assert "gesture" not in registry._by_serviceType
+    assert "gpu2" not in registry._by_nodeName
+    assert ("192.168.1.11", 8000) not in registry._by_agent
+    assert registry.ids_on_pod("10.0.0.2") == [] and registry.count("gesture") == 0
+    registry.remove(0)
+    assert normalized(registry) == {"podIP": {}, "serviceType": {}, "nodeName": {}, "agent": {}}
+
+
+def test_move_drops_the_emptied_pod_and_node_buckets():
+    registry = SubscriptionRegistry([subscription("192.168.1.10", 8000)])
+    registry.move(0, "10.0.0.2", "gpu2")
+    assert list(registry._by_podIP) == ["10.0.0.2"]
+    assert list(registry._by_nodeName) == ["gpu2"]
+
+
+def test_indexes_stay_consistent_through_a_sequence_of_changes():
+    registry = SubscriptionRegistry()
+    for port in range(20):
+        registry.add(subscription(f"192.168.1.{port % 3}", 8000 + port, ("pose", "gesture")[port % 2], f"10.0.0.{port % 4}", f"gpu{port % 2}"))
+    for subscriptionId in range(0, 20, 3):
+        registry.move(subscriptionId, "10.0.0.9", "gpu9")
+    for subscriptionId in range(1, 20, 4):
+        registry.remove(subscriptionId)
+    registry.add(subscription("192.168.1.5", 9000))
+    assert normalized(registry) == rebuilt(registry)
+
+
+def test_restored_ids_continue_the_sequence():
+    registry = SubscriptionRegistry()
+    registry.add(subscription("192.168.1.10", 8000), 7)
+    assert registry.add(subscription("192.168.1.10", 8001)) == 8
+
+
+def test_pop_changed_reports_every_touched_id_once():
+    registry = SubscriptionRegistry([subscription("192.168.1.10", port) for port in range(8000, 8003)])
+    assert registry.pop_changed() == [0, 1, 2]
+    registry.move(2, "10.0.0.2", "gpu2")
+    registry.remove(0)
+    registry.move(2, "10.0.0.1", "gpu1")
+    assert registry.pop_changed() == [0, 2]
+    assert registry.pop_changed() == []
@@ -0,0 +1,144 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from port_allocator import PortAllocator, pod_name
+
+SERVICE_SPEC_LIST = [
+    {"serviceType": "pose", "gpuMemoryRequest": 2, "frequencyLimit": [10, 5], "workAbility": {"gpu1": 60, "gpu2": 60}, "warmPool": 1},
+    {"serviceType": "object", "gpuMemoryRequest": 2, "frequencyLimit": [8, 4], "workAbility": {"gpu1": 32, "gpu2": 32}},
+]
+
+
+class Cluster:
+    """Fake Kubernetes API and watch cache: the Pods the warm pool creates, lists and deletes."""
+
+    def __init__(self, label):
+        self.label = label
+        self.pod_dict = {}
+        self.deleted_list = []
+
+    def add_pod(self, name, serviceType, ready=True):
+        self.pod_dict[name] = {
+            "name": name, "serviceType": serviceType, "ready": ready, "terminating": False,
+            "podIP": f"10.0.0.{len(self.pod_dict) + 1}", "hostIP": "192.168.0.1",
+        }
+
+    # kube_cache
+    def pods(self):
+        return list(self.pod_dict.values())
+
+    def node(self, nodeName):
+        return {"labels": {self.label: "24"}, "ip": None}
+
+    # kube_client
+    def core_api(self):
+        return None
+
+    # kube_utils
+    async def deploy_pod(self, serviceType, hostPort, nodeName):
+        name = pod_name(serviceType, nodeName, hostPort)
+        self.add_pod(name, serviceType)
+        return SimpleNamespace(metadata=SimpleNamespace(name=name))
+
+    async def wait_for_pod_ready(self, podName, timeout=None):
+        pod = self.pod_dict[podName]
+        return SimpleNamespace(status=SimpleNamespace(pod_ip=pod["podIP"], host_ip=pod["hostIP"]))
+
+    def delete_pod(self, podName, namespace="default"):
+        self.deleted_list.append(podName)
+        del self.pod_dict[podName]
+
+
+@pytest.fixture
+def WarmPool(controller_module):
+    return controller_module("warm_pool").WarmPool
+
+
+@pytest.fixture
+def service_manager(controller_module, WarmPool, monkeypatch, tmp_path):
+    service_manager = controller_module("service_manager")
+    state = controller_module("state")
+    cluster_state = state.ClusterState(
+        str(tmp_path / "service.json"), str(tmp_path / "serviceSpec.json"), str(tmp_path / "subscription.json"),
+        str(tmp_path / "nodestatus.json"), str(tmp_path / "state.journal"), str(tmp_path / "state.snapshot.json"),
+    )
+    cluster_state.serviceSpec_list = SERVICE_SPEC_LIST
+    cluster_state.serviceSpec_dict = {serviceSpec["serviceType"]: serviceSpec for serviceSpec in SERVICE_SPEC_LIST}
+    cluster_state.node_health_status = {"gpu1": "healthy", "gpu2": "healthy"}
+    cluster = Cluster(service_manager.GPU_MEMORY_LABEL)
+    monkeypatch.setattr(service_manager, "cluster_state", cluster_state)
+    monkeypatch.setattr(service_manager, "warm_pool", WarmPool())
+    monkeypatch.setattr(service_manager, "port_allocator", PortAllocator(30500, 30510))
+    monkeypatch.setattr(service_manager, "demand_forecaster", controller_module("forecaster").DemandForecaster(10, 0.5, 0.3, 3))
+    monkeypatch.setattr(service_manager, "kube_cache", cluster)
+    monkeypatch.setattr(service_manager, "kube_client", cluster)
+    monkeypatch.setattr(service_manager, "deploy_pod", cluster.deploy_pod)
+    monkeypatch.setattr(service_manager, "wait_for_pod_ready", cluster.wait_for_pod_ready)
+    monkeypatch.setattr(service_manager, "delete_pod", cluster.delete_pod)
+    service_manager.cluster = cluster
+    return service_manager
+
+
+def test_take_only_returns_a_ready_standby(WarmPool):
+    warm_pool = WarmPool()
+    standby = warm_pool.add_pending("pose", "gpu1", 30500)
+    assert warm_pool.take("pose", "gpu1") is None and warm_pool.count("pose") == 1
+
+    warm_pool.mark_ready("pose-gpu1-30500", "10.0.0.1", "192.168.0.1")
+    assert warm_pool.take("pose", "gpu1") is standby
+    assert warm_pool.count("pose") == 0 and warm_pool.standbys() == []
+    assert warm_pool.metrics()["promoted"] == 1
+
+    warm_pool.put_back(standby)
+    assert warm_pool.is_ready("pose", "gpu1") and warm_pool.metrics()["promoted"] == 0
+
+
+def test_removed_standby_is_not_marked_ready(WarmPool):
+    warm_pool = WarmPool()
+    warm_pool.add_pending("pose", "gpu1", 30500)
+    assert warm_pool.remove("pose-gpu1-30500", failed=True)["nodeName"] == "gpu1"
+    # the node failed while the Pod was starting
+    assert warm_pool.mark_ready("pose-gpu1-30500", "10.0.0.1", "192.168.0.1") is None
+    assert warm_pool.metrics()["failed"] == 1 and warm_pool.metrics()["created"] == 0
+
+
+def test_refill_starts_the_missing_standbys(service_manager):
+    asyncio.run(service_manager.refill_warm_pool())
+
+    warm_pool = service_manager.warm_pool
+    assert warm_pool.count("pose") == 1 and warm_pool.count("object") == 0
+    standby = warm_pool.of_service_type("pose")[0]
+    assert standby["ready"] and list(service_manager.cluster.pod_dict) == [standby["podName"]]
+    assert service_manager.port_allocator.metrics()["allocated"] == 1
+
+    # the pool is full, nothing else is started
+    asyncio.run(service_manager.refill_warm_pool())
+    assert len(service_manager.cluster.pod_dict) == 1
+
+
+def test_adopt_keeps_the_target_and_deletes_the_orphans(service_manager):
+    cluster = service_manager.cluster
+    service_manager.cluster_state.service_list = [{
+        "podIP": "None", "hostPort": 30500, "serviceType": "pose", "currentConnection": 0, "nodeName": "gpu1",
+        "hostIP": "192.168.0.1", "frequencyLimit": [10, 5], "currentFrequency": 10, "workloadLimit": 60.0,
+    }]
+    # the service Pod, not Ready yet when it was added to the service list
+    cluster.add_pod("pose-gpu1-30500", "pose")
+    # on the node of the service, it can never be promoted
+    cluster.add_pod("pose-gpu1-30501", "pose")
+    cluster.add_pod("pose-gpu2-30500", "pose")
+    # above the warmPool of pose
+    cluster.add_pod("pose-gpu2-30502", "pose")
+    # warmPool 0
+    cluster.add_pod("object-gpu2-30501", "object")
+    # not Ready, left alone
+    cluster.add_pod("object-gpu1-30502", "object", ready=False)
+    service_manager.reserve_used_ports()
+    asyncio.run(service_manager.adopt_standby_pods())
+
+    warm_pool = service_manager.warm_pool
+    assert [standby["podName"] for standby in warm_pool.standbys()] == ["pose-gpu2-30500"]
+    assert sorted(cluster.deleted_list) == ["object-gpu2-30501", "pose-gpu1-30501", "pose-gpu2-30502"]
+    assert sorted(cluster.pod_dict) == ["object-gpu1-30502", "pose-gpu1-30500", "pose-gpu2-30500"]
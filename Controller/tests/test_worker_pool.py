@@ -0,0 +1,61 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def WorkerPool(controller_module):
+    return controller_module("worker_pool").WorkerPool
+
+
+def test_blocking_call_runs_off_the_event_loop(WorkerPool):
+    worker_pool = WorkerPool(max_workers=2)
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        thread = await worker_pool.run(lambda: (time.sleep(0.2), threading.current_thread())[1])
+        ticker.cancel()
+        return thread, ticks
+
+    try:
+        thread, ticks = asyncio.run(run())
+    finally:
+        worker_pool.shutdown()
+    assert thread is not threading.main_thread()
+    # the loop kept running while the call was blocked
+    assert ticks >= 5
+    metrics = worker_pool.metrics()
+    assert metrics["completed"] == 1 and metrics["inFlight"] == 0 and metrics["maxSeconds"] >= 0.2
+
+
+def test_calls_run_concurrently_and_failures_are_counted(WorkerPool):
+    worker_pool = WorkerPool(max_workers=4)
+
+    def fail():
+        raise ValueError("no such node")
+
+    async def run():
+        start = time.perf_counter()
+        await asyncio.gather(*(worker_pool.run(time.sleep, 0.1) for _ in range(4)))
+        seconds = time.perf_counter() - start
+        with pytest.raises(ValueError):
+            await worker_pool.run(fail)
+        return seconds
+
+    try:
+        seconds = asyncio.run(run())
+    finally:
+        worker_pool.shutdown()
+    assert seconds < 0.3
+    metrics = worker_pool.metrics()
+    assert metrics["maxInFlight"] == 4 and metrics["completed"] == 4 and metrics["failed"] == 1
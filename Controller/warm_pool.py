@@ -0,0 +1,130 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from .port_allocator import pod_name
+
+
+class WarmPool:
+    """
+    Standby pods: service pods that are created but not in service.json, so
+    no agent is paired with them. deploy_service() promotes a ready standby
+    instead of creating a pod and waiting for the model to load.
+
+    There is at most one standby per (serviceType, nodeName), the same rule
+    deploy_service() applies to the services. A standby is pending until its
+    pod is Ready. Only used from the event loop, so there is no locking.
+    """
+
+    def __init__(self):
+        self._standby: Dict[str, Dict[str, dict]] = {}
+        self._by_podName: Dict[str, dict] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stats = {
+            "created": 0,
+            "promoted": 0,
+            "failed": 0,
+            "discarded": 0,
+        }
+
+    def add_pending(self, serviceType: str, nodeName: str, hostPort: int) -> dict:
+        standby = {
+            "podName": pod_name(serviceType, nodeName, hostPort),
+            "serviceType": serviceType,
+            "nodeName": nodeName,
+            "hostPort": hostPort,
+            "podIP": None,
+            "hostIP": None,
+            "ready": False,
+        }
+        self._standby.setdefault(serviceType, {})[nodeName] = standby
+        self._by_podName[standby["podName"]] = standby
+        return standby
+
+    def mark_ready(self, podName: str, podIP: str, hostIP: str) -> Optional[dict]:
+        """Returns None if the standby was removed while its pod was starting."""
+        standby = self._by_podName.get(podName)
+        if standby is None:
+            return None
+        standby.update(podIP=podIP, hostIP=hostIP, ready=True)
+        self._stats["created"] += 1
+        return standby
+
+    def _pop(self, podName: str) -> Optional[dict]:
+        standby = self._by_podName.pop(podName, None)
+        if standby is None:
+            return None
+        node_dict = self._standby[standby["serviceType"]]
+        del node_dict[standby["nodeName"]]
+        if not node_dict:
+            del self._standby[standby["serviceType"]]
+        return standby
+
+    def remove(self, podName: str, failed: bool = False) -> Optional[dict]:
+        standby = self._pop(podName)
+        if standby is not None:
+            self._stats["failed" if failed else "discarded"] += 1
+        return standby
+
+    def take(self, serviceType: str, nodeName: str) -> Optional[dict]:
+        """Remove the ready standby of serviceType on nodeName and return it."""
+        standby = self.get(serviceType, nodeName)
+        if standby is None or not standby["ready"]:
+            return None
+        self._pop(standby["podName"])
+        self._stats["promoted"] += 1
+        self.wakeup()
+        return standby
+
+    def put_back(self, standby: dict):
+        """Undo take() of a standby that was not promoted after all."""
+        self._standby.setdefault(standby["serviceType"], {})[standby["nodeName"]] = standby
+        self._by_podName[standby["podName"]] = standby
+        self._stats["promoted"] -= 1
+
+    def get(self, serviceType: str, nodeName: str) -> Optional[dict]:
+        return self._standby.get(serviceType, {}).get(nodeName)
+
+    def is_ready(self, serviceType: str, nodeName: str) -> bool:
+        standby = self.get(serviceType, nodeName)
+        return standby is not None and standby["ready"]
+
+    def count(self, serviceType: str) -> int:
+        """Ready and pending standbys of serviceType."""
+        return len(self._standby.get(serviceType, ()))
+
+    def of_service_type(self, serviceType: str) -> List[dict]:
+        return list(self._standby.get(serviceType, {}).values())
+
+    def standbys(self) -> List[dict]:
+        return list(self._by_podName.values())
+
+    def on_node(self, nodeName: str) -> List[dict]:
+        return [standby for standby in self._by_podName.values() if standby["nodeName"] == nodeName]
+
+    def wakeup(self):
+        """Ask the refiller to top the pool up."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def wait(self, timeout: float):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    def metrics(self) -> dict:
+        metrics = dict(self._stats)
+        metrics["standby"] = {
+            serviceType: {
+                nodeName: "ready" if standby["ready"] else "pending"
+                for nodeName, standby in node_dict.items()
+            }
+            for serviceType, node_dict in self._standby.items()
+        }
+        return metrics
+
+
+warm_pool = WarmPool()
@@ -0,0 +1,60 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from .config import BLOCKING_WORKERS
+
+
+class WorkerPool:
+    """
+    Thread pool for the blocking work of the Controller (Kubernetes API,
+    health checks, file I/O). The request handlers await run() so the event
+    loop keeps serving other requests while the call is in progress.
+    """
+
+    def __init__(self, max_workers: int = BLOCKING_WORKERS):
+        self._max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats = {
+            "inFlight": 0,
+            "maxInFlight": 0,
+            "completed": 0,
+            "failed": 0,
+            "totalSeconds": 0.0,
+            "maxSeconds": 0.0,
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='controller-worker')
+        return self._executor
+
+    async def run(self, func: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        self._stats["inFlight"] += 1
+        self._stats["maxInFlight"] = max(self._stats["maxInFlight"], self._stats["inFlight"])
+        start = loop.time()
+        try:
+            result = await loop.run_in_executor(self._get_executor(), functools.partial(func, *args, **kwargs))
+            self._stats["completed"] += 1
+            return result
+        except BaseException:
+            self._stats["failed"] += 1
+            raise
+        finally:
+            seconds = loop.time() - start
+            self._stats["inFlight"] -= 1
+            self._stats["totalSeconds"] += seconds
+            self._stats["maxSeconds"] = max(self._stats["maxSeconds"], seconds)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def metrics(self) -> dict:
+        return dict(self._stats)
+
+
+worker_pool = WorkerPool()